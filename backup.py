@@ -0,0 +1,304 @@
+"""
+Онлайн-бэкапы bot_data.db без остановки бота.
+
+Снимок делается через sqlite3 backup API по BACKUP_STEP_PAGES страниц за
+шаг с паузой BACKUP_STEP_PAUSE между шагами, в отдельном потоке — event
+loop бота не блокируется ни на одном шаге. Всё копирование идёт внутри
+одной читающей транзакции исходного соединения: в WAL она не мешает
+записям, снимок согласован на момент её начала, а записи бота не
+перезапускают копирование с начала (без неё backup API начинает заново
+после каждой записи из другого соединения и на живой базе может не
+закончиться никогда).
+
+Снимок пишется во временный файл, по желанию сжимается gzip (тоже
+порциями с паузой) и переименовывается в ``<база>-<UTC-время>.db[.gz]``; хранятся последние
+BACKUP_KEEP снимков. Из консоли:
+
+    python backup.py now
+    python backup.py list
+    python backup.py restore backups/bot_data-20260101-120000.db.gz
+
+Восстановление — при остановленном боте: снимок проверяется
+integrity_check и копируется в базу тем же backup API (с -wal и -shm
+ничего делать не нужно). Текущая база перед этим сохраняется снимком
+``<база>-before-restore-<время>``.
+"""
+
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from config import (
+    BACKUP_COMPRESS, BACKUP_DIR, BACKUP_INTERVAL, BACKUP_KEEP, BACKUP_STEP_PAGES,
+    BACKUP_STEP_PAUSE,
+)
+
+logger = logging.getLogger(__name__)
+
+# gzip тоже идёт порциями с паузой: на одном ядре сжатие целиком отнимает
+# процессор у хендлеров. Уровень 1 в разы быстрее 6 и почти не уступает на страницах SQLite
+GZIP_CHUNK = 256 << 10
+GZIP_LEVEL = 1
+# Метка снимка, который restore делает перед восстановлением; ротация его не трогает
+RESTORE_LABEL = "before-restore"
+
+
+class BackupAborted(Exception):
+    pass
+
+
+def backups_dir(db_path: str) -> str:
+    """BACKUP_DIR; относительный путь считается от каталога базы."""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), BACKUP_DIR)
+
+
+def _stem(db_path: str) -> str:
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+
+def list_backups(db_path: str, directory: str = None):
+    """Снимки базы, новые первыми."""
+    directory = directory or backups_dir(db_path)
+    if not os.path.isdir(directory):
+        return []
+    prefix = _stem(db_path) + "-"
+    names = [
+        name for name in os.listdir(directory)
+        if name.startswith(prefix) and name.endswith((".db", ".db.gz"))
+    ]
+    # В имени время UTC, поэтому порядок имён — порядок снимков
+    return [os.path.join(directory, name) for name in sorted(names, reverse=True)]
+
+
+def snapshot(db_path: str, path: str, pages: int = BACKUP_STEP_PAGES,
+             pause: float = BACKUP_STEP_PAUSE, progress=None, should_stop=None) -> int:
+    """Копирует живую базу в ``path`` по шагам. Возвращает число страниц."""
+    source = sqlite3.connect(db_path, isolation_level=None)
+    target = sqlite3.connect(path, isolation_level=None)
+    copied = [0]
+
+    def step(status, remaining, total):
+        copied[0] = total - remaining
+        if progress:
+            progress(total - remaining, total)
+        if should_stop and should_stop():
+            raise BackupAborted("backup aborted")
+        if pause:
+            time.sleep(pause)
+
+    try:
+        source.execute("PRAGMA busy_timeout=5000")
+        # Одна читающая транзакция на всё копирование — см. описание модуля
+        source.execute("BEGIN")
+        source.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        source.backup(target, pages=pages, progress=step)
+        source.execute("COMMIT")
+        # Снимок — один самодостаточный файл, без -wal
+        target.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+        source.close()
+    return copied[0]
+
+
+def _gzip(source_path: str, target_path: str, pause: float = 0.0, should_stop=None):
+    with open(source_path, "rb") as src, \
+            gzip.open(target_path, "wb", compresslevel=GZIP_LEVEL) as dst:
+        while True:
+            chunk = src.read(GZIP_CHUNK)
+            if not chunk:
+                break
+            dst.write(chunk)
+            if should_stop and should_stop():
+                raise BackupAborted("backup aborted")
+            if pause:
+                time.sleep(pause)
+
+
+def _gunzip(source_path: str, target_path: str):
+    with gzip.open(source_path, "rb") as src, open(target_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, GZIP_CHUNK)
+
+
+def make_backup(db_path: str, directory: str = None, compress: bool = BACKUP_COMPRESS,
+                keep: int = BACKUP_KEEP, label: str = "", **snapshot_kwargs) -> str:
+    """Снимок базы в каталог бэкапов с ротацией. Возвращает путь к файлу."""
+    directory = directory or backups_dir(db_path)
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    name = f"{_stem(db_path)}-{label + '-' if label else ''}{stamp}.db"
+    path = os.path.join(directory, name + (".gz" if compress else ""))
+
+    # Во временные файлы, затем rename: незаконченный снимок не попадёт в список
+    tmp_db = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+    try:
+        snapshot(db_path, tmp_db, **snapshot_kwargs)
+        if compress:
+            tmp_gz = tmp_db + ".gz"
+            try:
+                _gzip(tmp_db, tmp_gz, snapshot_kwargs.get("pause", BACKUP_STEP_PAUSE),
+                      snapshot_kwargs.get("should_stop"))
+                os.replace(tmp_gz, path)
+            finally:
+                if os.path.exists(tmp_gz):
+                    os.remove(tmp_gz)
+        else:
+            os.replace(tmp_db, path)
+    finally:
+        if os.path.exists(tmp_db):
+            os.remove(tmp_db)
+
+    if keep and not label:
+        regular = [p for p in list_backups(db_path, directory)
+                   if f"-{RESTORE_LABEL}-" not in os.path.basename(p)]
+        for old in regular[keep:]:
+            os.remove(old)
+    return path
+
+
+def restore(snapshot_path: str, db_path: str, pages: int = BACKUP_STEP_PAGES) -> str:
+    """Восстанавливает базу из снимка. Возвращает путь снимка текущей базы."""
+    with tempfile.TemporaryDirectory() as tmp:
+        source_path = snapshot_path
+        if snapshot_path.endswith(".gz"):
+            source_path = os.path.join(tmp, "restore.db")
+            _gunzip(snapshot_path, source_path)
+
+        source = sqlite3.connect(source_path, isolation_level=None)
+        try:
+            result = source.execute("PRAGMA integrity_check").fetchone()[0]
+            if result != "ok":
+                raise ValueError(f"Snapshot {snapshot_path} is damaged: {result}")
+            previous = None
+            if os.path.exists(db_path):
+                previous = make_backup(db_path, label=RESTORE_LABEL, pause=0)
+            target = sqlite3.connect(db_path, isolation_level=None)
+            try:
+                source.backup(target, pages=pages)
+            finally:
+                target.close()
+        finally:
+            source.close()
+    return previous
+
+
+class BackupManager:
+    """Периодические снимки из бота и их прогресс для /stats."""
+
+    def __init__(self, db_path: str, interval: float = BACKUP_INTERVAL, **backup_kwargs):
+        self.db_path = db_path
+        self.interval = interval
+        self.backup_kwargs = backup_kwargs
+        self.running = False
+        self.copied = 0
+        self.total = 0
+        self.last = None
+        self.last_error = None
+        self._stopping = threading.Event()
+        self._task = None
+        self._current = None
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            # Первый снимок — через interval, чтобы не замедлять старт
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.backup()
+            except BackupAborted:
+                return
+            except Exception:
+                logger.exception("Scheduled backup failed")
+
+    def _progress(self, copied: int, total: int):
+        self.copied, self.total = copied, total
+
+    async def backup(self) -> str:
+        if self.running:
+            raise RuntimeError("Backup is already running")
+        self.running = True
+        self.copied = self.total = 0
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        self._current = loop.run_in_executor(
+            None, lambda: make_backup(
+                self.db_path, progress=self._progress,
+                should_stop=self._stopping.is_set, **self.backup_kwargs
+            )
+        )
+        try:
+            path = await self._current
+        except Exception as e:
+            self.last_error = str(e)
+            raise
+        finally:
+            self.running = False
+            self._current = None
+        self.last = {
+            "path": path,
+            "size": os.path.getsize(path),
+            "seconds": time.monotonic() - started,
+            "finished_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self.last_error = None
+        logger.info("Backup %s done in %.1f s (%d bytes)", path, self.last["seconds"],
+                    self.last["size"])
+        return path
+
+    async def stop(self):
+        """Прерывает идущий снимок на ближайшем шаге и останавливает расписание."""
+        self._stopping.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._current:
+            try:
+                await self._current
+            except Exception:
+                pass
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "progress": self.copied / self.total if self.total else 0.0,
+            "last": self.last,
+            "last_error": self.last_error,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Онлайн-бэкапы bot_data.db")
+    parser.add_argument("command", choices=("now", "list", "restore"))
+    parser.add_argument("snapshot", nargs="?", help="файл снимка для restore")
+    parser.add_argument("--db", default="bot_data.db")
+    args = parser.parse_args()
+
+    if args.command == "now":
+        started = time.monotonic()
+        path = make_backup(args.db)
+        print(f"✅ {path} ({os.path.getsize(path)} байт, {time.monotonic() - started:.1f} с)")
+    elif args.command == "list":
+        for path in list_backups(args.db):
+            print(f"{path}  {os.path.getsize(path)} байт")
+    else:
+        if not args.snapshot:
+            parser.error("restore: укажите файл снимка")
+        previous = restore(args.snapshot, args.db)
+        print(f"✅ {args.db} восстановлена из {args.snapshot}")
+        if previous:
+            print(f"Прежняя база сохранена в {previous}")
+
+
+if __name__ == "__main__":
+    main()
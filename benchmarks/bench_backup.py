@@ -0,0 +1,136 @@
+"""
+Цена онлайн-бэкапов для живых хендлеров.
+
+Два прогона сценария bench_handlers (/start → ... → оплата → пожелание)
+с открытой нагрузкой — --rate новых пользователей в секунду — на одной
+базе с --db-users пользователями: без бэкапов и с BackupManager, который
+снимает базу без перерыва всё время прогона. Печатает p50/p95/p99
+обработки апдейта, пропускную способность и число и длительность снимков.
+
+    python benchmarks/bench_backup.py --users 1000 --rate 100 --db-users 200000
+    python benchmarks/bench_backup.py --pages 1024 --pause 0
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+from backup import BackupManager  # noqa: E402
+from benchmarks.bench_handlers import FIRST_USER_ID, seed_database, user_script  # noqa: E402
+from benchmarks.fake_telegram import FakeTelegram, StubRequest  # noqa: E402
+from bot import build_application  # noqa: E402
+from database import Database  # noqa: E402
+from screens import PLANS  # noqa: E402
+
+
+async def run_load(application, first_user: int, users: int, rate: float, seed: int):
+    """Пользователи приходят по ``rate`` в секунду; возвращает (латентности апдейтов, секунды).
+
+    Нагрузка открытая, а не «все сразу», чтобы латентность показывала время
+    обработки, а не ожидание в очереди.
+    """
+    rng = random.Random(seed)
+    scripts = [user_script(first_user + i, rng) for i in range(users)]
+    latencies = []
+
+    async def feed(index, script):
+        await asyncio.sleep(index / rate)
+        for data in script:
+            started = time.perf_counter()
+            await application.process_update(Update.de_json(data, application.bot))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(index, script) for index, script in enumerate(scripts)))
+    return sorted(latencies), time.perf_counter() - started
+
+
+async def backup_loop(manager: BackupManager, done: asyncio.Event, durations: list):
+    while not done.is_set():
+        started = time.perf_counter()
+        await manager.backup()
+        durations.append(time.perf_counter() - started)
+
+
+def report(title: str, latencies, seconds: float):
+    n = len(latencies)
+    print(f"{title:16} {n / seconds:7.0f} upd/s  "
+          f"p50 {latencies[n // 2] * 1000:6.2f} ms  "
+          f"p95 {latencies[int(n * 0.95)] * 1000:6.2f} ms  "
+          f"p99 {latencies[int(n * 0.99)] * 1000:6.2f} ms")
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        db = Database(db_path)
+        seed_database(db, args.db_users, args.seed)
+        fake = FakeTelegram()
+        builder = (
+            Application.builder()
+            .token("1:BENCH")
+            .request(StubRequest(fake))
+            .get_updates_request(StubRequest(fake))
+        )
+        application = build_application(db, builder=builder)
+        manager = BackupManager(
+            db_path, interval=0, directory=os.path.join(tmp, "backups"), keep=2,
+            compress=args.compress, pages=args.pages, pause=args.pause,
+        )
+
+        async with application:
+            await application.start()
+            baseline = await run_load(application, FIRST_USER_ID, args.users, args.rate, args.seed)
+            print(f"db: {os.path.getsize(db_path) / 2**20:.1f} MB, "
+                  f"{args.pages} pages/step, pause {args.pause * 1000:g} ms, "
+                  f"gzip {'on' if args.compress else 'off'}")
+            report("no backup", *baseline)
+
+            done = asyncio.Event()
+            durations = []
+            backups = asyncio.create_task(backup_loop(manager, done, durations))
+            with_backup = await run_load(
+                application, FIRST_USER_ID + args.users, args.users, args.rate, args.seed + 1
+            )
+            done.set()
+            await backups
+            report("with backups", *with_backup)
+            if durations:
+                print(f"backups: {len(durations)}, "
+                      f"{sum(durations) / len(durations):.2f} s each, "
+                      f"last {manager.last['size'] / 2**20:.1f} MB")
+            await application.stop()
+            await application.post_stop(application)
+        await application.post_shutdown(application)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=100, help="новых пользователей в секунду")
+    parser.add_argument("--db-users", type=int, default=200_000)
+    parser.add_argument("--pages", type=int, default=256, help="страниц за шаг")
+    parser.add_argument("--pause", type=float, default=0.005, help="пауза между шагами, с")
+    parser.add_argument("--no-compress", dest="compress", action="store_false")
+    parser.add_argument("--seed", type=int, default=2026)
+    args = parser.parse_args()
+
+    logging.disable(logging.ERROR)
+    # Сертификаты рендерятся в других процессах и только зашумляют замер
+    for plan in PLANS.values():
+        plan["certificate"] = False
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
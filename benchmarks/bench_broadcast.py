@@ -0,0 +1,90 @@
+"""
+Рассылка на локальном фейковом Bot API.
+
+Фейковый сервер отвечает 429, если бот превышает --api-limit сообщений
+в секунду, и 403 для доли «заблокировавших» пользователей. С
+--interrupt-after рассылка прерывается и продолжается с сохранённого
+места, как после перезапуска бота.
+
+    python benchmarks/bench_broadcast.py --users 2000 --rate 40 --api-limit 30
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from telegram import Bot  # noqa: E402
+
+from benchmarks.fake_telegram import FakeTelegram  # noqa: E402
+from broadcast import Broadcaster  # noqa: E402
+from database import AsyncDatabase, Database  # noqa: E402
+
+ADMIN_ID = 1
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        first_id = 1000
+        user_ids = range(first_id, first_id + args.users)
+        for user_id in user_ids:
+            db.add_user(user_id, f"user{user_id}")
+        adb = AsyncDatabase(db)
+
+        async with FakeTelegram(rate_limit=args.api_limit, retry_after=1) as fake:
+            fake.blocked_chats = set(user_ids[:: max(1, int(1 / args.blocked))]) if args.blocked else set()
+            async with Bot("1:BENCH", base_url=fake.base_url) as bot:
+                broadcaster = Broadcaster(adb, rate=args.rate, page_size=args.page_size)
+                started = time.perf_counter()
+                broadcast_id = await broadcaster.start(bot, ADMIN_ID, "Розыгрыш уже завтра! ⚽")
+
+                if args.interrupt_after:
+                    await asyncio.sleep(args.interrupt_after)
+                    await broadcaster.stop_all(resume_later=True)
+                    saved = await adb.get_broadcast(broadcast_id)
+                    print(f"interrupted: saved progress after user {saved['last_user_id']}, "
+                          f"sent {saved['sent']}")
+                    broadcaster = Broadcaster(adb, rate=args.rate, page_size=args.page_size)
+                    await broadcaster.resume(bot)
+
+                while broadcaster.is_running(broadcast_id):
+                    await asyncio.sleep(0.05)
+                elapsed = time.perf_counter() - started
+
+        result = await adb.get_broadcast(broadcast_id)
+        await adb.close()
+
+    delivered = {int(params["chat_id"]) for method, params in fake.calls
+                 if method == "sendMessage" and int(params["chat_id"]) != ADMIN_ID}
+    missing = set(user_ids) - delivered - fake.blocked_chats
+    total = result["sent"] + result["failed"] + result["blocked"]
+    print(
+        f"status={result['status']} sent={result['sent']} blocked={result['blocked']} "
+        f"failed={result['failed']}\n"
+        f"{total} recipients in {elapsed:.1f} s = {total / elapsed:.1f} msg/s, "
+        f"429 responses: {fake.flood_errors}, missing: {len(missing)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=25, help="стартовая скорость бота, сообщ./с")
+    parser.add_argument("--api-limit", type=float, default=30, help="лимит фейкового API, сообщ./с")
+    parser.add_argument("--blocked", type=float, default=0.05, help="доля заблокировавших бота")
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--interrupt-after", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
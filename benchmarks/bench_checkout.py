@@ -0,0 +1,152 @@
+"""
+Бенчмарк проверки оплат на pre_checkout_query (checkout.CheckoutGuard).
+
+1. Время одного решения ``reserve`` на счётчиках в памяти (p50/p99/max).
+2. Через настоящий Application из bot.py: --users пользователей одновременно
+   пытаются купить PLATINUM при --slots местах и лимите одна покупка на
+   пользователя. Проверяется, что ok=True получили ровно --slots из них, после
+   оплаты места проданы, а повторные попытки отклонены.
+
+    python benchmarks/bench_checkout.py --users 5000 --slots 100
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+PLAN_ID = "plan_1000"
+
+
+def percentile(values, q: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def bench_guard(db, users: int, slots: int):
+    from checkout import CheckoutGuard
+    from database import AsyncDatabase
+    from screens import PLANS
+
+    plan = PLANS[PLAN_ID]
+    guard = CheckoutGuard(AsyncDatabase(db), slots={PLAN_ID: slots}, max_per_user=1)
+    await guard.load()
+    samples = []
+    results = Counter()
+    for user_id in range(1, users + 1):
+        started = time.perf_counter()
+        reason = guard.reserve(str(user_id), user_id, plan["payload"], plan["stars"])
+        samples.append(time.perf_counter() - started)
+        results[reason or "ok"] += 1
+        if reason is None and user_id % 2:
+            guard.confirm(user_id, PLAN_ID)
+    samples.sort()
+    print(f"reserve: {users} calls, p50 {percentile(samples, 0.5) * 1e6:.1f} µs, "
+          f"p99 {percentile(samples, 0.99) * 1e6:.1f} µs, max {samples[-1] * 1e6:.1f} µs")
+    print(f"         {dict(results)}")
+
+
+async def bench_application(db, users: int, slots: int, concurrency: int):
+    from telegram import Update
+    from telegram.ext import Application
+
+    from benchmarks.fake_telegram import (
+        FakeTelegram, StubRequest, pre_checkout_update, successful_payment_update,
+    )
+    from bot import build_application
+    from screens import PLANS
+
+    plan = PLANS[PLAN_ID]
+    fake = FakeTelegram()
+    builder = (
+        Application.builder()
+        .token("1:BENCH")
+        .request(StubRequest(fake))
+        .get_updates_request(StubRequest(fake))
+    )
+    application = build_application(db, builder=builder, concurrency=concurrency)
+
+    def answers():
+        calls = [params for method, params in fake.calls if method == "answerPreCheckoutQuery"]
+        fake.calls.clear()
+        return calls
+
+    async def process(updates):
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            application.process_update(Update.de_json(data, application.bot))
+            for data in updates
+        ))
+        return time.perf_counter() - started
+
+    def pre_checkouts(per_user: int = 1):
+        return [pre_checkout_update(user_id, plan["payload"], plan["stars"])
+                for user_id in range(1, users + 1) for _ in range(per_user)]
+
+    async with application:
+        await application.post_init(application)
+        await application.start()
+        # Каждый пытается купить дважды — вторую попытку отсекает лимит на пользователя
+        updates = pre_checkouts(per_user=2)
+        owners = {data["pre_checkout_query"]["id"]: data["pre_checkout_query"]["from"]["id"]
+                  for data in updates}
+        elapsed = await process(updates)
+        approved = [owners[params["pre_checkout_query_id"]] for params in answers()
+                    if params["ok"]]
+        print(f"pre-checkout: {len(updates)} concurrent in {elapsed * 1000:.0f} ms, "
+              f"approved {len(approved)} for {slots} slots")
+
+        await process([successful_payment_update(user_id, plan["payload"], plan["stars"])
+                       for user_id in approved])
+        fake.calls.clear()
+
+        elapsed = await process(pre_checkouts())
+        rejected = Counter(params.get("error_message") for params in answers() if not params["ok"])
+        print(f"after sell-out: {users} in {elapsed * 1000:.0f} ms, "
+              f"rejected {sum(rejected.values())}")
+        sold, _, _ = db.get_checkout_counts([PLAN_ID], [])
+        await application.stop()
+        await application.post_stop(application)
+    await application.post_shutdown(application)
+
+    ok = (len(approved) == len(set(approved)) == slots == sold[PLAN_ID]
+          and sum(rejected.values()) == users)
+    print(f"sold {sold[PLAN_ID]} of {slots}: {'OK' if ok else 'MISMATCH'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--slots", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    import logging
+
+    logging.disable(logging.INFO)
+    os.environ["MAX_PURCHASES_PER_USER"] = "1"
+    os.environ["PLATINUM_SLOTS"] = str(args.slots)
+    from database import Database
+    from screens import PLANS
+
+    # Рендер сертификатов к проверке оплат не относится
+    PLANS[PLAN_ID]["certificate"] = False
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "guard.db"))
+        asyncio.run(bench_guard(db, args.users, args.slots))
+        db.close()
+        # Эту Database закрывает сам Application при остановке
+        ok = asyncio.run(bench_application(
+            Database(os.path.join(tmp, "bench.db")), args.users, args.slots, args.concurrency
+        ))
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Нагрузочный прогон BotHandlers через настоящий Application из bot.py.
+
+Каждый синтетический пользователь проходит сценарий
+/start (часть — по реферальной ссылке) → «Мои билеты» → выбор плана →
+pre-checkout → оплата → пожелание. Апдейты идут через update_queue
+Application, ConversationHandler и PerUserUpdateProcessor; Bot API
+заменён транспортом StubRequest, который только записывает вызовы.
+
+Отчёт: пропускная способность и p50/p95/p99 по каждому хендлеру и
+каждому методу Database. С --json результат сохраняется в файл, а
+--compare печатает разницу с прошлым прогоном (например, с другого коммита).
+
+    python benchmarks/bench_handlers.py --users 2000 --db-users 100000
+    python benchmarks/bench_handlers.py --json after.json --compare before.json
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application, ConversationHandler  # noqa: E402
+
+from benchmarks.fake_telegram import (  # noqa: E402
+    FakeTelegram, StubRequest, callback_update, pre_checkout_update,
+    successful_payment_update, text_update,
+)
+from bot import PLANS, build_application  # noqa: E402
+from config import UPDATE_CONCURRENCY  # noqa: E402
+from database import Database  # noqa: E402
+from metrics import SKIP_DB_METHODS  # noqa: E402
+
+FIRST_USER_ID = 10_000_000
+
+
+class Timings:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.samples[name].append(seconds)
+
+    def summary(self, elapsed: float) -> dict:
+        result = {}
+        for name, values in sorted(self.samples.items()):
+            values = sorted(values)
+            n = len(values)
+            result[name] = {
+                "count": n,
+                "per_second": n / elapsed,
+                "p50_ms": values[n // 2] * 1000,
+                "p95_ms": values[min(n - 1, int(n * 0.95))] * 1000,
+                "p99_ms": values[min(n - 1, int(n * 0.99))] * 1000,
+            }
+        return result
+
+
+def instrument_handlers(application: Application, timings: Timings):
+    """Оборачивает callback каждого хендлера (включая вложенные в диалог)."""
+    def wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for inner in handler.entry_points + handler.fallbacks:
+                wrap(inner)
+            for handlers in handler.states.values():
+                for inner in handlers:
+                    wrap(inner)
+            return
+        callback = handler.callback
+        if getattr(callback, "_timed", False):
+            return
+
+        @functools.wraps(callback)
+        async def timed(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                timings.add(callback.__name__, time.perf_counter() - started)
+
+        timed._timed = True
+        handler.callback = timed
+
+    for group in application.handlers.values():
+        for handler in group:
+            wrap(handler)
+
+
+def instrument_database(db: Database, timings: Timings):
+    """Замеряет синхронное время каждого публичного метода Database."""
+    for name in dir(Database):
+        attr = getattr(db, name)
+        if name.startswith("_") or name in SKIP_DB_METHODS or not callable(attr):
+            continue
+
+        def make(method, method_name):
+            @functools.wraps(method)
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    timings.add(f"db.{method_name}", time.perf_counter() - started)
+            return timed
+
+        setattr(db, name, make(attr, name))
+
+
+def seed_database(db: Database, users: int, seed: int):
+    """Заполняет базу пользователями напрямую, минуя хендлеры."""
+    rng = random.Random(seed)
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, username, invites_req) VALUES (?, ?, ?)",
+            ((user_id, f"seed{user_id}", rng.choice((0, 0, 1, 2, 5)))
+             for user_id in range(1, users + 1)),
+        )
+        # Счётчики /stats заново по засеянным строкам
+        conn.execute("DELETE FROM counters")
+        db.seed_aggregates(conn)
+
+
+def user_script(user_id: int, rng: random.Random):
+    """Апдейты одного пользователя в порядке, в котором их шлёт Telegram."""
+    if user_id > FIRST_USER_ID and rng.random() < 0.3:
+        start = text_update(user_id, f"/start ref_{user_id - 1}")
+    else:
+        start = text_update(user_id, "/start")
+    plan_id = rng.choice(list(PLANS))
+    plan = PLANS[plan_id]
+    return [
+        start,
+        callback_update(user_id, "my_tickets"),
+        callback_update(user_id, f"buy_{plan_id}"),
+        pre_checkout_update(user_id, plan["payload"], plan["stars"]),
+        successful_payment_update(user_id, plan["payload"], plan["stars"]),
+        text_update(user_id, f"Удачи, Роналду! от {user_id}"),
+    ]
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    timings = Timings()
+    fake = FakeTelegram(latency=args.api_latency)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        seed_database(db, args.db_users, args.seed)
+        instrument_database(db, timings)
+
+        builder = (
+            Application.builder()
+            .token("1:BENCH")
+            .request(StubRequest(fake))
+            .get_updates_request(StubRequest(fake))
+        )
+        application = build_application(db, builder=builder, concurrency=args.concurrency)
+        instrument_handlers(application, timings)
+
+        scripts = [user_script(FIRST_USER_ID + i, rng) for i in range(args.users)]
+        async with application:
+            await application.start()
+            started = time.perf_counter()
+
+            async def feed(script):
+                # Следующий апдейт пользователя — только после обработки предыдущего,
+                # как при реальной переписке
+                for data in script:
+                    update = Update.de_json(data, application.bot)
+                    done = pending[update.update_id] = asyncio.Event()
+                    await application.update_queue.put(update)
+                    await done.wait()
+
+            pending = {}
+            original = application.process_update
+
+            async def process_update(update):
+                try:
+                    await original(update)
+                finally:
+                    event = pending.pop(getattr(update, "update_id", None), None)
+                    if event:
+                        event.set()
+
+            application.process_update = process_update
+            await asyncio.gather(*(feed(script) for script in scripts))
+            elapsed = time.perf_counter() - started
+            await application.stop()
+            await application.post_stop(application)
+        await application.post_shutdown(application)
+
+    updates = sum(len(script) for script in scripts)
+    return {
+        "commit": _git_commit(),
+        "params": {
+            "users": args.users, "concurrency": args.concurrency,
+            "db_users": args.db_users, "api_latency": args.api_latency, "seed": args.seed,
+        },
+        "updates": updates,
+        "seconds": elapsed,
+        "updates_per_second": updates / elapsed,
+        "api_calls": dict(fake.counts),
+        "timings": timings.summary(elapsed),
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def print_report(result: dict, baseline: dict = None):
+    print(
+        f"commit {result['commit']}  {result['updates']} updates in {result['seconds']:.2f} s "
+        f"= {result['updates_per_second']:.1f} upd/s  {result['params']}"
+    )
+    if baseline:
+        change = result["updates_per_second"] / baseline["updates_per_second"] - 1
+        print(f"vs {baseline['commit']}: {change:+.1%} throughput")
+        if baseline["params"] != result["params"]:
+            print(f"warning: baseline params differ: {baseline['params']}")
+    print(f"{'name':32} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, row in result["timings"].items():
+        line = (f"{name:32} {row['count']:7d} {row['p50_ms']:9.3f} "
+                f"{row['p95_ms']:9.3f} {row['p99_ms']:9.3f}")
+        old = baseline and baseline["timings"].get(name)
+        if old:
+            line += f"   p95 {row['p95_ms'] / old['p95_ms'] - 1:+7.1%}" if old["p95_ms"] else ""
+        print(line)
+    print(f"api calls: {result['api_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=UPDATE_CONCURRENCY,
+                        help="по умолчанию — как у бота (UPDATE_CONCURRENCY)")
+    parser.add_argument("--db-users", type=int, default=10_000, help="пользователей в базе заранее")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка Bot API, секунды")
+    parser.add_argument("--seed", type=int, default=2026)
+    parser.add_argument("--json", help="сохранить результат в файл")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    logging.disable(logging.ERROR)
+    result = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
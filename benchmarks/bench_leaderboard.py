@@ -0,0 +1,166 @@
+"""
+Бенчмарк рейтинга (leaderboard.Leaderboard) против запросов на каждое нажатие.
+
+На базе с --db-users пользователями (билеты как в bench_handlers, часть
+пользователей — с приглашёнными) сравнивается одно нажатие «🏆 Рейтинг»:
+первые места и место пользователя на обеих досках
+  * SQL без индекса — ORDER BY ... LIMIT и COUNT(*) полным проходом;
+  * SQL по индексам idx_users_tickets и idx_referral_stats_invites;
+  * в памяти — Leaderboard.top и Leaderboard.rank.
+Ещё печатаются время перестройки досок при старте и цена обновления после
+записи, а места --users случайных пользователей сверяются с SQL.
+
+    python benchmarks/bench_leaderboard.py --db-users 200000 --users 2000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from benchmarks.bench_handlers import seed_database  # noqa: E402
+from database import AsyncDatabase, Database  # noqa: E402
+from leaderboard import INVITES, TICKETS, Leaderboard  # noqa: E402
+
+# Доска -> (таблица, колонка очков)
+SOURCES = {TICKETS: ("users", "invites_req"), INVITES: ("referral_stats", "invites")}
+
+
+def seed_invites(db: Database, users: int, seed: int):
+    """Приглашённые у каждого третьего: много малых счетов и длинный хвост."""
+    rng = random.Random(seed)
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO referral_stats (user_id, invites) VALUES (?, ?)",
+            ((user_id, int(rng.paretovariate(1.5)))
+             for user_id in range(1, users + 1) if user_id % 3 == 0),
+        )
+
+
+def sql_tap(conn, size: int, scores: dict, indexed: bool):
+    """Одно нажатие запросами: первые места и место на каждой доске."""
+    result = {}
+    for board, (table, column) in SOURCES.items():
+        source = table if indexed else f"{table} NOT INDEXED"
+        top = conn.execute(
+            f"""SELECT user_id, {column} FROM {source}
+            WHERE {column} > 0 ORDER BY {column} DESC, user_id LIMIT ?""",
+            (size,),
+        ).fetchall()
+        higher = conn.execute(
+            f"SELECT COUNT(*) FROM {source} WHERE {column} > ?", (scores[board],)
+        ).fetchone()[0]
+        result[board] = ([tuple(row) for row in top], higher + 1)
+    return result
+
+
+def memory_tap(ranking: Leaderboard, scores: dict):
+    return {
+        board: (ranking.top(board), ranking.rank(board, score)[0])
+        for board, score in scores.items()
+    }
+
+
+def measure(func, samples):
+    timings = []
+    for args in samples:
+        started = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings
+
+
+def report(title: str, timings):
+    n = len(timings)
+    print(f"{title:20} p50 {timings[n // 2] * 1e6:9.1f} µs  "
+          f"p99 {timings[min(n - 1, int(n * 0.99))] * 1e6:9.1f} µs")
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db = Database(path)
+        seed_database(db, args.db_users, args.seed)
+        seed_invites(db, args.db_users, args.seed)
+        db.migrate_deferred()
+
+        ranking = Leaderboard(AsyncDatabase(db), size=args.size, refresh=0)
+        db.add_listener(ranking.apply)
+        started = time.perf_counter()
+        await ranking.load()
+        print(f"rebuild at startup: {(time.perf_counter() - started) * 1000:.1f} ms "
+              f"for {args.db_users} users")
+
+        # SQL-варианты читают через своё соединение, как и пул читателей
+        conn = sqlite3.connect(path)
+        samples = []
+        for _ in range(args.users):
+            user_id = rng.randint(1, args.db_users)
+            scores = {}
+            for board, (table, column) in SOURCES.items():
+                row = conn.execute(
+                    f"SELECT {column} FROM {table} WHERE user_id=?", (user_id,)
+                ).fetchone()
+                scores[board] = row[0] if row else 0
+            samples.append(scores)
+
+        mismatches = 0
+        for scores in samples:
+            expected = sql_tap(conn, args.size, scores, indexed=True)
+            got = memory_tap(ranking, scores)
+            for board, score in scores.items():
+                top, rank = expected[board]
+                if got[board][0] != top or (score > 0 and got[board][1] != rank):
+                    mismatches += 1
+
+        report("sql, no index", measure(
+            lambda scores: sql_tap(conn, args.size, scores, indexed=False),
+            [(scores,) for scores in samples[:args.scan_samples]],
+        ))
+        report("sql, indexed", measure(
+            lambda scores: sql_tap(conn, args.size, scores, indexed=True),
+            [(scores,) for scores in samples],
+        ))
+        report("in memory", measure(
+            lambda scores: memory_tap(ranking, scores), [(scores,) for scores in samples]
+        ))
+
+        # Цена обновления: сама запись и она же со слушателем рейтинга
+        writes = [(rng.randint(1, args.db_users), rng.randint(1, 5)) for _ in range(args.users)]
+        db.remove_listener(ranking.apply)
+        without_listener = measure(db.add_tickets, writes)
+        db.add_listener(ranking.apply)
+        with_listener = measure(db.add_tickets, writes)
+        report("add_tickets", without_listener)
+        report("add_tickets + board", with_listener)
+        conn.close()
+        db.close()
+
+    print(f"ranks checked: {len(samples) * len(SOURCES)}, "
+          f"{'OK' if not mismatches else f'{mismatches} MISMATCHES'}")
+    return not mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db-users", type=int, default=200_000)
+    parser.add_argument("--users", type=int, default=2000, help="нажатий и сверок")
+    parser.add_argument("--scan-samples", type=int, default=50,
+                        help="нажатий для варианта без индекса")
+    parser.add_argument("--size", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=2026)
+    args = parser.parse_args()
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
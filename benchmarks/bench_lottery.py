@@ -0,0 +1,135 @@
+"""
+Бенчмарк розыгрыша: старый подход (список из всех билетов) против
+WeightedLottery (префиксные суммы и bisect).
+
+Кроме времени и памяти проверяет, что шанс пропорционален билетам:
+частоты одиночного draw сравниваются с долями билетов критерием
+хи-квадрат, а частоты попадания в draw_many(2) — с точными
+вероятностями выбора без возвращения.
+
+    python benchmarks/bench_lottery.py --users 1000000 --max-tickets 10 --winners 100
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from lottery import WeightedLottery  # noqa: E402
+
+
+def make_entries(users: int, max_tickets: int, seed: int):
+    rng = random.Random(seed)
+    return [(user_id, rng.randint(1, max_tickets)) for user_id in range(1, users + 1)]
+
+
+def measure(func):
+    """Время — отдельным прогоном, т.к. tracemalloc сильно замедляет код."""
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def check_distribution(trials: int, seed: int) -> bool:
+    """Частоты победителей на маленьком розыгрыше против теории."""
+    weights = {user_id: tickets for user_id, tickets in make_entries(20, 10, seed)}
+    weights[21] = 60  # крупный держатель: чаще всего попадает в уже выигравших
+    total = sum(weights.values())
+    share = {user_id: tickets / total for user_id, tickets in weights.items()}
+    lottery = WeightedLottery(list(weights.items()), random.Random(seed))
+
+    # Один победитель: хи-квадрат с 20 степенями свободы, порог p = 0.001
+    counts = dict.fromkeys(weights, 0)
+    for _ in range(trials):
+        counts[lottery.draw()] += 1
+    chi2 = sum((counts[u] - trials * p) ** 2 / (trials * p) for u, p in share.items())
+    single_ok = chi2 < 45.3
+
+    # Двое без повторов: P(i среди двух) = p_i + sum_j p_j * p_i / (1 - p_j)
+    inclusion = {
+        i: p_i + sum(p_j * p_i / (1 - p_j) for j, p_j in share.items() if j != i)
+        for i, p_i in share.items()
+    }
+    rng = random.Random(seed + 1)
+    hits = dict.fromkeys(weights, 0)
+    pair_trials = trials // 10
+    for _ in range(pair_trials):
+        for user_id in WeightedLottery(list(weights.items()), rng).draw_many(2):
+            hits[user_id] += 1
+    # Отклонение каждой частоты — не больше 4.5 стандартных ошибок
+    worst = max(
+        abs(hits[u] / pair_trials - q) / (q * (1 - q) / pair_trials) ** 0.5
+        for u, q in inclusion.items()
+    )
+    pair_ok = worst < 4.5
+
+    print(f"distribution: draw chi2 {chi2:.1f} (df 20, limit 45.3), "
+          f"draw_many(2) worst z {worst:.2f} (limit 4.5): "
+          f"{'OK' if single_ok and pair_ok else 'MISMATCH'}")
+    return single_ok and pair_ok
+
+
+def naive_draw(entries, winners, rng):
+    tickets = []
+    for user_id, count in entries:
+        tickets.extend([user_id] * count)
+    chosen = set()
+    while len(chosen) < winners:
+        chosen.add(rng.choice(tickets))
+    return chosen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--max-tickets", type=int, default=10)
+    parser.add_argument("--winners", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=2026)
+    parser.add_argument("--skip-naive", action="store_true")
+    parser.add_argument("--trials", type=int, default=200_000,
+                        help="розыгрышей для проверки распределения")
+    args = parser.parse_args()
+
+    distribution_ok = check_distribution(args.trials, args.seed)
+
+    entries = make_entries(args.users, args.max_tickets, args.seed)
+    total = sum(count for _, count in entries)
+    print(f"users={args.users:,} tickets={total:,} winners={args.winners}")
+
+    lottery, build_time, build_peak = measure(
+        lambda: WeightedLottery(entries, random.Random(args.seed))
+    )
+    started = time.perf_counter()
+    winners = lottery.draw_many(args.winners)
+    draw_time = time.perf_counter() - started
+    assert len(set(winners)) == len(winners)
+    print(
+        f"prefix:  build {build_time * 1000:9.1f} ms  "
+        f"draw {draw_time * 1000:7.2f} ms  "
+        f"({draw_time / max(len(winners), 1) * 1e6:.1f} us/winner)  "
+        f"peak {build_peak / 2**20:7.1f} MiB"
+    )
+
+    if not args.skip_naive:
+        _, naive_time, naive_peak = measure(
+            lambda: naive_draw(entries, args.winners, random.Random(args.seed))
+        )
+        print(
+            f"naive:   total {naive_time * 1000:9.1f} ms  "
+            f"{'':28}peak {naive_peak / 2**20:7.1f} MiB"
+        )
+    if not distribution_ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
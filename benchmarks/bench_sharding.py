@@ -0,0 +1,85 @@
+"""
+Масштабирование многопроцессного режима по числу воркеров.
+
+Supervisor из sharding.py запускает N процессов-воркеров, Bot API в
+каждом заменён транспортом StubRequest (без сети), поэтому упор — в CPU:
+разбор апдейтов, ConversationHandler, хендлеры и SQLite. Каждый из
+--users пользователей проходит полный сценарий из bench_handlers
+(/start → «Мои билеты» → план → pre-checkout → оплата → пожелание).
+Время считается от первого апдейта до выхода последнего воркера; после
+прогона проверяется, что все пожелания дошли до базы.
+
+    python benchmarks/bench_sharding.py --users 2000 --workers 1 2 4 8
+"""
+
+import argparse
+import functools
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from benchmarks.bench_handlers import FIRST_USER_ID, user_script  # noqa: E402
+from benchmarks.fake_telegram import stub_builder  # noqa: E402
+from sharding import Supervisor  # noqa: E402
+
+
+def run_once(workers: int, users: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    scripts = [user_script(FIRST_USER_ID + i, rng) for i in range(users)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        supervisor = Supervisor(workers, db_path, builder_factory=functools.partial(stub_builder))
+        supervisor.start()
+        started = time.perf_counter()
+        # Апдейты одного пользователя уходят по порядку; порядок между
+        # пользователями перемешан, как в реальном потоке
+        for step in range(max(len(script) for script in scripts)):
+            for script in scripts:
+                if step < len(script):
+                    supervisor.dispatch(script[step])
+        supervisor.stop()
+        elapsed = time.perf_counter() - started
+
+        conn = sqlite3.connect(db_path)
+        wishes = conn.execute("SELECT COUNT(*) FROM users WHERE wish IS NOT NULL").fetchone()[0]
+        conn.close()
+
+    updates = sum(len(script) for script in scripts)
+    return {
+        "workers": workers,
+        "updates": updates,
+        "seconds": elapsed,
+        "per_second": updates / elapsed,
+        "wishes": wishes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seed", type=int, default=2026)
+    args = parser.parse_args()
+
+    logging.disable(logging.ERROR)
+    print(f"cpu cores: {os.cpu_count()}")
+    baseline = None
+    for workers in args.workers:
+        result = run_once(workers, args.users, args.seed)
+        baseline = baseline or result["per_second"]
+        print(
+            f"workers={result['workers']:3d}  "
+            f"{result['updates']} updates in {result['seconds']:6.2f} s  "
+            f"= {result['per_second']:8.1f} upd/s  x{result['per_second'] / baseline:4.2f}  "
+            f"wishes {result['wishes']}/{args.users}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Время холодного старта: от запуска процесса до обработки первого апдейта.
+
+Каждый прогон — отдельный процесс python (чтобы импорты были честными),
+который по шагам замеряет: импорт bot, открытие Database (миграции),
+build_application, initialize + post_init + start и обработку первого
+/start через StubRequest. Прогоны идут на новой базе (все миграции) и
+на уже существующей с --db-users пользователями (схема актуальна, DDL нет).
+С --budget-ms код выхода 1, если медиана превышает бюджет.
+
+    python benchmarks/bench_startup.py --runs 5 --db-users 100000 --budget-ms 1500
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+PHASES = ("import", "database", "build", "start", "first_update", "total")
+
+
+def child(db_path: str):
+    started = time.perf_counter()
+    marks = {}
+
+    def mark(name):
+        marks[name] = (time.perf_counter() - started) * 1000
+
+    sys.path.insert(0, ROOT)
+    import asyncio
+    import logging
+
+    logging.disable(logging.ERROR)
+    from telegram import Update
+
+    from benchmarks.fake_telegram import stub_builder, text_update
+    from bot import build_application
+    from database import Database
+    mark("import")
+
+    async def run():
+        db = Database(db_path)
+        mark("database")
+        application = build_application(db, builder=stub_builder())
+        mark("build")
+        await application.initialize()
+        await application.post_init(application)
+        await application.start()
+        mark("start")
+        await application.process_update(
+            Update.de_json(text_update(1, "/start"), application.bot)
+        )
+        mark("first_update")
+        await application.stop()
+        await application.post_stop(application)
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+    asyncio.run(run())
+    marks["total"] = marks["first_update"]
+    print(json.dumps(marks))
+
+
+def run_child(db_path: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", db_path],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(title: str, runs) -> float:
+    medians = {phase: statistics.median(run[phase] for run in runs) for phase in PHASES}
+    # Фазы кумулятивные — печатаем длительность каждой
+    previous = 0.0
+    parts = []
+    for phase in PHASES[:-1]:
+        parts.append(f"{phase} {medians[phase] - previous:6.0f}")
+        previous = medians[phase]
+    print(f"{title:14} total {medians['total']:6.0f} ms  (" + ", ".join(parts) + ")")
+    return medians["total"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--db-users", type=int, default=10_000)
+    parser.add_argument("--budget-ms", type=float, default=0, help="допустимая медиана, мс")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    sys.path.insert(0, ROOT)
+    from benchmarks.bench_handlers import seed_database
+    from database import Database
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fresh = []
+        for i in range(args.runs):
+            fresh.append(run_child(os.path.join(tmp, f"fresh{i}.db")))
+        existing_path = os.path.join(tmp, "existing.db")
+        db = Database(existing_path)
+        seed_database(db, args.db_users, seed=2026)
+        db.migrate_deferred()
+        db.close()
+        existing = [run_child(existing_path) for _ in range(args.runs)]
+
+    report("new db", fresh)
+    total = report(f"{args.db_users} users", existing)
+    if args.budget_ms and total > args.budget_ms:
+        print(f"❌ startup {total:.0f} ms exceeds budget {args.budget_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Пропускная способность webhook-режима на локальном фейковом Bot API.
+
+Каждый из --users пользователей шлёт /start и затем --taps нажатий
+«Мои билеты». Бот отвечает через FakeTelegram с задержкой --latency,
+то есть каждый хендлер ждёт «сеть». Сравниваются последовательная
+обработка (concurrency=1) и параллельная.
+
+    python benchmarks/bench_webhook.py --users 200 --taps 3 --latency 0.02
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from telegram.ext import Application  # noqa: E402
+
+from benchmarks.fake_telegram import FakeTelegram, callback_update, text_update  # noqa: E402
+from bot import build_application  # noqa: E402
+from database import Database  # noqa: E402
+from webhook import serve_webhook  # noqa: E402
+
+WEBHOOK_PORT = 18443
+
+
+async def run_once(concurrency: int, users: int, taps: int, latency: float) -> dict:
+    async with FakeTelegram(latency=latency) as fake:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, "bench.db"))
+            builder = Application.builder().token("1:BENCH").base_url(fake.base_url)
+            application = build_application(db, builder=builder, concurrency=concurrency)
+
+            stop = asyncio.Event()
+            server = asyncio.create_task(serve_webhook(
+                application, url="", listen="127.0.0.1", port=WEBHOOK_PORT,
+                path="/telegram", stop_event=stop,
+            ))
+            await asyncio.sleep(0.3)
+
+            url = f"http://127.0.0.1:{WEBHOOK_PORT}/telegram"
+            started = time.perf_counter()
+            async with aiohttp.ClientSession() as session:
+                async def user_flow(user_id):
+                    # Telegram доставляет апдейты одного чата последовательно
+                    await session.post(url, json=text_update(user_id, "/start"))
+                    for _ in range(taps):
+                        await session.post(url, json=callback_update(user_id, "my_tickets"))
+
+                await asyncio.gather(*(user_flow(1000 + i) for i in range(users)))
+            stop.set()
+            await server
+            elapsed = time.perf_counter() - started
+
+    updates = users * (1 + taps)
+    return {
+        "concurrency": concurrency,
+        "updates": updates,
+        "seconds": elapsed,
+        "per_second": updates / elapsed,
+        # Каждое нажатие должно дойти до хендлера после /start (порядок соблюдён)
+        "edits": fake.counts["editMessageText"],
+        "expected_edits": users * taps,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--taps", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    args = parser.parse_args()
+
+    logging.disable(logging.ERROR)
+    for concurrency in args.concurrency:
+        result = asyncio.run(run_once(concurrency, args.users, args.taps, args.latency))
+        print(
+            f"concurrency={result['concurrency']:4d}  "
+            f"{result['updates']} updates in {result['seconds']:6.2f} s  "
+            f"= {result['per_second']:8.1f} upd/s  "
+            f"ordered edits {result['edits']}/{result['expected_edits']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
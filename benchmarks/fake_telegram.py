@@ -0,0 +1,278 @@
+"""
+Локальный фейковый Bot API для стендов и бенчмарков.
+
+FakeTelegram поднимает aiohttp-сервер, который отвечает на методы Bot API
+правдоподобными объектами, записывает все вызовы и умеет имитировать
+задержку сети и ответы 429 (flood control). Бот подключается к нему через
+``Application.builder().base_url(fake.base_url)`` или, без HTTP вообще,
+через транспорт StubRequest.
+
+Здесь же — конструкторы JSON-апдейтов в формате Bot API.
+"""
+
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from aiohttp import web
+from telegram.request import BaseRequest
+
+BOT_USER = {
+    "id": 100000,
+    "is_bot": True,
+    "first_name": "Bench",
+    "username": "bench_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+
+class FakeTelegram:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        rate_limit: float = 0.0,
+        retry_after: int = 1,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """
+        latency     — задержка каждого ответа, секунды;
+        rate_limit  — если > 0, глобальный лимит отправки сообщений в секунду,
+                      сверх него отвечаем 429 с ``retry_after``.
+        """
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.host = host
+        self.port = port
+        self.calls = []
+        self.counts = Counter()
+        self.flood_errors = 0
+        self.blocked_chats = set()
+        self._message_ids = itertools.count(1)
+        self._window_start = time.monotonic()
+        self._window_sent = 0
+        self._runner = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _flooded(self) -> bool:
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_sent = 0
+        self._window_sent += 1
+        return self._window_sent > self.rate_limit
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    def _message(self, params: dict, **extra) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        message.update(extra)
+        return message
+
+    def _result(self, method: str, params: dict):
+        file_id = f"file-{next(self._message_ids)}"
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText", "sendInvoice", "sendDocument"):
+            return self._message(params, text=str(params.get("text", "")))
+        if method == "sendAnimation":
+            return self._message(params, animation={
+                "file_id": file_id, "file_unique_id": file_id,
+                "width": 800, "height": 450, "duration": 3,
+            })
+        if method == "sendPhoto":
+            return self._message(params, photo=[{
+                "file_id": file_id, "file_unique_id": file_id,
+                "width": 800, "height": 450,
+            }])
+        return True
+
+    async def respond(self, method: str, params: dict):
+        """Ответ Bot API на вызов: ``(http_status, json)``."""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method.startswith("send") and self._flooded():
+            self.flood_errors += 1
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        chat_id = params.get("chat_id")
+        if chat_id is not None and int(chat_id) in self.blocked_chats:
+            return 403, {
+                "ok": False,
+                "error_code": 403,
+                "description": "Forbidden: bot was blocked by the user",
+            }
+
+        self.calls.append((method, params))
+        self.counts[method] += 1
+        return 200, {"ok": True, "result": self._result(method, params)}
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        status, payload = await self.respond(method, await self._params(request))
+        return web.json_response(payload, status=status)
+
+
+class StubRequest(BaseRequest):
+    """Транспорт PTB без сети: вызовы Bot API уходят прямо в FakeTelegram.
+
+    Сервер при этом запускать не нужно:
+    ``Application.builder().request(StubRequest(fake)).get_updates_request(StubRequest(fake))``.
+    """
+
+    def __init__(self, fake: FakeTelegram):
+        self.fake = fake
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        params = request_data.parameters if request_data else {}
+        status, payload = await self.fake.respond(url.rsplit("/", 1)[-1], params)
+        return status, json.dumps(payload).encode()
+
+
+def stub_builder(latency: float = 0.0, token: str = "1:BENCH"):
+    """ApplicationBuilder поверх нового FakeTelegram без сети.
+
+    Функция уровня модуля, чтобы её (через functools.partial) можно было
+    передать в процесс-воркер.
+    """
+    from telegram.ext import Application
+
+    fake = FakeTelegram(latency=latency)
+    return (
+        Application.builder()
+        .token(token)
+        .request(StubRequest(fake))
+        .get_updates_request(StubRequest(fake))
+    )
+
+
+# ---- Апдейты в формате Bot API ----
+
+_update_ids = itertools.count(1)
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}",
+            "username": f"user{user_id}"}
+
+
+def _message(user_id: int, **fields) -> dict:
+    message = {
+        "message_id": next(_update_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": _user(user_id),
+    }
+    message.update(fields)
+    return message
+
+
+def text_update(user_id: int, text: str) -> dict:
+    fields = {"text": text}
+    if text.startswith("/"):
+        command = text.split()[0]
+        fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": next(_update_ids), "message": _message(user_id, **fields)}
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    # Кнопка висит под сообщением бота
+    message = _message(user_id, text="menu")
+    message["from"] = BOT_USER
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": message,
+        },
+    }
+
+
+def pre_checkout_update(user_id: int, payload: str, amount: int) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "pre_checkout_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "currency": "XTR",
+            "total_amount": amount,
+            "invoice_payload": payload,
+        },
+    }
+
+
+def successful_payment_update(user_id: int, payload: str, amount: int) -> dict:
+    charge_id = f"charge-{next(_update_ids)}"
+    return {
+        "update_id": next(_update_ids),
+        "message": _message(user_id, successful_payment={
+            "currency": "XTR",
+            "total_amount": amount,
+            "invoice_payload": payload,
+            "telegram_payment_charge_id": charge_id,
+            "provider_payment_charge_id": charge_id,
+        }),
+    }
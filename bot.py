@@ -3,17 +3,37 @@
 import logging
 import asyncio
 import os
-from telegram import (
-    Update, InlineKeyboardButton, InlineKeyboardMarkup,
-    LabeledPrice, InputMediaPhoto
-)
+import tempfile
+from telegram import Update
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler,
     MessageHandler, PreCheckoutQueryHandler, ContextTypes,
     ConversationHandler, filters
 )
-from config import BOT_TOKEN, ADMIN_IDS
-from database import Database
+from telegram.request import HTTPXRequest
+
+from config import (
+    BOT_TOKEN, ADMIN_IDS, BOT_MODE, BOT_WORKERS, LEADERBOARD_REFRESH, METRICS_PORT,
+    UPDATE_CONCURRENCY, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+)
+from backup import BackupManager
+from broadcast import Broadcaster
+from checkout import CheckoutGuard
+from database import AsyncDatabase, Database
+from leaderboard import INVITES, TICKETS, Leaderboard
+from media import MediaRegistry
+from screens import (
+    PLANS, PLANS_BY_PAYLOAD, PLAN_PRICES, MAIN_MENU_MARKUP, INVITE_AND_MENU_MARKUP,
+    MENU_ONLY_MARKUP, WELCOME_TEXT, PAYMENT_OK_TEXT, WISH_SAVED_TEXT,
+    MY_TICKETS_TEXT, INVITE_TEXT, CHECKOUT_ERRORS, LEADERBOARD_TEXT, LEADERBOARD_ROW,
+    LEADERBOARD_EMPTY, LEADERBOARD_RANK, LEADERBOARD_NO_RANK, LEADERBOARD_ANONYMOUS
+)
+import metrics
+from persistence import SQLitePersistence
+from render import CERTIFICATE_CAPTION, CertificateRenderer, certificate_name, certificates_dir
+from sharding import owner
+from throttling import FloodGuard
+from update_processor import PerUserUpdateProcessor
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -24,79 +44,47 @@ logger = logging.getLogger(__name__)
 # ---- Состояния ConversationHandler ----
 CHOOSE_PLAN, WAITING_WISH, WAITING_INVITE_CHECK = range(3)
 
-# ---- Тарифные планы ----
-PLANS = {
-    "plan_300": {
-        "stars": 300,
-        "invites": 1,
-        "title": "🌟 VIP – 300 звёзд",
-        "description": "Ваше имя в книге рекордов Гиннесса",
-        "payload": "plan_300"
-    },
-    "plan_500": {
-        "stars": 500,
-        "invites": 2,
-        "title": "💎 PREMIUM – 500 звёзд",
-        "description": "Ваше имя в книге рекордов Гиннесса. Именной подарочный сертификат",
-        "payload": "plan_500"
-    },
-    "plan_1000": {
-        "stars": 1000,
-        "invites": 5,
-        "title": "👑 PLATINUM – 1000 звёзд",
-        "description": "Ваше имя в книге рекордов Гиннесса. Именной подарочный сертификат. Участие в розыгрыше билетов на FIFA World Cup 2026",
-        "payload": "plan_1000"
-    }
-}
-
+# Максимум победителей за один /draw N
+MAX_DRAW_WINNERS = 100
 
 class BotHandlers:
-    def __init__(self, db: Database):
+    def __init__(self, db: AsyncDatabase, media: MediaRegistry, broadcaster: Broadcaster,
+                 certificates: CertificateRenderer = None, checkout: CheckoutGuard = None,
+                 backups: BackupManager = None, ranking: Leaderboard = None):
         self.db = db
+        self.media = media
+        self.broadcaster = broadcaster
+        self.certificates = certificates
+        self.checkout = checkout
+        self.backups = backups
+        self.ranking = ranking
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        logger.info(f"User {user.id} ({user.username}) started the bot")
+        logger.info("User %s (%s) started the bot", user.id, user.username)
         
         args = context.args
         referrer_id = None
         if args and args[0].startswith("ref_"):
             referrer_id = int(args[0].split("ref_")[1])
-            logger.info(f"New user {user.id} referred by {referrer_id}")
-
-        self.db.add_user(user.id, user.username, referrer_id)
-
-        text = (
-            f"Привет, {user.first_name}! 🎉\n\n"
-            "📢 Создаём подарок! Самое большое послание в Мире!:\n"
-            "✨ Внеси своё имя в Книгу Рекордов Гиннесса! Оставь пожелание на самолёте Роналду!\n\n"
-            "👇  Разыграем билет на FIFA World Cup 2026 :"
-        )
+            logger.info("New user %s referred by %s", user.id, referrer_id)
 
-        keyboard = []
-        for plan_id, plan in PLANS.items():
-            button_text = f"{plan['title']} – {plan['invites']} билет(а)"
-            keyboard.append([
-                InlineKeyboardButton(button_text, callback_data=f"buy_{plan_id}")
-            ])
+        await self.db.add_user(user.id, user.username, referrer_id)
 
-        keyboard.append([InlineKeyboardButton("🎟 Мои билеты", callback_data="my_tickets")])
-        keyboard.append([InlineKeyboardButton("🔗 Пригласить друга", callback_data="invite_friend")])
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        if update.message:
-        # Отправка GIF-изображения
+        # Приветственная картинка (после первой загрузки — по file_id);
+        # если файла нет, MediaRegistry один раз предупредит и пропустит её
         try:
-            gif_path = os.path.join(os.path.dirname(__file__), 'images', 'welcome.gif')
-            with open(gif_path, 'rb') as gif:
-                await update.message.reply_animation(animation=gif, caption="")
+            await self.media.send(context.bot, update.effective_chat.id, "welcome")
         except Exception as e:
-            logger.error(f"Failed to send GIF: {e}")
-                    await update.callback_query.message.reply_text(text, reply_markup=reply_markup)
-
+            logger.error("Failed to send welcome media: %s", e)
+        await self._send_main_menu(update.message, user.first_name)
         return CHOOSE_PLAN
 
+    async def _send_main_menu(self, message, first_name: str):
+        await message.reply_text(
+            WELCOME_TEXT.format(first_name=first_name), reply_markup=MAIN_MENU_MARKUP
+        )
+
     async def buy_plan(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
@@ -105,8 +93,6 @@ class BotHandlers:
         context.user_data["selected_plan"] = plan_id
         plan = PLANS[plan_id]
 
-        price = LabeledPrice(label=plan["title"], amount=plan["stars"])
-
         await context.bot.send_invoice(
             chat_id=query.from_user.id,
             title=plan["title"],
@@ -114,61 +100,78 @@ class BotHandlers:
             payload=plan["payload"],
             provider_token="",
             currency="XTR",
-            prices=[price]
+            prices=PLAN_PRICES[plan_id]
         )
 
         return CHOOSE_PLAN
 
     async def precheckout_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.pre_checkout_query
-        await query.answer(ok=True)
+        reason = None
+        if self.checkout:
+            # Запрос к базе — только если истекли брони; само решение из
+            # счётчиков в памяти, между expire и reserve нет await
+            await self.checkout.expire()
+            reason = self.checkout.reserve(
+                query.id, query.from_user.id, query.invoice_payload,
+                query.total_amount, query.currency,
+            )
+        if reason:
+            metrics.CHECKOUT_REJECTED.labels(reason).inc()
+            logger.info("Pre-checkout from %s rejected: %s", query.from_user.id, reason)
+            await query.answer(ok=False, error_message=CHECKOUT_ERRORS[reason])
+        else:
+            await query.answer(ok=True)
         return CHOOSE_PLAN
 
     async def successful_payment(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
-        payload = update.message.successful_payment.payload
-
-        plan = None
-        for p_id, p_data in PLANS.items():
-            if p_data["payload"] == payload:
-                plan = p_data
-                break
+        payment = update.message.successful_payment
 
+        plan_id, plan = PLANS_BY_PAYLOAD.get(payment.invoice_payload, (None, None))
         if not plan:
             await update.message.reply_text("❌ Ошибка при обработке платежа.")
             return ConversationHandler.END
 
         num_tickets = plan["invites"]
-        self.db.add_tickets(user_id, num_tickets)
-
-        text = (
-            f"✅ Оплата прошла успешно!\n"
-            f"Вы получили {num_tickets} билет(а).\n\n"
-            "Теперь напишите своё пожелание для Роналду 🙏"
+        is_new = await self.db.add_payment(
+            payment.telegram_payment_charge_id, user_id, plan_id,
+            payment.total_amount, num_tickets
         )
-        await update.message.reply_text(text)
+        if not is_new:
+            logger.info("Duplicate payment %s from %s ignored",
+                        payment.telegram_payment_charge_id, user_id)
+            return WAITING_WISH
+        if self.checkout:
+            self.checkout.confirm(user_id, plan_id)
+        metrics.PAYMENTS.labels(plan_id).inc()
+
+        await update.message.reply_text(PAYMENT_OK_TEXT.format(tickets=num_tickets))
+        if plan.get("certificate") and self.certificates:
+            # Рендер в пуле процессов не задерживает переход к пожеланию
+            context.application.create_task(
+                self._send_certificate(context.bot, update.effective_user, plan), update=update
+            )
 
         return WAITING_WISH
 
+    async def _send_certificate(self, bot, user, plan: dict):
+        try:
+            info = await self.db.get_user_info(user.id)
+            name = certificate_name(info["username"], user.id)
+            path = await self.certificates.render(name, plan["title"], info["invites_req"])
+            with open(path, "rb") as f:
+                await bot.send_photo(user.id, f, caption=CERTIFICATE_CAPTION)
+        except Exception as e:
+            logger.error("Failed to send certificate to %s: %s", user.id, e)
+
     async def receive_wish(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         wish_text = update.message.text
 
-        self.db.add_wish(user_id, wish_text)
-
-        text = (
-            "💌 Ваше пожелание принято!\n\n"
-            "🎟 Хочешь больше билетов?\n"
-            "👉 Пригласи друзей и получи бонус!"
-        )
-
-        keyboard = [
-            [InlineKeyboardButton("🔗 Пригласить друга", callback_data="invite_friend")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        await self.db.add_wish(user_id, wish_text)
 
-        await update.message.reply_text(text, reply_markup=reply_markup)
+        await update.message.reply_text(WISH_SAVED_TEXT, reply_markup=INVITE_AND_MENU_MARKUP)
         return ConversationHandler.END
 
     async def my_tickets(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -176,50 +179,69 @@ class BotHandlers:
         await query.answer()
 
         user_id = query.from_user.id
-        tickets = self.db.get_user_tickets(user_id)
-        invites = self.db.get_user_invites(user_id)
+        tickets = await self.db.get_user_tickets(user_id)
+        invites = await self.db.get_user_invites(user_id)
 
-        text = (
-            f"🎟 У вас {tickets} билет(ов)\n"
-            f"👥 Приглашённых друзей: {invites}\n\n"
-            "Пригласи больше друзей, чтобы получить дополнительные билеты!"
+        await query.edit_message_text(
+            MY_TICKETS_TEXT.format(tickets=tickets, invites=invites),
+            reply_markup=INVITE_AND_MENU_MARKUP,
         )
-
-        keyboard = [
-            [InlineKeyboardButton("🔗 Пригласить друга", callback_data="invite_friend")],
-            [InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await query.edit_message_text(text, reply_markup=reply_markup)
         return CHOOSE_PLAN
 
-    async def invite_friend(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def leaderboard(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
 
+        # Первые места и место пользователя — из памяти; из базы только
+        # его собственные счета и имена первых мест по первичному ключу
         user_id = query.from_user.id
-        bot_username = (await context.bot.get_me()).username
-        invite_link = f"https://t.me/{bot_username}?start=ref_{user_id}"
-
-        text = (
-            "🔗 Твоя реферальная ссылка:\n"
-            f"{invite_link}\n\n"
-            "Отправь её друзьям! За каждого друга, который купит тариф, "
-            "ты получишь +1 билет! 🎫"
+        scores = {
+            TICKETS: await self.db.get_user_tickets(user_id),
+            INVITES: await self.db.get_user_invites(user_id),
+        }
+        tops = {board: self.ranking.top(board) for board in scores}
+        names = await self.db.get_usernames(
+            {member for top in tops.values() for member, _ in top}
         )
 
-        keyboard = [[InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        lines = {}
+        for board, score in scores.items():
+            rows = [
+                LEADERBOARD_ROW.format(
+                    place=place,
+                    name=f"@{names[member]}" if names.get(member) else LEADERBOARD_ANONYMOUS,
+                    score=member_score,
+                )
+                for place, (member, member_score) in enumerate(tops[board], 1)
+            ]
+            rank, total = self.ranking.rank(board, score)
+            lines[f"{board}_top"] = "\n".join(rows) or LEADERBOARD_EMPTY
+            lines[f"{board}_rank"] = (
+                LEADERBOARD_RANK.format(rank=rank, total=total, score=score)
+                if rank else LEADERBOARD_NO_RANK
+            )
+
+        await query.edit_message_text(
+            LEADERBOARD_TEXT.format(**lines), reply_markup=INVITE_AND_MENU_MARKUP
+        )
+        return CHOOSE_PLAN
+
+    async def invite_friend(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        await query.answer()
 
-        await query.edit_message_text(text, reply_markup=reply_markup)
+        # username бота закеширован при initialize(), без запроса get_me
+        text = INVITE_TEXT.format(bot_username=context.bot.username, user_id=query.from_user.id)
+        await query.edit_message_text(text, reply_markup=MENU_ONLY_MARKUP)
         return CHOOSE_PLAN
 
     async def main_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         await query.answer()
         context.user_data.clear()
-        return await self.start(update, context)
+        # Пользователь уже в базе и GIF уже видел — только меню
+        await self._send_main_menu(query.message, query.from_user.first_name)
+        return CHOOSE_PLAN
 
     async def admin_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
@@ -227,14 +249,70 @@ class BotHandlers:
             await update.message.reply_text("❌ У вас нет прав доступа.")
             return
 
-        stats = self.db.get_stats()
-        text = (
-            "📊 Статистика бота:\n\n"
-            f"👥 Всего пользователей: {stats['total_users']}\n"
-            f"🎟 Всего билетов выдано: {stats['total_tickets']}\n"
-            f"💌 Всего пожеланий: {stats['total_wishes']}"
-        )
-        await update.message.reply_text(text)
+        stats = await self.db.get_stats()
+        lines = [
+            "📊 Статистика бота:\n",
+            f"👥 Всего пользователей: {stats['total_users']}",
+            f"🎟 Всего билетов выдано: {stats['total_tickets']}",
+            f"💌 Всего пожеланий: {stats['total_wishes']}",
+        ]
+
+        if stats["plans"]:
+            lines.append("\n💰 Выручка по планам:")
+            for plan_id, plan_stats in stats["plans"].items():
+                title = PLANS[plan_id]["title"] if plan_id in PLANS else plan_id
+                lines.append(
+                    f"{title}: {plan_stats['payments']} оплат, {plan_stats['stars']} ⭐"
+                )
+
+        if stats["payments_per_hour"]:
+            lines.append("\n🕐 Оплаты по часам (UTC):")
+            for hour in stats["payments_per_hour"][:6]:
+                lines.append(f"{hour['hour']}: {hour['payments']} оплат, {hour['stars']} ⭐")
+
+        if self.backups:
+            lines += self._backup_lines()
+
+        await update.message.reply_text("\n".join(lines))
+
+    def _backup_lines(self):
+        status = self.backups.status()
+        lines = ["\n💾 Бэкапы:"]
+        if status["running"]:
+            lines.append(f"Идёт снимок: {status['progress']:.0%}")
+        last = status["last"]
+        if last:
+            lines.append(
+                f"Последний: {last['finished_at']} UTC, {last['size'] / 2**20:.1f} МБ "
+                f"за {last['seconds']:.1f} с"
+            )
+        elif not status["running"]:
+            lines.append("Снимков с запуска бота ещё не было")
+        if status["last_error"]:
+            lines.append(f"❗ Ошибка: {status['last_error']}")
+        return lines
+
+    async def admin_backup(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if user_id not in ADMIN_IDS:
+            await update.message.reply_text("❌ У вас нет прав доступа.")
+            return
+
+        if self.backups.running:
+            await update.message.reply_text("\n".join(self._backup_lines()))
+            return
+        # Снимок идёт в фоне, чтобы /stats с прогрессом обработался сразу
+        context.application.create_task(self._backup_now(update.message), update=update)
+        await update.message.reply_text("💾 Снимок базы запущен. Прогресс: /stats")
+
+    async def _backup_now(self, message):
+        try:
+            path = await self.backups.backup()
+        except Exception as e:
+            logger.error("Backup failed: %s", e)
+            await message.reply_text(f"❌ Бэкап не удался: {e}")
+            return
+        await message.reply_text(f"✅ Снимок готов: {os.path.basename(path)}")
 
     async def admin_draw(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
@@ -242,27 +320,202 @@ class BotHandlers:
             await update.message.reply_text("❌ У вас нет прав доступа.")
             return
 
-        winner_id = self.db.draw_winner()
-        if not winner_id:
+        count = 1
+        if context.args:
+            try:
+                count = int(context.args[0])
+            except ValueError:
+                count = 0
+            if not 1 <= count <= MAX_DRAW_WINNERS:
+                await update.message.reply_text(
+                    f"❌ Использование: /draw N, где N от 1 до {MAX_DRAW_WINNERS}."
+                )
+                return
+
+        winners = await self.db.draw_winners(count)
+        if not winners:
             await update.message.reply_text("❌ Нет участников для розыгрыша.")
             return
 
-        winner_info = self.db.get_user_info(winner_id)
-        text = (
-            f"🎉 Победитель розыгрыша:\n"
-            f"ID: {winner_id}\n"
-            f"Username: @{winner_info['username'] if winner_info['username'] else 'N/A'}\n"
-            f"Билетов: {winner_info['tickets']}"
-        )
-        await update.message.reply_text(text)
+        lines = [f"🎉 Победители розыгрыша ({len(winners)}):"]
+        for place, winner_id in enumerate(winners, 1):
+            winner_info = await self.db.get_user_info(winner_id)
+            lines.append(
+                f"{place}. ID: {winner_id}, "
+                f"@{winner_info['username'] if winner_info['username'] else 'N/A'}, "
+                f"билетов: {winner_info['invites_req']}"
+            )
+        if self.checkout and not self.checkout.closed:
+            await self.checkout.set_closed(True)
+            lines.append("\n🔒 Продажи закрыты. Открыть снова: /sales open")
+        await update.message.reply_text("\n".join(lines))
+
+        for winner_id in winners:
+            try:
+                await context.bot.send_message(
+                    chat_id=winner_id,
+                    text="🎉 Поздравляем! Вы выиграли в розыгрыше! Администратор свяжется с вами."
+                )
+            except Exception as e:
+                logger.error("Failed to notify winner %s: %s", winner_id, e)
+
+    async def admin_sales(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if user_id not in ADMIN_IDS:
+            await update.message.reply_text("❌ У вас нет прав доступа.")
+            return
+
+        arg = context.args[0].lower() if context.args else ""
+        if arg not in ("", "open", "close"):
+            await update.message.reply_text("❌ Использование: /sales [open|close]")
+            return
+        if arg:
+            await self.checkout.set_closed(arg == "close")
+
+        await self.checkout.expire()
+        status = self.checkout.status()
+        lines = [
+            f"🛒 Продажи {'закрыты 🔒' if status['closed'] else 'открыты ✅'}",
+            f"⏳ Оплат в процессе: {status['reserved']}",
+        ]
+        for plan_id, plan_status in status["plans"].items():
+            lines.append(
+                f"{PLANS[plan_id]['title']}: продано {plan_status['sold']}, "
+                f"в процессе {plan_status['held']} из {plan_status['slots']} мест"
+            )
+        if self.checkout.max_per_user:
+            lines.append(f"👤 Покупок на пользователя: до {self.checkout.max_per_user}")
+        await update.message.reply_text("\n".join(lines))
+
+    async def admin_perf(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if user_id not in ADMIN_IDS:
+            await update.message.reply_text("❌ У вас нет прав доступа.")
+            return
+
+        await update.message.reply_text(metrics.perf_report())
+
+    async def admin_referrals(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if user_id not in ADMIN_IDS:
+            await update.message.reply_text("❌ У вас нет прав доступа.")
+            return
+
+        if not context.args:
+            top = await self.db.get_top_inviters(10)
+            if not top:
+                await update.message.reply_text("Рефералов пока нет.")
+                return
+            lines = ["🔗 Топ пригласивших:\n"]
+            for place, row in enumerate(top, 1):
+                lines.append(
+                    f"{place}. {row['user_id']} @{row['username'] or 'N/A'} — "
+                    f"{row['invites']} прямых, {row['subtree']} всего в дереве"
+                )
+            lines.append("\nПодробно по пользователю: /referrals <user_id>")
+            await update.message.reply_text("\n".join(lines))
+            return
 
         try:
-            await context.bot.send_message(
-                chat_id=winner_id,
-                text="🎉 Поздравляем! Вы выиграли в розыгрыше! Администратор свяжется с вами."
+            target_id = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("❌ Использование: /referrals [user_id]")
+            return
+
+        stats = await self.db.get_referral_stats(target_id)
+        chain = await self.db.get_referral_chain(target_id)
+        levels = await self.db.get_referral_levels(target_id)
+        lines = [
+            f"🔗 Рефералы пользователя {target_id}:\n",
+            f"👥 Прямых приглашённых: {stats['invites']}",
+            f"🌳 Всего в дереве: {stats['subtree']}",
+            f"📏 Глубина: {stats['depth']}",
+        ]
+        if chain:
+            lines.append("⬆️ Цепочка пригласивших: " + " → ".join(map(str, chain)))
+        if levels:
+            lines.append("⬇️ По уровням: " + ", ".join(f"{level}: {cnt}" for level, cnt in levels))
+        await update.message.reply_text("\n".join(lines))
+
+    async def admin_broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if user_id not in ADMIN_IDS:
+            await update.message.reply_text("❌ У вас нет прав доступа.")
+            return
+
+        # Текст берём целиком, чтобы сохранить переносы строк
+        parts = update.message.text.split(maxsplit=1)
+        arg = parts[1].strip() if len(parts) > 1 else ""
+
+        if not arg:
+            await update.message.reply_text(
+                "Использование:\n"
+                "/broadcast <текст> — разослать всем пользователям\n"
+                "/broadcast status — прогресс последней рассылки\n"
+                "/broadcast stop — остановить рассылку"
             )
-        except Exception as e:
-            logger.error(f"Failed to notify winner {winner_id}: {e}")
+            return
+
+        if arg == "stop":
+            stopped = await self.broadcaster.stop_all()
+            await update.message.reply_text(f"⏹ Остановлено рассылок: {stopped}")
+            return
+
+        if arg == "status":
+            broadcast = await self.db.get_broadcast()
+            if not broadcast:
+                await update.message.reply_text("Рассылок ещё не было.")
+                return
+            running = self.broadcaster.is_running(broadcast["id"])
+            text = (
+                f"📣 Рассылка #{broadcast['id']}: {broadcast['status']}"
+                f"{' (идёт)' if running else ''}\n"
+                f"✅ Доставлено: {broadcast['sent']}\n"
+                f"🚫 Заблокировали бота: {broadcast['blocked']}\n"
+                f"❌ Ошибки: {broadcast['failed']}\n"
+                f"⚡ Скорость: {self.broadcaster.rate_per_second(broadcast):.1f} сообщ./с "
+                f"(лимит {self.broadcaster.bucket.rate:.0f}/с, 429: {self.broadcaster.flood_errors})"
+            )
+            await update.message.reply_text(text)
+            return
+
+        broadcast_id = await self.broadcaster.start(context.bot, user_id, arg)
+        await update.message.reply_text(
+            f"📣 Рассылка #{broadcast_id} запущена. Прогресс: /broadcast status"
+        )
+
+    async def admin_export(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if user_id not in ADMIN_IDS:
+            await update.message.reply_text("❌ У вас нет прав доступа.")
+            return
+
+        import export
+
+        args = [arg.lower() for arg in context.args]
+        unknown = set(args) - set(export.DATASETS) - set(export.FORMATS) - {"new"}
+        if unknown:
+            await update.message.reply_text(
+                "Использование: /export [" + "|".join(export.DATASETS) + "] "
+                "[csv|jsonl] [new]\n"
+                "new — только изменения с прошлой выгрузки этого набора"
+            )
+            return
+        dataset = next((arg for arg in args if arg in export.DATASETS), "wishes")
+        fmt = next((arg for arg in args if arg in export.FORMATS), "csv")
+
+        # Накопленная пачка записей должна попасть в выгрузку
+        if self.db.write_queue:
+            await self.db.write_queue.flush()
+        with tempfile.TemporaryDirectory() as directory:
+            path, rows, since = await self.db.sync.run(
+                export.run_export, self.db.sync, dataset, fmt, directory, "new" in args
+            )
+            caption = f"📦 {dataset}: {rows} строк" + (f" (изменения с {since} UTC)" if since else "")
+            with open(path, "rb") as f:
+                await update.message.reply_document(
+                    document=f, filename=os.path.basename(path), caption=caption
+                )
 
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Действие отменено.")
@@ -270,11 +523,94 @@ class BotHandlers:
         return ConversationHandler.END
 
 
-def main():
-    db = Database("bot_data.db")
-    handlers = BotHandlers(db)
-
-    application = Application.builder().token(BOT_TOKEN).build()
+def build_application(
+    db: Database,
+    builder=None,
+    concurrency: int = UPDATE_CONCURRENCY,
+    worker: int = 0,
+    workers: int = BOT_WORKERS,
+) -> Application:
+    """Собирает Application со всеми хендлерами поверх ``db``.
+
+    ``builder`` можно передать свой (например, с base_url локального
+    стенда); по умолчанию — боевой токен из config. ``worker`` — номер
+    процесса в многопроцессном режиме: фоновые рассылки продолжает только
+    нулевой, он же получает команды админов; ``workers`` — число процессов.
+    """
+    metrics.instrument_database(db)
+    adb = AsyncDatabase(db, batch_writes=True)
+    broadcaster = Broadcaster(adb)
+    certificates = CertificateRenderer(directory=certificates_dir(db.db_path))
+    checkout = CheckoutGuard(adb)
+    backups = BackupManager(db.db_path)
+    # С одним процессом рейтинг точен по изменениям из своей базы, с несколькими
+    # его ещё и перестраивают: в базу пишут и другие воркеры
+    ranking = Leaderboard(adb, refresh=LEADERBOARD_REFRESH if workers > 1 else 0)
+    db.add_listener(ranking.apply)
+    handlers = BotHandlers(
+        adb, MediaRegistry(adb), broadcaster, certificates, checkout, backups, ranking
+    )
+    metrics.instrument_handlers(handlers)
+    metrics_server = metrics.MetricsServer(port=METRICS_PORT + worker)
+
+    background = []
+
+    async def post_init(application: Application):
+        await checkout.load()
+        await ranking.load()
+        ranking.start()
+        await metrics_server.start()
+        if worker == 0:
+            await broadcaster.resume(application.bot)
+            # Индексы по большим таблицам строятся, когда бот уже отвечает, —
+            # в своём потоке, а не в пуле потоков базы
+            background.append(asyncio.create_task(asyncio.to_thread(db.migrate_deferred)))
+            backups.start()
+
+    async def post_stop(application: Application):
+        await ranking.stop()
+        await backups.stop()
+        await broadcaster.stop_all(resume_later=True)
+
+    async def post_shutdown(application: Application):
+        await asyncio.gather(*background, return_exceptions=True)
+        await metrics_server.stop()
+        certificates.close()
+        await adb.close()
+
+    if builder is None:
+        builder = Application.builder().token(BOT_TOKEN)
+        if metrics.REGISTRY.enabled:
+            builder = builder.request(
+                metrics.InstrumentedRequest(HTTPXRequest(connection_pool_size=256))
+            )
+    owns = None
+    if workers > 1:
+        def owns(user_id: int) -> bool:
+            return owner(user_id, workers) == worker
+    persistence = SQLitePersistence(adb, owns=owns)
+    update_processor = PerUserUpdateProcessor(concurrency, FloodGuard(), preload=persistence.load)
+    application = (
+        builder
+        .concurrent_updates(update_processor)
+        .persistence(persistence)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    metrics.REGISTRY.gauge_function(
+        "bot_update_queue_size", "Updates waiting in the queue",
+        application.update_queue.qsize,
+    )
+    metrics.REGISTRY.gauge_function(
+        "bot_updates_in_flight", "Updates being processed",
+        lambda: update_processor.in_flight,
+    )
+    metrics.REGISTRY.gauge_function(
+        "bot_checkout_reservations", "Pre-checkout reservations awaiting payment",
+        lambda: checkout.reserved,
+    )
 
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", handlers.start)],
@@ -282,14 +618,19 @@ def main():
             CHOOSE_PLAN: [
                 CallbackQueryHandler(handlers.buy_plan, pattern="^buy_"),
                 CallbackQueryHandler(handlers.my_tickets, pattern="^my_tickets$"),
+                CallbackQueryHandler(handlers.leaderboard, pattern="^leaderboard$"),
                 CallbackQueryHandler(handlers.invite_friend, pattern="^invite_friend$"),
                 CallbackQueryHandler(handlers.main_menu, pattern="^main_menu$"),
+                # Оплата внутри диалога переводит его в WAITING_WISH
+                MessageHandler(filters.SUCCESSFUL_PAYMENT, handlers.successful_payment),
             ],
             WAITING_WISH: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handlers.receive_wish)
             ],
         },
         fallbacks=[CommandHandler("cancel", handlers.cancel)],
+        name="main",
+        persistent=True,
     )
 
     application.add_handler(conv_handler)
@@ -299,9 +640,40 @@ def main():
     )
     application.add_handler(CommandHandler("stats", handlers.admin_stats))
     application.add_handler(CommandHandler("draw", handlers.admin_draw))
+    application.add_handler(CommandHandler("broadcast", handlers.admin_broadcast))
+    application.add_handler(CommandHandler("referrals", handlers.admin_referrals))
+    application.add_handler(CommandHandler("sales", handlers.admin_sales))
+    application.add_handler(CommandHandler("perf", handlers.admin_perf))
+    application.add_handler(CommandHandler("export", handlers.admin_export))
+    application.add_handler(CommandHandler("backup", handlers.admin_backup))
+    persistence.attach(application)
+    return application
 
-    logger.info("Bot is starting...")
-    application.run_polling()
+
+def main():
+    if BOT_WORKERS > 1:
+        from sharding import run_sharded
+
+        logger.info("Bot is starting in %s mode with %d workers...", BOT_MODE, BOT_WORKERS)
+        run_sharded(BOT_WORKERS, "bot_data.db")
+        return
+
+    application = build_application(Database("bot_data.db"))
+
+    logger.info("Bot is starting in %s mode...", BOT_MODE)
+    if BOT_MODE == "webhook":
+        from webhook import run_webhook
+
+        run_webhook(
+            application,
+            url=WEBHOOK_URL,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
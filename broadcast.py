@@ -0,0 +1,218 @@
+"""
+Массовые рассылки по всей таблице users.
+
+Получатели читаются из базы страницами (keyset по user_id), отправка идёт
+через общий token bucket. На 429 bucket замирает на ``retry_after`` и
+снижает скорость, после серии успешных отправок скорость плавно растёт
+обратно (AIMD). Лимит Telegram «1 сообщение в секунду в чат» соблюдается
+сам собой: каждый чат получает одно сообщение за рассылку, а повтор после
+429 идёт не раньше чем через ``retry_after`` секунд.
+
+Прогресс сохраняется в таблице broadcasts после каждой страницы, поэтому
+после перезапуска рассылка продолжается с места остановки (в худшем случае
+повторно уйдёт одна страница).
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from config import BROADCAST_RATE
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 500
+MAX_ATTEMPTS = 5
+MIN_RATE = 1.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    @property
+    def paused(self) -> bool:
+        return time.monotonic() < self._paused_until
+
+    def pause(self, seconds: float):
+        """Полная остановка отправки на ``seconds`` (ответ 429)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+def retry_after_seconds(retry_after) -> float:
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+class Broadcaster:
+    def __init__(self, db: AsyncDatabase, rate: float = BROADCAST_RATE,
+                 page_size: int = PAGE_SIZE):
+        self.db = db
+        self.max_rate = rate
+        self.page_size = page_size
+        self.bucket = TokenBucket(rate)
+        self.flood_errors = 0
+        self._streak = 0
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._started: Dict[int, float] = {}
+        self._cancelled = set()
+
+    # ---- Управление ----
+
+    async def start(self, bot, admin_id: int, text: str) -> int:
+        broadcast_id = await self.db.create_broadcast(admin_id, text)
+        self._spawn(bot, await self.db.get_broadcast(broadcast_id))
+        return broadcast_id
+
+    async def resume(self, bot):
+        """Продолжает рассылки, прерванные перезапуском бота."""
+        for broadcast in await self.db.get_running_broadcasts():
+            if broadcast["id"] not in self._tasks:
+                logger.info("Resuming broadcast #%s after user %s",
+                            broadcast["id"], broadcast["last_user_id"])
+                self._spawn(bot, broadcast)
+
+    async def stop_all(self, resume_later: bool = False) -> int:
+        """Останавливает рассылки. С ``resume_later`` (выключение бота)
+        они остаются в статусе running и продолжатся после перезапуска."""
+        tasks = list(self._tasks.items())
+        for broadcast_id, task in tasks:
+            if not resume_later:
+                self._cancelled.add(broadcast_id)
+            task.cancel()
+        await asyncio.gather(*(task for _, task in tasks), return_exceptions=True)
+        return len(tasks)
+
+    def is_running(self, broadcast_id: int) -> bool:
+        return broadcast_id in self._tasks
+
+    def rate_per_second(self, broadcast: dict) -> float:
+        started = self._started.get(broadcast["id"])
+        if not started:
+            return 0.0
+        done = broadcast["sent"] + broadcast["failed"] + broadcast["blocked"]
+        return done / max(time.monotonic() - started, 1e-9)
+
+    def _spawn(self, bot, broadcast: dict):
+        task = asyncio.create_task(self._run(bot, broadcast))
+        self._tasks[broadcast["id"]] = task
+        self._started[broadcast["id"]] = time.monotonic()
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast["id"], None))
+
+    # ---- Отправка ----
+
+    async def _run(self, bot, broadcast: dict):
+        broadcast_id = broadcast["id"]
+        after_id = broadcast["last_user_id"]
+        counts = {key: broadcast[key] for key in ("sent", "failed", "blocked")}
+        status = "failed"
+        try:
+            while True:
+                page = await self.db.get_user_ids_page(after_id, self.page_size)
+                if not page:
+                    break
+                results = await asyncio.gather(
+                    *(self._send(bot, chat_id, broadcast["text"]) for chat_id in page)
+                )
+                for result in results:
+                    counts[result] += 1
+                after_id = page[-1]
+                await self.db.save_broadcast_progress(broadcast_id, after_id, **counts)
+            status = "done"
+        except asyncio.CancelledError:
+            status = "cancelled" if broadcast_id in self._cancelled else "running"
+            self._cancelled.discard(broadcast_id)
+            raise
+        except Exception:
+            logger.exception("Broadcast #%s failed", broadcast_id)
+        finally:
+            await self.db.save_broadcast_progress(
+                broadcast_id, after_id, status=status, **counts
+            )
+            elapsed = time.monotonic() - self._started.pop(broadcast_id, time.monotonic())
+            logger.info("Broadcast #%s %s: %s in %.1f s", broadcast_id, status, counts, elapsed)
+
+        total = sum(counts.values())
+        try:
+            await bot.send_message(
+                chat_id=broadcast["admin_id"],
+                text=(
+                    f"📣 Рассылка #{broadcast_id} завершена\n"
+                    f"✅ Доставлено: {counts['sent']}\n"
+                    f"🚫 Заблокировали бота: {counts['blocked']}\n"
+                    f"❌ Ошибки: {counts['failed']}\n"
+                    f"⏱ {elapsed:.0f} с, {total / max(elapsed, 1e-9):.1f} сообщ./с, "
+                    f"429: {self.flood_errors}"
+                ),
+            )
+        except TelegramError as e:
+            logger.error("Failed to send broadcast report: %s", e)
+
+    async def _send(self, bot, chat_id: int, text: str) -> str:
+        for _ in range(MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+            except RetryAfter as e:
+                self._on_flood(retry_after_seconds(e.retry_after))
+                continue
+            except Forbidden:
+                return "blocked"
+            except BadRequest as e:
+                logger.debug("Broadcast to %s rejected: %s", chat_id, e)
+                return "failed"
+            except NetworkError:
+                await asyncio.sleep(1)
+                continue
+            except TelegramError as e:
+                logger.debug("Broadcast to %s failed: %s", chat_id, e)
+                return "failed"
+            self._on_success()
+            return "sent"
+        return "failed"
+
+    def _on_flood(self, retry_after: float):
+        """Мультипликативно снижает скорость и ждёт retry_after.
+
+        Несколько 429 подряд от запросов, отправленных до паузы, — это один
+        и тот же эпизод: скорость снижается только на первом из них.
+        """
+        self.flood_errors += 1
+        self._streak = 0
+        if not self.bucket.paused:
+            self.bucket.rate = max(MIN_RATE, self.bucket.rate * 0.7)
+            logger.warning("Broadcast hit 429, pausing %.1f s, rate now %.1f/s",
+                           retry_after, self.bucket.rate)
+        self.bucket.pause(retry_after)
+
+    def _on_success(self):
+        """Аддитивно возвращает скорость после серии успешных отправок."""
+        self._streak += 1
+        if self._streak >= self.bucket.rate * 5 and self.bucket.rate < self.max_rate:
+            self.bucket.rate = min(self.max_rate, self.bucket.rate + 1)
+            self._streak = 0
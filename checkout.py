@@ -0,0 +1,184 @@
+"""
+Проверка оплаты на pre_checkout_query без обращения к диску.
+
+На ответ у бота 10 секунд, а деньги списываются только после ok=True,
+поэтому все ограничения кампании проверяются здесь:
+  * продажи закрыты после /draw (и вручную через /sales);
+  * число мест на планах со ``slots`` (PLATINUM_SLOTS);
+  * покупок на одного пользователя (MAX_PURCHASES_PER_USER).
+
+Счётчики держатся в памяти: проданное по планам и покупки плательщиков
+читаются из базы при старте, дальше их меняет ``confirm`` из
+successful_payment. ``reserve`` — синхронная проверка и захват места без
+единого await, поэтому в одном event loop две одновременные оплаты не
+займут одно и то же место. Бронь, за которой за RESERVATION_TTL секунд
+не пришёл successful_payment, истекает, но держит место, пока счётчики не
+сверены с базой: в многопроцессном режиме все pre_checkout_query идут в
+нулевой воркер, а successful_payment — в воркер пользователя, и оплату по
+брони мог записать только он. Хендлер перед ``reserve`` дожидается сверки
+(``expire``), поэтому запрос, на котором бронь истекла, видит уже
+освобождённое место, а места, оплаченные в другом воркере, не продаются
+повторно.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict, namedtuple
+from typing import Dict, Optional
+
+from config import MAX_PURCHASES_PER_USER, RESERVATION_TTL
+from screens import PLANS, PLANS_BY_PAYLOAD
+
+logger = logging.getLogger(__name__)
+
+# Причины отказа (ключи CHECKOUT_ERRORS в screens)
+CLOSED = "closed"
+SOLD_OUT = "sold_out"
+USER_LIMIT = "user_limit"
+INVALID = "invalid"
+
+Reservation = namedtuple("Reservation", "user_id plan_id expires")
+
+
+class CheckoutGuard:
+    def __init__(self, db, slots: Dict[str, int] = None,
+                 max_per_user: int = MAX_PURCHASES_PER_USER,
+                 ttl: float = RESERVATION_TTL, clock=time.monotonic):
+        self.db = db
+        if slots is None:
+            slots = {plan_id: plan["slots"] for plan_id, plan in PLANS.items() if plan.get("slots")}
+        self.slots = slots
+        self.max_per_user = max_per_user
+        self.ttl = ttl
+        self.clock = clock
+        self.closed = False
+        self._sold: Dict[str, int] = {}
+        self._purchases: Dict[int, int] = {}
+        # id запроса -> бронь; TTL у всех один, поэтому порядок вставки = порядок истечения
+        self._reservations: "OrderedDict[str, Reservation]" = OrderedDict()
+        self._held: Dict[str, int] = {}
+        self._user_held: Dict[int, int] = {}
+        # Истёкшие брони держат место, пока счётчики не сверены с базой
+        self._expired = []
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def load(self):
+        """Счётчики из базы; вызывается до приёма апдейтов."""
+        self._sold, purchases, self.closed = await self.db.get_checkout_counts(
+            list(self.slots), None if self.max_per_user else []
+        )
+        self._purchases = purchases
+
+    # ---- Горячий путь ----
+
+    def reserve(self, query_id: str, user_id: int, payload: str, amount: int,
+                currency: str = "XTR") -> Optional[str]:
+        """Проверяет оплату и бронирует место. None — можно, иначе причина отказа."""
+        plan_id, plan = PLANS_BY_PAYLOAD.get(payload, (None, None))
+        if plan is None or amount != plan["stars"] or currency != "XTR":
+            return INVALID
+        if self.closed:
+            return CLOSED
+        self._expire()
+
+        limit = self.slots.get(plan_id)
+        if limit and self._sold.get(plan_id, 0) + self._held.get(plan_id, 0) >= limit:
+            return SOLD_OUT
+        if self.max_per_user and (
+            self._purchases.get(user_id, 0) + self._user_held.get(user_id, 0)
+            >= self.max_per_user
+        ):
+            return USER_LIMIT
+
+        self._reservations[query_id] = Reservation(user_id, plan_id, self.clock() + self.ttl)
+        self._hold(user_id, plan_id, 1)
+        return None
+
+    def confirm(self, user_id: int, plan_id: str):
+        """Оплата прошла: бронь становится покупкой (или покупка без брони)."""
+        for query_id, reservation in self._reservations.items():
+            if reservation.user_id == user_id and reservation.plan_id == plan_id:
+                del self._reservations[query_id]
+                self._hold(user_id, plan_id, -1)
+                break
+        self._sold[plan_id] = self._sold.get(plan_id, 0) + 1
+        self._purchases[user_id] = self._purchases.get(user_id, 0) + 1
+
+    def _hold(self, user_id: int, plan_id: str, delta: int):
+        self._held[plan_id] = self._held.get(plan_id, 0) + delta
+        held = self._user_held.get(user_id, 0) + delta
+        if held:
+            self._user_held[user_id] = held
+        else:
+            self._user_held.pop(user_id, None)
+
+    # ---- Истечение броней ----
+
+    async def expire(self):
+        """Истёкшие брони со сверкой счётчиков; хендлер ждёт её перед ``reserve``.
+
+        Если истёкших броней нет, возвращается без единого await.
+        """
+        self._expire()
+        if self._refresh_task is not None and not self._refresh_task.done():
+            # shield: отмена апдейта не должна прерывать сверку
+            await asyncio.shield(self._refresh_task)
+
+    def _expire(self):
+        now = self.clock()
+        while self._reservations:
+            query_id, reservation = next(iter(self._reservations.items()))
+            if reservation.expires > now:
+                break
+            del self._reservations[query_id]
+            self._expired.append(reservation)
+        if self._expired and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh())
+
+    async def _refresh(self):
+        # Брони, истёкшие во время чтения, сверяются следующим проходом
+        while self._expired:
+            expired, self._expired = self._expired, []
+            try:
+                sold, purchases, _ = await self.db.get_checkout_counts(
+                    list(self.slots),
+                    sorted({r.user_id for r in expired}) if self.max_per_user else [],
+                )
+            except Exception:
+                logger.exception("Failed to refresh checkout counters")
+                sold, purchases = {}, {}
+            # Счётчики только растут: берём большее из памяти и базы
+            for plan_id, count in sold.items():
+                self._sold[plan_id] = max(self._sold.get(plan_id, 0), count)
+            for user_id, count in purchases.items():
+                self._purchases[user_id] = max(self._purchases.get(user_id, 0), count)
+            for reservation in expired:
+                self._hold(reservation.user_id, reservation.plan_id, -1)
+            logger.info("Released %d expired checkout reservations", len(expired))
+
+    # ---- Управление продажами ----
+
+    async def set_closed(self, closed: bool):
+        self.closed = closed
+        await self.db.set_sales_closed(closed)
+
+    @property
+    def reserved(self) -> int:
+        self._expire()
+        return len(self._reservations) + len(self._expired)
+
+    def status(self) -> dict:
+        self._expire()
+        return {
+            "closed": self.closed,
+            "reserved": self.reserved,
+            "plans": {
+                plan_id: {
+                    "sold": self._sold.get(plan_id, 0),
+                    "held": self._held.get(plan_id, 0),
+                    "slots": limit,
+                }
+                for plan_id, limit in self.slots.items()
+            },
+        }
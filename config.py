@@ -2,3 +2,61 @@ import os
 
 BOT_TOKEN = os.getenv("BOT_TOKEN", "8580771359:AAH_OjbUC10J59htA43yt5DH2qS3c3Kf7F8")
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_ID", "5495453929").split(",")]
+
+# Режим получения апдейтов: "polling" или "webhook"; по умолчанию webhook,
+# если задан WEBHOOK_URL. Процесс один — режим выбирает только конфигурация
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+BOT_MODE = os.getenv("BOT_MODE", "webhook" if WEBHOOK_URL else "polling")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", os.getenv("WEBHOOK_PORT", "8443")))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Сколько апдейтов обрабатывается одновременно (апдейты одного пользователя — по очереди).
+# Больше — не быстрее: пул соединений httpx на каждый запрос к Bot API перебирает все
+# открытые соединения и ждущие запросы, и на одном ядре эта работа растёт с числом
+# одновременных апдейтов (bench_webhook: 16 — 110-135 upd/s, 64 — 51-60 upd/s)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+# Число процессов-воркеров; при > 1 апдейты распределяются между ними по user_id
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+
+# Рассылки: сообщений в секунду (лимит Telegram — около 30/с на бота)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+
+# Метрики: METRICS_ENABLED=1 включает замеры, /metrics и /perf
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Защита от флуда: апдейтов в секунду на пользователя, размер всплеска,
+# сколько пользователей держать в памяти
+FLOOD_RATE = float(os.getenv("FLOOD_RATE", "2"))
+FLOOD_BURST = float(os.getenv("FLOOD_BURST", "5"))
+FLOOD_MAX_USERS = int(os.getenv("FLOOD_MAX_USERS", "100000"))
+
+# Состояние диалогов и user_data в bot_data.db: как часто сбрасывать изменения, секунды
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "5"))
+
+# Именные сертификаты: процессов рендера, каталог кеша (относительно базы), шрифт с кириллицей
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+CERTIFICATES_DIR = os.getenv("CERTIFICATES_DIR", "certificates")
+FONT_PATH = os.getenv("FONT_PATH", "")
+
+# Ограничения продаж: мест на PLATINUM, покупок на пользователя (0 — без ограничения),
+# сколько секунд держать место между pre_checkout_query и successful_payment
+PLATINUM_SLOTS = int(os.getenv("PLATINUM_SLOTS", "0"))
+MAX_PURCHASES_PER_USER = int(os.getenv("MAX_PURCHASES_PER_USER", "0"))
+RESERVATION_TTL = float(os.getenv("RESERVATION_TTL", "120"))
+
+# Онлайн-бэкапы базы: интервал в секундах (0 — выключены), каталог (относительно базы),
+# сколько снимков хранить, сжимать ли gzip, страниц за шаг и пауза между шагами, секунды
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", "3600"))
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "24"))
+BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS", "1") == "1"
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "256"))
+BACKUP_STEP_PAUSE = float(os.getenv("BACKUP_STEP_PAUSE", "0.005"))
+
+# Рейтинг: сколько первых мест показывать; как часто перестраивать его из базы
+# в многопроцессном режиме, секунды (с одним процессом он всегда точный)
+LEADERBOARD_SIZE = int(os.getenv("LEADERBOARD_SIZE", "10"))
+LEADERBOARD_REFRESH = float(os.getenv("LEADERBOARD_REFRESH", "30"))
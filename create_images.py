@@ -4,8 +4,10 @@
 После — замени их своими реальными картинками.
 """
 
-from PIL import Image, ImageDraw, ImageFont
 import os
+from concurrent.futures import ProcessPoolExecutor
+
+from render import save_screen
 
 os.makedirs("images", exist_ok=True)
 
@@ -47,46 +49,18 @@ IMAGES = {
     },
 }
 
-W, H = 800, 450
-
-
-def create_image(filename: str, bg: tuple, text: str):
-    img = Image.new("RGB", (W, H), color=bg)
-    draw = ImageDraw.Draw(img)
-
-    # Градиентное затемнение снизу
-    for y in range(H):
-        alpha = int(80 * y / H)
-        draw.line([(0, y), (W, y)], fill=tuple(max(0, c - alpha) for c in bg))
-
-    # Декоративные круги
-    for cx, cy, r, col in [
-        (50, 50, 80, (255, 255, 255, 30)),
-        (W - 60, H - 60, 100, (255, 220, 0, 20)),
-        (W // 2, 30, 60, (255, 255, 255, 15)),
-    ]:
-        for i in range(3):
-            draw.ellipse(
-                [cx - r + i * 5, cy - r + i * 5, cx + r - i * 5, cy + r - i * 5],
-                outline=(255, 255, 255, 50 - i * 15),
-                width=2,
-            )
-
-    # Текст (базовый, без спецшрифта)
-    lines = text.split("\n")
-    y_start = H // 2 - len(lines) * 30
-    for i, line in enumerate(lines):
-        # Убираем эмодзи для PIL (нет поддержки по умолчанию)
-        clean = "".join(c for c in line if ord(c) < 65536)
-        draw.text((W // 2, y_start + i * 55), clean, fill="white", anchor="mm")
-
-    img.save(f"images/{filename}.jpg", "JPEG", quality=90)
-    print(f"✅ images/{filename}.jpg")
-
-
 if __name__ == "__main__":
     print("🎨 Генерация изображений-заглушек...")
-    for name, cfg in IMAGES.items():
-        create_image(name, cfg["bg"], cfg["text"])
+    # Картинки независимы — рендерим их параллельно по ядрам
+    with ProcessPoolExecutor() as pool:
+        paths = pool.map(
+            save_screen,
+            ["images"] * len(IMAGES),
+            IMAGES,
+            [cfg["bg"] for cfg in IMAGES.values()],
+            [cfg["text"] for cfg in IMAGES.values()],
+        )
+        for path in paths:
+            print(f"✅ {path}")
     print("\n✅ Готово! Замени изображения в папке images/ своими реальными картинками.")
     print("   Рекомендуемый размер: 800×450 px, формат JPG")
@@ -1,83 +1,539 @@
 """"""  
 
+import asyncio
+import json
+import logging
+import queue
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
+
+import migrations
+from lottery import WeightedLottery
+
+logger = logging.getLogger(__name__)
+
+# Прагмы для каждого соединения. journal_mode=WAL хранится в самом файле,
+# поэтому его достаточно выставить один раз на writer-соединении.
+CONNECTION_PRAGMAS = (
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+)
+
+# Group commit: пачка уходит в базу через WRITE_BATCH_DELAY секунд
+# или сразу по достижении WRITE_BATCH_SIZE вызовов
+WRITE_BATCH_SIZE = 500
+WRITE_BATCH_DELAY = 0.005
+BATCHED_WRITES = frozenset({"add_user", "add_tickets", "add_wish"})
+FLUSH_BEFORE = frozenset({"add_payment"})
+
+# Наборы для выгрузки: (SELECT ... FROM ..., доп. условие, индексированная колонка
+# времени изменения для инкрементальной выгрузки)
+EXPORT_QUERIES = {
+    "wishes": (
+        "SELECT user_id, username, wish, updated_at FROM users",
+        "wish IS NOT NULL", "updated_at",
+    ),
+    "participants": (
+        """SELECT user_id, username, plan_key, stars_paid, invites_req AS tickets,
+                  wish IS NOT NULL AS has_wish, created_at, updated_at FROM users""",
+        "", "updated_at",
+    ),
+    "referrals": (
+        "SELECT inviter_id, invited_id, created_at FROM referrals", "", "created_at",
+    ),
+    "payments": (
+        "SELECT charge_id, user_id, plan_key, stars, tickets, created_at FROM payments",
+        "", "created_at",
+    ),
+}
+EXPORT_PAGE_SIZE = 1000
 
 
 class Database:
-    def __init__(self, db_path: str = "bot_data.db"):
+    """SQLite-хранилище с долгоживущими соединениями.
+
+    Все записи идут через одно writer-соединение под блокировкой,
+    чтения — через небольшой пул reader-соединений (WAL позволяет
+    читать параллельно с записью). Методы синхронные; для async-кода
+    есть ``run()`` и обёртка ``AsyncDatabase``.
+
+    Изменения очков рейтинга (билеты, приглашения) копятся внутри
+    транзакции и после COMMIT передаются слушателям ``add_listener``;
+    откаченный SAVEPOINT свои изменения не передаёт.
+    """
+
+    def __init__(self, db_path: str = "bot_data.db", readers: int = 4):
         self.db_path = db_path
+        self._write_lock = threading.RLock()
+        self._tx_depth = 0
+        self._listeners = []
+        self._changes = []
+        self._writer = self._connect()
+        # FULL: каждый COMMIT делает fsync WAL, и записанное переживает
+        # отключение питания (с NORMAL последние коммиты могут откатиться).
+        # Цену fsync на частых записях делит на пачку WriteQueue
+        self._writer.execute("PRAGMA synchronous=FULL")
+        if db_path != ":memory:":
+            self._writer.execute("PRAGMA journal_mode=WAL")
+        else:
+            # У каждого соединения с :memory: своя база — читаем через writer
+            readers = 0
         self._init_db()
 
-    def _get_conn(self):
-        conn = sqlite3.connect(self.db_path)
+        self._readers = queue.LifoQueue()
+        for _ in range(readers):
+            conn = self._connect()
+            conn.execute("PRAGMA query_only=ON")
+            self._readers.put(conn)
+        self._has_readers = readers > 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=readers + 1, thread_name_prefix="db"
+        )
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path, isolation_level=None, check_same_thread=False
+        )
         conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
         return conn
 
+    @contextmanager
+    def _write(self):
+        """Транзакция на writer-соединении (BEGIN IMMEDIATE ... COMMIT).
+
+        Вложенный вызов (например, из ``apply_batch``) открывает SAVEPOINT:
+        ошибка откатывает только его, внешняя транзакция продолжается.
+        """
+        with self._write_lock:
+            conn = self._writer
+            depth = self._tx_depth
+            if depth:
+                begin = (f"SAVEPOINT sp{depth}",)
+                commit = (f"RELEASE sp{depth}",)
+                rollback = (f"ROLLBACK TO sp{depth}", f"RELEASE sp{depth}")
+            else:
+                begin, commit, rollback = ("BEGIN IMMEDIATE",), ("COMMIT",), ("ROLLBACK",)
+
+            for sql in begin:
+                conn.execute(sql)
+            self._tx_depth += 1
+            if not depth:
+                # Остатки транзакции, на которой упал COMMIT
+                self._changes.clear()
+            mark = len(self._changes)
+            try:
+                yield conn
+            except BaseException:
+                for sql in rollback:
+                    conn.execute(sql)
+                del self._changes[mark:]
+                raise
+            else:
+                for sql in commit:
+                    conn.execute(sql)
+            finally:
+                self._tx_depth -= 1
+
+            if not depth and self._changes:
+                changes, self._changes = self._changes, []
+                self._notify(changes)
+
+    def transaction(self):
+        """Транзакция записи для миграций и скриптов: ``with db.transaction() as conn``.
+
+        То же, что внутренние записи Database: BEGIN IMMEDIATE на
+        writer-соединении, вложенный вызов — SAVEPOINT.
+        """
+        return self._write()
+
+    def snapshot_under_write_lock(self, fn, *args):
+        """``fn(*args)``, пока ни одна транзакция этого Database не коммитится.
+
+        Слушатели ``add_listener`` на это время тоже замирают: состояние,
+        прочитанное в ``fn``, и следующие изменения идут строго друг за
+        другом, ни одно не теряется и не учитывается дважды.
+        """
+        with self._write_lock:
+            return fn(*args)
+
+    def schema_version(self) -> int:
+        """Номер применённой миграции (PRAGMA user_version)."""
+        with self._write_lock:
+            return migrations.schema_version(self._writer)
+
+    def add_listener(self, callback):
+        """``callback(changes)`` после каждого COMMIT с изменениями очков.
+
+        ``changes`` — список ``(доска, user_id, прирост, новое_значение)``,
+        доска ``"tickets"`` или ``"invites"``. Вызывается в потоке базы под
+        блокировкой записи, поэтому должен быть быстрым.
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """Отключает слушателя ``add_listener``."""
+        with self._write_lock:
+            self._listeners.remove(callback)
+
+    def _changed(self, board: str, user_id: int, delta: int, score: int):
+        self._changes.append((board, user_id, delta, score))
+
+    def _notify(self, changes):
+        for callback in self._listeners:
+            try:
+                callback(changes)
+            except Exception:
+                logger.exception("Change listener failed")
+
+    @contextmanager
+    def _read(self):
+        """Соединение из пула читателей; без пула — writer под блокировкой."""
+        if not self._has_readers:
+            with self._write_lock:
+                yield self._writer
+            return
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    async def run(self, func, *args, **kwargs):
+        """Выполняет синхронный метод в пуле потоков, не блокируя event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(func, *args, **kwargs)
+        )
+
+    def apply_batch(self, calls):
+        """Выполняет несколько записей одной транзакцией (один fsync).
+
+        ``calls`` — список ``(имя_метода, args, kwargs)``. Каждый вызов идёт
+        в своём SAVEPOINT, поэтому ошибка одного не откатывает остальные.
+        Возвращает список ``(ok, результат_или_исключение)`` в том же порядке.
+        """
+        results = []
+        with self._write():
+            for name, args, kwargs in calls:
+                try:
+                    results.append((True, getattr(self, name)(*args, **kwargs)))
+                except Exception as e:
+                    results.append((False, e))
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+        with self._write_lock:
+            self._writer.close()
+
     def _init_db(self):
-        with self._get_conn() as conn:
-            conn.executescript(
-                """
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id       INTEGER PRIMARY KEY,
-                    username      TEXT,
-                    plan_key      TEXT,
-                    stars_paid    INTEGER DEFAULT 0,
-                    invites_req   INTEGER DEFAULT 0,
-                    wish          TEXT,
-                    completed     INTEGER DEFAULT 0,
-                    created_at    TEXT DEFAULT (datetime('now'))
-                );
-
-                CREATE TABLE IF NOT EXISTS referrals (
-                    id            INTEGER PRIMARY KEY AUTOINCREMENT,
-                    inviter_id    INTEGER NOT NULL,
-                    invited_id    INTEGER NOT NULL UNIQUE,
-                    created_at    TEXT DEFAULT (datetime('now')),
-                    FOREIGN KEY (inviter_id) REFERENCES users(user_id)
-                );
-                """
-            )
+        """Применяет недостающие миграции; на актуальной схеме — ни одного DDL.
+
+        Отложенные шаги (построение индексов) выполняет ``migrate_deferred``
+        уже после старта бота.
+        """
+        migrations.migrate(self)
+
+    def migrate_deferred(self):
+        """Отложенные миграции: индексы строятся, пока бот уже работает.
+
+        Идут на своём соединении и не занимают ни блокировку записи, ни
+        пул потоков базы; из async-кода — через ``asyncio.to_thread``.
+        """
+        if self.db_path == ":memory:":
+            # Другое соединение с :memory: открыло бы пустую базу
+            return migrations.migrate(self, include_deferred=True)
+        return migrations.migrate_deferred(self.db_path)
+
+    # ---- Счётчики статистики ----
+
+    def seed_aggregates(self, conn):
+        """Заполняет counters и referral_stats по уже лежащим в базе данным.
+
+        Шаг миграции: на базе, где агрегаты уже есть, ничего не делает.
+        """
+        self._seed_counters(conn)
+        self._seed_referral_stats(conn)
+
+    def _seed_counters(self, conn):
+        """Один раз заполняет counters по существующим данным.
+
+        Дальше счётчики меняются в тех же транзакциях, что и сами данные,
+        поэтому /stats не сканирует таблицы.
+        """
+        if conn.execute("SELECT 1 FROM counters LIMIT 1").fetchone():
+            return
+        row = conn.execute(
+            """SELECT COUNT(*) AS users,
+                      COALESCE(SUM(invites_req), 0) AS tickets,
+                      COUNT(wish) AS wishes
+               FROM users"""
+        ).fetchone()
+        self._bump(conn, "total_users", row["users"])
+        self._bump(conn, "total_tickets", row["tickets"])
+        self._bump(conn, "total_wishes", row["wishes"])
+        for plan in conn.execute(
+            """SELECT plan_key, COUNT(*) AS payments, SUM(stars_paid) AS stars
+               FROM users WHERE plan_key IS NOT NULL GROUP BY plan_key"""
+        ):
+            self._bump(conn, f"plan:{plan['plan_key']}:payments", plan["payments"])
+            self._bump(conn, f"plan:{plan['plan_key']}:stars", plan["stars"] or 0)
+
+    @staticmethod
+    def _bump(conn, name: str, delta: int):
+        conn.execute(
+            """INSERT INTO counters (name, value) VALUES (?, ?)
+               ON CONFLICT(name) DO UPDATE SET value = value + excluded.value""",
+            (name, delta),
+        )
 
     # ---- Пользователи ----
 
     def add_user(self, user_id: int, username: str, referrer_id: int = None):
-        with self._get_conn() as conn:
-            conn.execute(
-                "INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)",
+        with self._write() as conn:
+            cur = conn.execute(
+                """INSERT OR IGNORE INTO users (user_id, username, updated_at)
+                VALUES (?, ?, datetime('now'))""",
                 (user_id, username),
             )
+            if cur.rowcount:
+                self._bump(conn, "total_users", 1)
 
-            # Обработка реферала
-            if referrer_id:
-                conn.execute(
-                    """INSERT INTO referrals (inviter_id, invited_id) 
-                    VALUES (?, ?)""",
-                    (referrer_id, user_id),
+            # Реферал засчитывается только новому пользователю
+            if referrer_id and cur.rowcount and referrer_id != user_id:
+                self._add_referral(conn, referrer_id, user_id)
+
+    # ---- Рефералы ----
+
+    def _add_referral(self, conn, inviter_id: int, invited_id: int):
+        cur = conn.execute(
+            """INSERT OR IGNORE INTO referrals (inviter_id, invited_id)
+            VALUES (?, ?)""",
+            (inviter_id, invited_id),
+        )
+        if not cur.rowcount:
+            return
+
+        # Добавляем билет рефереру
+        row = conn.execute(
+            """UPDATE users SET invites_req = invites_req + 1, updated_at = datetime('now')
+            WHERE user_id=? RETURNING invites_req""",
+            (inviter_id,),
+        ).fetchone()
+        if row:
+            self._bump(conn, "total_tickets", 1)
+            self._changed("tickets", inviter_id, 1, row[0])
+
+        row = conn.execute(
+            "SELECT depth FROM referral_stats WHERE user_id=?", (inviter_id,)
+        ).fetchone()
+        depth = row["depth"] + 1 if row else 1
+        conn.execute(
+            "INSERT OR IGNORE INTO referral_stats (user_id, depth) VALUES (?, ?)",
+            (invited_id, depth),
+        )
+        row = conn.execute(
+            """INSERT INTO referral_stats (user_id, invites) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET invites = invites + 1
+            RETURNING invites""",
+            (inviter_id,),
+        ).fetchone()
+        self._changed("invites", inviter_id, 1, row[0])
+
+        # Приглашённый — новый лист, поэтому поддерево растёт у всей цепочки
+        # предков: O(глубина) запросов по UNIQUE-индексу invited_id
+        ancestor = inviter_id
+        for _ in range(depth):
+            conn.execute(
+                """INSERT INTO referral_stats (user_id, subtree) VALUES (?, 1)
+                ON CONFLICT(user_id) DO UPDATE SET subtree = subtree + 1""",
+                (ancestor,),
+            )
+            row = conn.execute(
+                "SELECT inviter_id FROM referrals WHERE invited_id=?", (ancestor,)
+            ).fetchone()
+            if not row:
+                break
+            ancestor = row["inviter_id"]
+
+    def _seed_referral_stats(self, conn):
+        """Один раз строит referral_stats по существующей таблице referrals."""
+        if conn.execute("SELECT 1 FROM referral_stats LIMIT 1").fetchone():
+            return
+        parent = {
+            row[0]: row[1]
+            for row in conn.execute("SELECT invited_id, inviter_id FROM referrals")
+        }
+        if not parent:
+            return
+
+        # user_id -> [invites, subtree, depth]
+        stats = {}
+        for invited_id, inviter_id in parent.items():
+            stats.setdefault(inviter_id, [0, 0, 0])[0] += 1
+            # Поднимаемся по цепочке; seen защищает от циклов в старых данных
+            seen = {invited_id}
+            ancestor = inviter_id
+            depth = 0
+            while ancestor is not None and ancestor not in seen:
+                seen.add(ancestor)
+                stats.setdefault(ancestor, [0, 0, 0])[1] += 1
+                depth += 1
+                ancestor = parent.get(ancestor)
+            stats.setdefault(invited_id, [0, 0, 0])[2] = depth
+
+        conn.executemany(
+            """INSERT INTO referral_stats (user_id, invites, subtree, depth)
+            VALUES (?, ?, ?, ?)""",
+            ((user_id, *values) for user_id, values in stats.items()),
+        )
+
+    def get_referral_stats(self, user_id: int):
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT invites, subtree, depth FROM referral_stats WHERE user_id=?",
+                (user_id,),
+            ).fetchone()
+            return dict(row) if row else {"invites": 0, "subtree": 0, "depth": 0}
+
+    def get_top_inviters(self, limit: int = 10):
+        with self._read() as conn:
+            rows = conn.execute(
+                """SELECT s.user_id, s.invites, s.subtree, u.username
+                FROM referral_stats s LEFT JOIN users u ON u.user_id = s.user_id
+                WHERE s.invites > 0
+                ORDER BY s.invites DESC LIMIT ?""",
+                (limit,),
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def get_referral_chain(self, user_id: int, limit: int = 20):
+        """Цепочка пригласивших вверх от user_id (рекурсивный CTE)."""
+        with self._read() as conn:
+            rows = conn.execute(
+                """WITH RECURSIVE chain(user_id, level) AS (
+                    SELECT inviter_id, 1 FROM referrals WHERE invited_id = ?
+                    UNION ALL
+                    SELECT r.inviter_id, chain.level + 1
+                    FROM referrals r JOIN chain ON r.invited_id = chain.user_id
+                    WHERE chain.level < ?
                 )
-                # Добавляем билет рефереру
-                conn.execute(
-                    """UPDATE users SET invites_req = invites_req + 1 
-                    WHERE user_id=?""",
-                    (referrer_id,),
+                SELECT user_id FROM chain ORDER BY level""",
+                (user_id, limit),
+            ).fetchall()
+            return [row[0] for row in rows]
+
+    def get_referral_levels(self, user_id: int, max_depth: int = 5):
+        """Число приглашённых на каждом уровне вниз (до max_depth)."""
+        with self._read() as conn:
+            rows = conn.execute(
+                """WITH RECURSIVE tree(user_id, level) AS (
+                    SELECT invited_id, 1 FROM referrals WHERE inviter_id = ?
+                    UNION ALL
+                    SELECT r.invited_id, tree.level + 1
+                    FROM referrals r JOIN tree ON r.inviter_id = tree.user_id
+                    WHERE tree.level < ?
                 )
+                SELECT level, COUNT(*) AS cnt FROM tree GROUP BY level ORDER BY level""",
+                (user_id, max_depth),
+            ).fetchall()
+            return [(row["level"], row["cnt"]) for row in rows]
 
     def add_tickets(self, user_id: int, count: int):
-        with self._get_conn() as conn:
-            conn.execute(
-                "UPDATE users SET invites_req = invites_req + ? WHERE user_id=?",
+        with self._write() as conn:
+            row = conn.execute(
+                """UPDATE users SET invites_req = invites_req + ?, updated_at = datetime('now')
+                WHERE user_id=? RETURNING invites_req""",
                 (count, user_id),
+            ).fetchone()
+            if row:
+                self._bump(conn, "total_tickets", count)
+                self._changed("tickets", user_id, count, row[0])
+
+    def add_payment(self, charge_id: str, user_id: int, plan_key: str,
+                    stars: int, tickets: int) -> bool:
+        """Записывает оплату в журнал payments и начисляет билеты.
+
+        Ключ журнала — telegram_payment_charge_id, поэтому повторно
+        доставленный апдейт ничего не меняет. Возвращает False для дубля.
+        Баланс (users.invites_req), выручка по планам и по часам
+        обновляются в той же транзакции.
+        """
+        with self._write() as conn:
+            cur = conn.execute(
+                """INSERT OR IGNORE INTO payments
+                (charge_id, user_id, plan_key, stars, tickets)
+                VALUES (?, ?, ?, ?, ?)""",
+                (charge_id, user_id, plan_key, stars, tickets),
             )
+            if not cur.rowcount:
+                return False
 
-    def add_wish(self, user_id: int, wish: str):
-        with self._get_conn() as conn:
+            # Оплата без /start: заводим пользователя, чтобы не потерять билеты
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO users (user_id, updated_at) VALUES (?, datetime('now'))",
+                (user_id,)
+            )
+            if cur.rowcount:
+                self._bump(conn, "total_users", 1)
+            row = conn.execute(
+                """UPDATE users SET invites_req = invites_req + ?,
+                                    stars_paid = stars_paid + ?,
+                                    plan_key = ?,
+                                    updated_at = datetime('now')
+                WHERE user_id=? RETURNING invites_req""",
+                (tickets, stars, plan_key, user_id),
+            ).fetchone()
+            self._bump(conn, "total_tickets", tickets)
+            self._changed("tickets", user_id, tickets, row[0])
+            self._bump(conn, f"plan:{plan_key}:payments", 1)
+            self._bump(conn, f"plan:{plan_key}:stars", stars)
             conn.execute(
-                "UPDATE users SET wish=? WHERE user_id=?",
+                """INSERT INTO payments_hourly (hour, payments, stars)
+                VALUES (strftime('%Y-%m-%d %H:00', 'now'), 1, ?)
+                ON CONFLICT(hour) DO UPDATE SET
+                    payments = payments + 1,
+                    stars = stars + excluded.stars""",
+                (stars,),
+            )
+            return True
+
+    def get_user_payments(self, user_id: int):
+        with self._read() as conn:
+            rows = conn.execute(
+                """SELECT * FROM payments WHERE user_id=?
+                ORDER BY created_at DESC""",
+                (user_id,),
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def add_wish(self, user_id: int, wish: str):
+        with self._write() as conn:
+            cur = conn.execute(
+                """UPDATE users SET wish=?, updated_at = datetime('now')
+                WHERE user_id=? AND wish IS NULL""",
                 (wish, user_id),
             )
+            if cur.rowcount:
+                self._bump(conn, "total_wishes", 1)
+            else:
+                conn.execute(
+                    "UPDATE users SET wish=?, updated_at = datetime('now') WHERE user_id=?",
+                    (wish, user_id),
+                )
 
     def get_user_tickets(self, user_id: int) -> int:
-        with self._get_conn() as conn:
+        with self._read() as conn:
             row = conn.execute(
                 "SELECT invites_req FROM users WHERE user_id=?",
                 (user_id,),
@@ -85,15 +541,28 @@ class Database:
             return row["invites_req"] if row else 0
 
     def get_user_invites(self, user_id: int) -> int:
-        with self._get_conn() as conn:
+        with self._read() as conn:
             row = conn.execute(
-                "SELECT COUNT(*) as cnt FROM referrals WHERE inviter_id=?",
+                "SELECT invites FROM referral_stats WHERE user_id=?",
                 (user_id,),
             ).fetchone()
-            return row["cnt"] if row else 0
+            return row["invites"] if row else 0
+
+    def get_usernames(self, user_ids):
+        """user_id -> username (или None) для нескольких пользователей."""
+        if not user_ids:
+            return {}
+        user_ids = list(user_ids)
+        with self._read() as conn:
+            rows = conn.execute(
+                f"""SELECT user_id, username FROM users
+                WHERE user_id IN ({",".join("?" * len(user_ids))})""",
+                user_ids,
+            ).fetchall()
+            return {row["user_id"]: row["username"] for row in rows}
 
     def get_user_info(self, user_id: int):
-        with self._get_conn() as conn:
+        with self._read() as conn:
             row = conn.execute(
                 "SELECT * FROM users WHERE user_id=?",
                 (user_id,),
@@ -102,41 +571,426 @@ class Database:
                 return dict(row)
             return None
 
-    # ---- Админ ----
-
-    def get_stats(self):
-        with self._get_conn() as conn:
-            total_users = conn.execute(
-                "SELECT COUNT(*) as cnt FROM users"
-            ).fetchone()["cnt"]
-            total_tickets = conn.execute(
-                "SELECT SUM(invites_req) as sm FROM users"
-            ).fetchone()["sm"] or 0
-            total_wishes = conn.execute(
-                "SELECT COUNT(*) as cnt FROM users WHERE wish IS NOT NULL"
-            ).fetchone()["cnt"]
+    # ---- Медиа ----
 
+    def get_media_file_ids(self):
+        with self._read() as conn:
             return {
-                "total_users": total_users,
-                "total_tickets": total_tickets,
-                "total_wishes": total_wishes,
+                row["content_hash"]: row["file_id"]
+                for row in conn.execute("SELECT content_hash, file_id FROM media_cache")
             }
 
-    def draw_winner(self):
-        with self._get_conn() as conn:
+    def save_media_file_id(self, content_hash: str, name: str, file_id: str):
+        with self._write() as conn:
+            conn.execute(
+                """INSERT OR REPLACE INTO media_cache (content_hash, name, file_id)
+                VALUES (?, ?, ?)""",
+                (content_hash, name, file_id),
+            )
+
+    # ---- Рассылки ----
+
+    def get_user_ids_page(self, after_user_id: int, limit: int):
+        """Страница user_id по возрастанию (keyset-пагинация по первичному ключу)."""
+        with self._read() as conn:
             rows = conn.execute(
-                "SELECT user_id, invites_req FROM users WHERE invites_req > 0"
+                "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (after_user_id, limit),
+            ).fetchall()
+            return [row[0] for row in rows]
+
+    def create_broadcast(self, admin_id: int, text: str) -> int:
+        with self._write() as conn:
+            cur = conn.execute(
+                "INSERT INTO broadcasts (admin_id, text) VALUES (?, ?)",
+                (admin_id, text),
+            )
+            return cur.lastrowid
+
+    def get_broadcast(self, broadcast_id: int = None):
+        """Рассылка по id; без id — последняя созданная."""
+        with self._read() as conn:
+            if broadcast_id is None:
+                row = conn.execute(
+                    "SELECT * FROM broadcasts ORDER BY id DESC LIMIT 1"
+                ).fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT * FROM broadcasts WHERE id=?", (broadcast_id,)
+                ).fetchone()
+            return dict(row) if row else None
+
+    def get_running_broadcasts(self):
+        with self._read() as conn:
+            rows = conn.execute(
+                "SELECT * FROM broadcasts WHERE status='running' ORDER BY id"
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def save_broadcast_progress(self, broadcast_id: int, last_user_id: int,
+                                sent: int, failed: int, blocked: int,
+                                status: str = "running"):
+        with self._write() as conn:
+            conn.execute(
+                """UPDATE broadcasts SET last_user_id=?, sent=?, failed=?, blocked=?,
+                    status=?,
+                    finished_at=CASE WHEN ?='running' THEN NULL ELSE datetime('now') END
+                WHERE id=?""",
+                (last_user_id, sent, failed, blocked, status, status, broadcast_id),
+            )
+
+    # ---- Состояние диалогов (persistence) ----
+
+    def load_user_state(self, user_id: int):
+        """user_data и состояния диалогов одного пользователя.
+
+        Возвращает (dict или None, [(name, key, state), ...]); ключи и
+        значения хранятся в JSON.
+        """
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT data FROM user_data WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            conversations = [
+                (r["name"], tuple(json.loads(r["conv_key"])), json.loads(r["state"]))
+                for r in conn.execute(
+                    "SELECT name, conv_key, state FROM conversations WHERE user_id = ?",
+                    (user_id,),
+                )
+            ]
+        return (json.loads(row["data"]) if row else None), conversations
+
+    def save_user_state(self, conversations, user_data):
+        """Записывает изменения одной транзакцией.
+
+        conversations — [(name, key, user_id, state)], user_data — [(user_id, data)];
+        state или data, равные None, удаляют запись.
+        """
+        with self._write() as conn:
+            for name, key, user_id, state in conversations:
+                conv_key = json.dumps(list(key))
+                if state is None:
+                    conn.execute(
+                        "DELETE FROM conversations WHERE name = ? AND conv_key = ?",
+                        (name, conv_key),
+                    )
+                else:
+                    conn.execute(
+                        """INSERT INTO conversations (name, conv_key, user_id, state)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT (name, conv_key) DO UPDATE SET
+                            state = excluded.state, updated_at = datetime('now')""",
+                        (name, conv_key, user_id, json.dumps(state)),
+                    )
+            for user_id, data in user_data:
+                if data is None:
+                    conn.execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+                else:
+                    conn.execute(
+                        """INSERT INTO user_data (user_id, data) VALUES (?, ?)
+                        ON CONFLICT (user_id) DO UPDATE SET
+                            data = excluded.data, updated_at = datetime('now')""",
+                        (user_id, json.dumps(data, ensure_ascii=False)),
+                    )
+
+    def get_certificate_payers(self, plan_keys):
+        """Оплатившие любой из ``plan_keys``: план — самый дорогой из оплаченных."""
+        if not plan_keys:
+            return []
+        placeholders = ",".join("?" * len(plan_keys))
+        with self._read() as conn:
+            return conn.execute(
+                f"""SELECT u.user_id, u.username, u.invites_req AS tickets,
+                           p.plan_key, MAX(p.stars) AS stars
+                FROM payments p JOIN users u ON u.user_id = p.user_id
+                WHERE p.plan_key IN ({placeholders})
+                GROUP BY p.user_id""",
+                list(plan_keys),
+            ).fetchall()
+
+    # ---- Рейтинг ----
+
+    def get_leaderboard(self, size: int):
+        """Гистограммы очков и первые ``size`` мест по билетам и приглашениям.
+
+        Для каждой доски — ``([(очки, сколько_пользователей), ...],
+        [(user_id, очки), ...])``. Оба запроса идут по индексам
+        idx_users_tickets и idx_referral_stats_invites без сортировки таблиц.
+        """
+        boards = {
+            "tickets": ("users", "invites_req"),
+            "invites": ("referral_stats", "invites"),
+        }
+        result = {}
+        with self._read() as conn:
+            for board, (table, column) in boards.items():
+                histogram = conn.execute(
+                    f"""SELECT {column}, COUNT(*) FROM {table}
+                    WHERE {column} > 0 GROUP BY {column}"""
+                ).fetchall()
+                top = conn.execute(
+                    f"""SELECT user_id, {column} FROM {table}
+                    WHERE {column} > 0 ORDER BY {column} DESC, user_id LIMIT ?""",
+                    (size,),
+                ).fetchall()
+                result[board] = ([tuple(row) for row in histogram], [tuple(row) for row in top])
+        return result
+
+    # ---- Ограничения продаж ----
+
+    def get_checkout_counts(self, plan_keys, user_ids=None):
+        """Счётчики для checkout.CheckoutGuard.
+
+        Возвращает (оплат по планам из ``plan_keys``, оплат по пользователям,
+        закрыты ли продажи). Оплаты по планам берутся из counters; по
+        пользователям — только для ``user_ids``, при None — по всем плательщикам.
+        """
+        with self._read() as conn:
+            counters = {
+                row["name"]: row["value"]
+                for row in conn.execute(
+                    "SELECT name, value FROM counters WHERE name = 'sales_closed' OR name LIKE 'plan:%'"
+                )
+            }
+            if user_ids is None:
+                rows = conn.execute(
+                    "SELECT user_id, COUNT(*) FROM payments GROUP BY user_id"
+                ).fetchall()
+            elif user_ids:
+                placeholders = ",".join("?" * len(user_ids))
+                rows = conn.execute(
+                    f"""SELECT user_id, COUNT(*) FROM payments
+                    WHERE user_id IN ({placeholders}) GROUP BY user_id""",
+                    list(user_ids),
+                ).fetchall()
+            else:
+                rows = []
+        sold = {plan_key: counters.get(f"plan:{plan_key}:payments", 0) for plan_key in plan_keys}
+        return sold, {row[0]: row[1] for row in rows}, bool(counters.get("sales_closed"))
+
+    def set_sales_closed(self, closed: bool):
+        with self._write() as conn:
+            conn.execute(
+                """INSERT INTO counters (name, value) VALUES ('sales_closed', ?)
+                ON CONFLICT (name) DO UPDATE SET value = excluded.value""",
+                (int(closed),),
+            )
+
+    # ---- Выгрузка ----
+
+    def iter_export(self, dataset: str, since: str = None, page_size: int = EXPORT_PAGE_SIZE):
+        """Потоковая выгрузка набора из EXPORT_QUERIES.
+
+        Первым отдаёт кортеж имён колонок, дальше — страницы строк по
+        ``page_size`` (fetchmany), так что таблица целиком в память не
+        попадает. С ``since`` — только строки, изменённые не раньше этого
+        момента (UTC, формат datetime('now')).
+        """
+        select, condition, changed_column = EXPORT_QUERIES[dataset]
+        conditions, params = [condition] if condition else [], []
+        if since:
+            conditions.append(f"{changed_column} >= ?")
+            params.append(since)
+        sql = select + (" WHERE " + " AND ".join(conditions) if conditions else "")
+        with self._read() as conn:
+            cursor = conn.execute(sql, params)
+            yield tuple(column[0] for column in cursor.description)
+            while True:
+                page = cursor.fetchmany(page_size)
+                if not page:
+                    break
+                yield page
+
+    def get_export_mark(self, dataset: str):
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT exported_at FROM export_marks WHERE dataset = ?", (dataset,)
+            ).fetchone()
+            return row["exported_at"] if row else None
+
+    def save_export_mark(self, dataset: str, exported_at: str):
+        with self._write() as conn:
+            conn.execute(
+                """INSERT INTO export_marks (dataset, exported_at) VALUES (?, ?)
+                ON CONFLICT (dataset) DO UPDATE SET exported_at = excluded.exported_at""",
+                (dataset, exported_at),
+            )
+
+    # ---- Админ ----
+
+    def get_stats(self, hours: int = 24):
+        with self._read() as conn:
+            counters = {
+                row["name"]: row["value"]
+                for row in conn.execute("SELECT name, value FROM counters")
+            }
+            hourly = conn.execute(
+                """SELECT hour, payments, stars FROM payments_hourly
+                ORDER BY hour DESC LIMIT ?""",
+                (hours,),
             ).fetchall()
 
-            if not rows:
-                return None
+        plans = {}
+        for name, value in counters.items():
+            if name.startswith("plan:"):
+                _, plan_key, field = name.split(":")
+                plans.setdefault(plan_key, {"payments": 0, "stars": 0})[field] = value
+
+        return {
+            "total_users": counters.get("total_users", 0),
+            "total_tickets": counters.get("total_tickets", 0),
+            "total_wishes": counters.get("total_wishes", 0),
+            "plans": plans,
+            "payments_per_hour": [dict(row) for row in hourly],
+        }
+
+    def draw_winners(self, count: int = 1, rng=None):
+        """До ``count`` разных победителей, шанс пропорционален билетам."""
+        with self._read() as conn:
+            cursor = conn.execute(
+                "SELECT user_id, invites_req FROM users WHERE invites_req > 0"
+            )
+            lottery = WeightedLottery(((row[0], row[1]) for row in cursor), rng)
+        return lottery.draw_many(count)
+
+    def draw_winner(self):
+        winners = self.draw_winners(1)
+        return winners[0] if winners else None
+
+
+class WriteQueue:
+    """Group commit для частых записей из async-кода.
+
+    Вызовы копятся в очереди и уходят в базу одной транзакцией — через
+    ``max_delay`` секунд после первого вызова в пачке или сразу, как только
+    набралось ``max_batch`` штук. ``await submit(...)`` завершается только
+    после COMMIT пачки, в которую попал вызов.
+
+    Writer-соединение работает с synchronous=FULL, поэтому COMMIT пачки —
+    это fsync WAL: завершившийся ``submit`` переживает и падение процесса,
+    и отключение питания. Один fsync приходится на всю пачку.
+    """
+
+    def __init__(self, db: Database, max_batch: int = WRITE_BATCH_SIZE,
+                 max_delay: float = WRITE_BATCH_DELAY):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = []
+        self._has_items = asyncio.Event()
+        self._commit_now = asyncio.Event()
+        self._task = None
+        # Пачка, которая уже снята с очереди и сейчас коммитится
+        self._in_flight = None
+
+    async def submit(self, name: str, *args, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((name, args, kwargs, future))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch:
+            self._commit_now.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return await future
+
+    async def flush(self):
+        """Немедленно коммитит всё, что накопилось, и ждёт COMMIT.
+
+        Ждёт и пачку, которая уже снята с очереди и коммитится: пачки идут
+        по порядку, поэтому маркер в очереди завершится после неё.
+        """
+        if self._pending:
+            future = asyncio.get_running_loop().create_future()
+            self._pending.append((None, (), {}, future))
+            self._commit_now.set()
+            await future
+        elif self._in_flight is not None:
+            # shield: отмена вызывающего не должна прерывать чужой COMMIT
+            await asyncio.shield(self._in_flight)
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if not self._commit_now.is_set():
+                try:
+                    await asyncio.wait_for(self._commit_now.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self._pending[: self.max_batch]
+            del self._pending[: self.max_batch]
+            if len(self._pending) < self.max_batch:
+                self._commit_now.clear()
+            if not self._pending:
+                self._has_items.clear()
+            self._in_flight = asyncio.ensure_future(self._commit(batch))
+            try:
+                await self._in_flight
+            finally:
+                self._in_flight = None
+
+    async def _commit(self, batch):
+        calls = [(name, args, kwargs) for name, args, kwargs, _ in batch if name]
+        try:
+            results = iter(await self.db.run(self.db.apply_batch, calls))
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for name, _, _, future in batch:
+            ok, value = next(results) if name else (True, None)
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    async def close(self):
+        await self.flush()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+class AsyncDatabase:
+    """Awaitable-фасад над ``Database`` для хендлеров бота.
+
+    ``await adb.add_user(...)`` выполняет ``Database.add_user`` в пуле
+    потоков базы. Синхронный объект доступен как ``adb.sync``.
+
+    С ``batch_writes=True`` частые записи (BATCHED_WRITES) идут через
+    WriteQueue, а записи из FLUSH_BEFORE (оплаты) сначала дожидаются
+    коммита накопленной пачки и выполняются отдельной транзакцией.
+    """
+
+    def __init__(self, db: Database, batch_writes: bool = False):
+        self.sync = db
+        self.write_queue = WriteQueue(db) if batch_writes else None
+
+    def __getattr__(self, name):
+        attr = getattr(self.sync, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
 
-            import random
+        if self.write_queue and name in BATCHED_WRITES:
+            async def call(*args, **kwargs):
+                return await self.write_queue.submit(name, *args, **kwargs)
+        elif self.write_queue and name in FLUSH_BEFORE:
+            async def call(*args, **kwargs):
+                await self.write_queue.flush()
+                return await self.sync.run(attr, *args, **kwargs)
+        else:
+            async def call(*args, **kwargs):
+                return await self.sync.run(attr, *args, **kwargs)
 
-            tickets = []
-            for row in rows:
-                user_id = row["user_id"]
-                count = row["invites_req"]
-                tickets.extend([user_id] * count)
+        call.__name__ = name
+        setattr(self, name, call)
+        return call
 
-            return random.choice(tickets) if tickets else None
+    async def close(self):
+        if self.write_queue:
+            await self.write_queue.close()
+        self.sync.close()
@@ -0,0 +1,100 @@
+"""
+Выгрузка пожеланий и участников для печати (CSV или JSONL, gzip).
+
+Строки читаются из базы страницами (Database.iter_export) и сразу пишутся
+в сжатый файл, поэтому память не зависит от размера таблиц. Момент
+каждой выгрузки запоминается в export_marks: инкрементальная выгрузка
+отдаёт только строки, изменённые с прошлой (по индексированным
+updated_at / created_at). Метка ставится на EXPORT_MARK_MARGIN секунд
+раньше начала выгрузки: запись получает время datetime('now') до своего
+COMMIT и могла ждать блокировку (busy_timeout) или пачку WriteQueue, так
+что строка со временем чуть раньше начала выгрузки может стать видна уже
+после её чтения. Поэтому строки, изменённые за эти секунды, попадают и в
+следующую выгрузку — при печати дубли по user_id отбрасываются.
+
+Из консоли (можно при работающем боте — чтение идёт из WAL-снимка):
+
+    python export.py wishes --format csv
+    python export.py all --format jsonl --new --out exports/
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+from database import EXPORT_QUERIES, Database
+
+DATASETS = tuple(EXPORT_QUERIES)
+FORMATS = ("csv", "jsonl")
+# Не меньше busy_timeout (5 с) + WRITE_BATCH_DELAY с запасом на саму транзакцию
+EXPORT_MARK_MARGIN = 10
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _now() -> datetime:
+    """Текущее время UTC с точностью datetime('now') SQLite."""
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+
+def write_export(db: Database, dataset: str, fmt: str, path: str, since: str = None) -> int:
+    """Пишет набор в ``path`` (gzip) и возвращает число строк."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    rows = 0
+    pages = db.iter_export(dataset, since)
+    header = next(pages)
+    with gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=6) as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for page in pages:
+                writer.writerows(page)
+                rows += len(page)
+        else:
+            for page in pages:
+                for row in page:
+                    f.write(json.dumps(dict(zip(header, row)), ensure_ascii=False))
+                    f.write("\n")
+                rows += len(page)
+    return rows
+
+
+def run_export(db: Database, dataset: str, fmt: str = "csv", directory: str = ".",
+               incremental: bool = False):
+    """Выгрузка с учётом export_marks. Возвращает (путь к файлу, число строк, since)."""
+    since = db.get_export_mark(dataset) if incremental else None
+    started = _now()
+    suffix = "-new" if since else ""
+    path = os.path.join(
+        directory, f"{dataset}{suffix}-{started.strftime('%Y-%m-%d_%H%M%S')}.{fmt}.gz"
+    )
+    rows = write_export(db, dataset, fmt, path, since)
+    mark = started - timedelta(seconds=EXPORT_MARK_MARGIN)
+    db.save_export_mark(dataset, mark.strftime(TIME_FORMAT))
+    return path, rows, since
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка данных бота в CSV/JSONL (gzip)")
+    parser.add_argument("dataset", choices=DATASETS + ("all",))
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--db", default="bot_data.db")
+    parser.add_argument("--out", default=".", help="каталог для файлов")
+    parser.add_argument("--new", action="store_true", help="только изменения с прошлой выгрузки")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    db = Database(args.db, readers=1)
+    try:
+        for dataset in DATASETS if args.dataset == "all" else (args.dataset,):
+            path, rows, since = run_export(db, dataset, args.format, args.out, args.new)
+            print(f"{dataset}: {rows} rows{f' since {since}' if since else ''} -> {path}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
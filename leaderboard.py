@@ -0,0 +1,187 @@
+"""
+Рейтинг участников по билетам и по приглашённым друзьям.
+
+Экран «🏆 Рейтинг» не сортирует users и не группирует referrals на каждое
+нажатие. Для каждой доски в памяти держатся:
+  * первые LEADERBOARD_SIZE мест — короткий отсортированный список;
+  * гистограмма «очки -> сколько участников» в дереве Фенвика, по ней
+    место любого участника (1 + число участников с большим счётом)
+    считается за O(log max_очков). Память зависит от максимального
+    счёта, а не от числа пользователей.
+
+При старте обе структуры строятся одним проходом по индексам
+(``Database.get_leaderboard``), дальше их обновляют изменения, которые
+Database передаёт после COMMIT (``Database.add_listener``). Очки только
+растут, поэтому первые места обновляются точно: участник может войти в
+список, только когда его счёт изменился.
+
+В многопроцессном режиме (BOT_WORKERS > 1) остальные воркеры пишут в
+базу мимо этого процесса, поэтому доски перестраиваются из базы раз в
+LEADERBOARD_REFRESH секунд.
+"""
+
+import asyncio
+import bisect
+import logging
+import threading
+from array import array
+from typing import List, Optional, Tuple
+
+from config import LEADERBOARD_REFRESH, LEADERBOARD_SIZE
+
+logger = logging.getLogger(__name__)
+
+TICKETS = "tickets"
+INVITES = "invites"
+
+
+class ScoreBoard:
+    """Одна доска: первые ``size`` мест и гистограмма очков."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.total = 0
+        # Ключи (-очки, user_id): по возрастанию ключа — сверху вниз по рейтингу
+        self._top: List[Tuple[int, int]] = []
+        self._counts = array("q", bytes(8))
+        self._tree = array("q", bytes(8))
+
+    def load(self, histogram, top):
+        """Гистограмма ``[(очки, участников)]`` и первые места ``[(user_id, очки)]``."""
+        capacity = 1
+        for score, _ in histogram:
+            capacity = max(capacity, score)
+        counts = array("q", bytes(8 * (capacity + 1)))
+        for score, count in histogram:
+            counts[score] += count
+        self._build(counts)
+        self._top = sorted((-score, user_id) for user_id, score in top)[:self.size]
+
+    def _build(self, counts):
+        # Построение дерева Фенвика за O(capacity), как в lottery.WeightedLottery
+        n = len(counts) - 1
+        tree = array("q", counts)
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self._counts = counts
+        self._tree = tree
+        self.total = sum(counts)
+
+    def _add(self, score: int, delta: int):
+        if score >= len(self._counts):
+            # Новый максимум: ёмкость удваивается, дерево строится заново
+            capacity = max(score, 2 * (len(self._counts) - 1))
+            counts = array("q", self._counts)
+            counts.extend(array("q", bytes(8 * (capacity + 1 - len(counts)))))
+            self._build(counts)
+        self._counts[score] += delta
+        self.total += delta
+        tree = self._tree
+        n = len(tree) - 1
+        i = score
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+
+    def _count_upto(self, score: int) -> int:
+        """Участников со счётом от 1 до ``score`` включительно."""
+        tree = self._tree
+        i = min(score, len(tree) - 1)
+        result = 0
+        while i > 0:
+            result += tree[i]
+            i -= i & -i
+        return result
+
+    def update(self, user_id: int, old: int, new: int):
+        # В многопроцессном режиме доска до перестройки может не знать о
+        # записях других воркеров — тогда старого счёта в гистограмме нет
+        if 0 < old < len(self._counts) and self._counts[old]:
+            self._add(old, -1)
+        if new > 0:
+            self._add(new, 1)
+        self._update_top(user_id, new)
+
+    def _update_top(self, user_id: int, score: int):
+        top = self._top
+        for i, (_, member) in enumerate(top):
+            if member == user_id:
+                del top[i]
+                break
+        key = (-score, user_id)
+        if len(top) < self.size or key < top[-1]:
+            bisect.insort(top, key)
+            del top[self.size:]
+
+    def rank(self, score: int) -> Optional[int]:
+        """Место участника со счётом ``score``; None — пока не в рейтинге."""
+        if score <= 0:
+            return None
+        return 1 + self.total - self._count_upto(score)
+
+    def top(self) -> List[Tuple[int, int]]:
+        """Первые места: ``[(user_id, очки)]`` сверху вниз."""
+        return [(user_id, -key) for key, user_id in self._top]
+
+
+class Leaderboard:
+    """Доски TICKETS и INVITES поверх Database."""
+
+    def __init__(self, db, size: int = LEADERBOARD_SIZE, refresh: float = LEADERBOARD_REFRESH):
+        self.db = db
+        self.size = size
+        self.refresh = refresh
+        self.boards = {TICKETS: ScoreBoard(size), INVITES: ScoreBoard(size)}
+        # apply вызывается из потока базы, чтения — из event loop
+        self._lock = threading.Lock()
+        self._task = None
+
+    def apply(self, changes):
+        """Слушатель Database.add_listener: изменения уже закоммичены."""
+        with self._lock:
+            for board, user_id, delta, score in changes:
+                self.boards[board].update(user_id, score - delta, score)
+
+    def _rebuild(self):
+        # Между чтением досок и их заменой ни одна транзакция не закоммитится,
+        # поэтому ни одно изменение не теряется и не применяется дважды
+        data = self.db.sync.get_leaderboard(self.size)
+        boards = {}
+        for board, (histogram, top) in data.items():
+            boards[board] = ScoreBoard(self.size)
+            boards[board].load(histogram, top)
+        with self._lock:
+            self.boards = boards
+
+    async def load(self):
+        """Строит доски из базы; вызывается до приёма апдейтов."""
+        await self.db.snapshot_under_write_lock(self._rebuild)
+
+    def start(self):
+        if self.refresh > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.refresh)
+            try:
+                await self.load()
+            except Exception:
+                logger.exception("Leaderboard refresh failed")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def top(self, board: str) -> List[Tuple[int, int]]:
+        with self._lock:
+            return self.boards[board].top()
+
+    def rank(self, board: str, score: int) -> Tuple[Optional[int], int]:
+        """(место или None, сколько участников на доске) за O(log max_очков)."""
+        with self._lock:
+            scores = self.boards[board]
+            return scores.rank(score), scores.total
@@ -0,0 +1,134 @@
+"""
+Реестр медиафайлов бота.
+
+Каждый файл из images/ загружается в Telegram один раз: полученный
+file_id сохраняется в базе по sha256 содержимого, и дальше картинка
+отправляется по file_id без повторной загрузки. Если файл на диске
+изменился, у него новый хеш — он будет загружен заново.
+
+Ассета может не быть на диске (images/ заполняет create_images.py,
+а welcome.gif кладут вручную): тогда ``send`` один раз пишет
+предупреждение и ничего не отправляет.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Dict, NamedTuple, Optional
+
+from telegram.error import BadRequest
+
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+
+# Имя ассета -> файл в images/ (кортеж — первый существующий из вариантов)
+MEDIA_FILES = {
+    "welcome": ("welcome.gif", "welcome.jpg"),
+    "plans": "plans.jpg",
+    "payment": "payment.jpg",
+    "success": "success.jpg",
+    "wish_saved": "wish_saved.jpg",
+    "invite": "invite.jpg",
+    "completed": "completed.jpg",
+}
+
+ANIMATION_EXTENSIONS = (".gif", ".mp4")
+
+
+class _Asset(NamedTuple):
+    path: str
+    stamp: tuple
+    content_hash: str
+
+
+class MediaRegistry:
+    def __init__(self, db: AsyncDatabase, images_dir: str = IMAGES_DIR):
+        self.db = db
+        self.images_dir = images_dir
+        self._assets: Dict[str, _Asset] = {}
+        self._file_ids: Optional[Dict[str, str]] = None
+        self._upload_locks: Dict[str, asyncio.Lock] = {}
+        self._missing = set()
+
+    def _asset(self, name: str) -> Optional[_Asset]:
+        """Путь и хеш файла; хеш пересчитывается только при смене mtime/size.
+
+        None, если ни одного варианта файла нет.
+        """
+        files = MEDIA_FILES[name]
+        for filename in (files,) if isinstance(files, str) else files:
+            path = os.path.join(self.images_dir, filename)
+            try:
+                st = os.stat(path)
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            if name not in self._missing:
+                self._missing.add(name)
+                logger.warning("Media %s not found in %s, sending without it", name,
+                               self.images_dir)
+            return None
+        self._missing.discard(name)
+        stamp = (st.st_mtime_ns, st.st_size)
+        asset = self._assets.get(name)
+        if asset is None or asset.stamp != stamp:
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 16), b""):
+                    digest.update(chunk)
+            asset = _Asset(path, stamp, digest.hexdigest())
+            self._assets[name] = asset
+        return asset
+
+    async def _load_file_ids(self):
+        if self._file_ids is None:
+            self._file_ids = await self.db.get_media_file_ids()
+        return self._file_ids
+
+    async def send(self, bot, chat_id: int, name: str, **kwargs):
+        """Отправляет ассет ``name`` в чат, по file_id если он уже известен.
+
+        Без файла на диске ничего не отправляет и возвращает None.
+        """
+        asset = self._asset(name)
+        if asset is None:
+            return None
+        file_ids = await self._load_file_ids()
+        is_animation = asset.path.endswith(ANIMATION_EXTENSIONS)
+
+        async def send_media(media):
+            if is_animation:
+                return await bot.send_animation(chat_id=chat_id, animation=media, **kwargs)
+            return await bot.send_photo(chat_id=chat_id, photo=media, **kwargs)
+
+        file_id = file_ids.get(asset.content_hash)
+        if file_id:
+            try:
+                return await send_media(file_id)
+            except BadRequest as e:
+                logger.warning("Cached file_id for %s rejected (%s), re-uploading", name, e)
+                file_ids.pop(asset.content_hash, None)
+
+        lock = self._upload_locks.setdefault(asset.content_hash, asyncio.Lock())
+        async with lock:
+            # Пока ждали блокировку, файл мог загрузить параллельный вызов
+            file_id = file_ids.get(asset.content_hash)
+            if file_id:
+                return await send_media(file_id)
+
+            with open(asset.path, "rb") as f:
+                message = await send_media(f)
+
+            if is_animation:
+                file_id = message.animation.file_id
+            else:
+                file_id = message.photo[-1].file_id
+            file_ids[asset.content_hash] = file_id
+            await self.db.save_media_file_id(asset.content_hash, name, file_id)
+            logger.info("Uploaded %s, cached file_id", name)
+            return message
@@ -0,0 +1,381 @@
+"""
+Метрики горячего пути: гистограммы латентности и счётчики.
+
+Что меряем:
+  bot_handler_seconds{handler}        — корутины BotHandlers;
+  bot_db_seconds{method}              — методы Database (время в потоке базы);
+  bot_api_seconds{method}             — вызовы Bot API (send_invoice, edit_message_text...);
+  bot_api_errors_total{method,code}   — ошибки Bot API (код HTTP или network);
+  bot_update_lag_seconds              — от даты сообщения в Telegram до начала обработки;
+  bot_payments_total{plan}            — новые оплаты по планам;
+  bot_updates_dropped_total{reason}   — апдейты, отброшенные защитой от флуда;
+  bot_checkout_rejected_total{reason} — отказы на pre_checkout_query;
+  а также текущие размер очереди апдейтов и число апдейтов в обработке.
+
+Включается переменной METRICS_ENABLED=1. Выключенные метрики — это
+заглушки без состояния, а обёртки вокруг методов вообще не ставятся,
+так что накладные расходы практически нулевые. Данные отдаются в формате
+Prometheus на http://METRICS_LISTEN:METRICS_PORT/metrics и командой /perf.
+"""
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Tuple
+
+from telegram.error import NetworkError
+from telegram.request import BaseRequest
+
+from config import METRICS_ENABLED, METRICS_LISTEN, METRICS_PORT
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class _Noop:
+    """Заглушка для выключенных метрик: любые вызовы ничего не делают."""
+
+    def labels(self, *values):
+        return self
+
+    def observe(self, value: float):
+        pass
+
+    def inc(self, amount: float = 1):
+        pass
+
+
+NOOP = _Noop()
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по бакетам (линейная интерполяция внутри бакета)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for index, count in enumerate(self.counts):
+            upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+            if count and seen + count >= rank:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.buckets[-1]
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.children: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self._lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_str(self, values, extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self):
+        for values, child in sorted(self.children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = self._label_str(values, 'le="%s"' % le)
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            yield f"{self.name}_sum{self._label_str(values)} {child.sum}"
+            yield f"{self.name}_count{self._label_str(values)} {child.count}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def render(self):
+        for values, child in sorted(self.children.items()):
+            yield f"{self.name}{self._label_str(values)} {child.value}"
+
+
+class Registry:
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.metrics = []
+        self.gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        if not self.enabled:
+            return NOOP
+        metric = Histogram(name, documentation, tuple(labelnames), buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        if not self.enabled:
+            return NOOP
+        metric = Counter(name, documentation, tuple(labelnames))
+        self.metrics.append(metric)
+        return metric
+
+    def gauge_function(self, name: str, documentation: str, func: Callable[[], float]):
+        """Gauge, значение которого вычисляется в момент чтения."""
+        if self.enabled:
+            self.gauges[name] = (documentation, func)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for name, (documentation, func) in self.gauges.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {func()}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry(METRICS_ENABLED)
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_seconds", "BotHandlers coroutine latency", ("handler",))
+DB_SECONDS = REGISTRY.histogram(
+    "bot_db_seconds", "Database method latency", ("method",))
+API_SECONDS = REGISTRY.histogram(
+    "bot_api_seconds", "Telegram Bot API call latency", ("method",))
+API_ERRORS = REGISTRY.counter(
+    "bot_api_errors_total", "Telegram Bot API errors", ("method", "code"))
+UPDATE_LAG = REGISTRY.histogram(
+    "bot_update_lag_seconds",
+    "Delay from a user message (or its edit) to processing start; callback queries excluded",
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 300))
+PAYMENTS = REGISTRY.counter(
+    "bot_payments_total", "New successful payments", ("plan",))
+UPDATES_DROPPED = REGISTRY.counter(
+    "bot_updates_dropped_total", "Updates dropped by flood control", ("reason",))
+CHECKOUT_REJECTED = REGISTRY.counter(
+    "bot_checkout_rejected_total", "Pre-checkout queries answered with ok=False", ("reason",))
+
+
+# ---- Обёртки ----
+
+SKIP_DB_METHODS = frozenset({
+    "run", "close", "apply_batch", "iter_export", "add_listener", "remove_listener",
+    "transaction",
+    "snapshot_under_write_lock", "schema_version", "seed_aggregates",
+})
+
+def instrument_handlers(handlers):
+    """Оборачивает все публичные корутины объекта BotHandlers."""
+    if not REGISTRY.enabled:
+        return
+    for name in dir(type(handlers)):
+        method = getattr(handlers, name)
+        if name.startswith("_") or not callable(method):
+            continue
+        setattr(handlers, name, _timed_async(method, HANDLER_SECONDS.labels(name)))
+
+
+def instrument_database(db):
+    """Оборачивает публичные методы Database (без служебных и генератора выгрузки)."""
+    if not REGISTRY.enabled:
+        return
+    for name in dir(type(db)):
+        method = getattr(db, name)
+        if name.startswith("_") or name in SKIP_DB_METHODS or not callable(method):
+            continue
+        setattr(db, name, _timed_sync(method, DB_SECONDS.labels(name)))
+
+
+def _timed_async(func, histogram):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+
+def _timed_sync(func, histogram):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+
+class InstrumentedRequest(BaseRequest):
+    """Транспорт Bot API, который меряет каждый вызов и считает ошибки."""
+
+    def __init__(self, inner: BaseRequest):
+        self._inner = inner
+
+    @property
+    def read_timeout(self):
+        return self._inner.read_timeout
+
+    async def initialize(self):
+        await self._inner.initialize()
+
+    async def shutdown(self):
+        await self._inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, payload = await self._inner.do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout,
+            )
+        except NetworkError:
+            API_ERRORS.labels(api_method, "network").inc()
+            raise
+        finally:
+            API_SECONDS.labels(api_method).observe(time.perf_counter() - started)
+        if status != 200:
+            API_ERRORS.labels(api_method, str(status)).inc()
+        return status, payload
+
+
+# ---- Отчёт и HTTP ----
+
+def perf_report(limit: int = 8) -> str:
+    """Короткая сводка для админской команды /perf."""
+    if not REGISTRY.enabled:
+        return "📈 Метрики выключены (METRICS_ENABLED=1)."
+
+    def section(title, histogram):
+        rows = sorted(
+            (item for item in histogram.children.items() if item[1].count),
+            key=lambda item: -item[1].count,
+        )[:limit]
+        if not rows:
+            return []
+        lines = [f"\n{title}"]
+        for (name,), child in rows:
+            lines.append(
+                f"{name}: {child.count} шт, "
+                f"p50 {child.quantile(0.5) * 1000:.1f} мс, "
+                f"p95 {child.quantile(0.95) * 1000:.1f} мс"
+            )
+        return lines
+
+    lines = ["📈 Производительность:"]
+    for name, (_, func) in REGISTRY.gauges.items():
+        lines.append(f"{name}: {func():g}")
+    lines += section("⚙️ Хендлеры:", HANDLER_SECONDS)
+    lines += section("🗄 База:", DB_SECONDS)
+    lines += section("📡 Bot API:", API_SECONDS)
+
+    errors = [f"{method} {code}: {child.value:g}"
+              for (method, code), child in sorted(API_ERRORS.children.items())]
+    if errors:
+        lines.append("\n❗ Ошибки API: " + ", ".join(errors))
+    payments = [f"{plan}: {child.value:g}"
+                for (plan,), child in sorted(PAYMENTS.children.items())]
+    if payments:
+        lines.append("💰 Оплаты: " + ", ".join(payments))
+    return "\n".join(lines)
+
+
+class MetricsServer:
+    """HTTP-эндпоинт /metrics в формате Prometheus."""
+
+    def __init__(self, listen: str = METRICS_LISTEN, port: int = METRICS_PORT):
+        self.listen = listen
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        if not REGISTRY.enabled:
+            return
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(
+                text=REGISTRY.render(), content_type="text/plain", charset="utf-8"
+            )
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
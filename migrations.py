@@ -0,0 +1,261 @@
+"""
+Версионные миграции схемы bot_data.db.
+
+Номер применённой миграции хранится в ``PRAGMA user_version``. При старте
+Database читает его одним запросом: если схема актуальна, никаких DDL не
+выполняется. Иначе недостающие шаги применяются по порядку, каждый в своей
+транзакции BEGIN IMMEDIATE вместе с новым user_version. Несколько
+процессов (BOT_WORKERS) могут стартовать одновременно: версия
+перечитывается внутри транзакции, и шаг выполняет только первый из них.
+
+Шаги с ``deferred=True`` (построение индексов по большим таблицам) при
+старте не выполняются. Их выполняет ``migrate_deferred`` на своём
+соединении, мимо writer-соединения и пула потоков Database: каждый
+CREATE INDEX — отдельная транзакция, user_version — ещё одна короткая.
+С одним процессом их запускает нулевой воркер в фоне, когда бот уже
+принимает апдейты; с BOT_WORKERS > 1 — супервизор до запуска воркеров,
+пока в базу никто не пишет.
+
+Остающаяся пауза: SQLite строит индекс под блокировкой записи. Чтения
+(WAL) идут как обычно, а записи ждут конца построения одного индекса
+(порядка секунды на миллион строк); до этого запросы работают без
+нового индекса. Построение дольше busy_timeout (5 с) закончится для
+ждущей записи ошибкой «database is locked», поэтому шаг не должен
+объединять несколько индексов по большим таблицам.
+
+Новый шаг добавляется в конец MIGRATIONS; старые шаги не меняются.
+"""
+
+import logging
+import sqlite3
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+Migration = namedtuple("Migration", "version description apply deferred")
+
+# Пауза между транзакциями отложенных шагов. Ждущая запись спит в
+# busy-обработчике SQLite до 100 мс за раз; без паузы следующий CREATE INDEX
+# снова захватил бы блокировку раньше неё, и ожидания складывались бы
+DEFERRED_PAUSE = 0.2
+
+# Схема на момент введения миграций. Всё с IF NOT EXISTS: базы, созданные
+# раньше (user_version = 0), проходят этот шаг без изменений.
+BASE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id       INTEGER PRIMARY KEY,
+        username      TEXT,
+        plan_key      TEXT,
+        stars_paid    INTEGER DEFAULT 0,
+        invites_req   INTEGER DEFAULT 0,
+        wish          TEXT,
+        completed     INTEGER DEFAULT 0,
+        created_at    TEXT DEFAULT (datetime('now')),
+        updated_at    TEXT DEFAULT (datetime('now'))
+    );
+
+    CREATE TABLE IF NOT EXISTS referrals (
+        id            INTEGER PRIMARY KEY AUTOINCREMENT,
+        inviter_id    INTEGER NOT NULL,
+        invited_id    INTEGER NOT NULL UNIQUE,
+        created_at    TEXT DEFAULT (datetime('now')),
+        FOREIGN KEY (inviter_id) REFERENCES users(user_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_referrals_inviter ON referrals (inviter_id);
+
+    -- Поддерживаемые агрегаты дерева рефералов:
+    -- invites — прямые приглашённые, subtree — все потомки,
+    -- depth — глубина пользователя от корня цепочки
+    CREATE TABLE IF NOT EXISTS referral_stats (
+        user_id       INTEGER PRIMARY KEY,
+        invites       INTEGER NOT NULL DEFAULT 0,
+        subtree       INTEGER NOT NULL DEFAULT 0,
+        depth         INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_referral_stats_invites
+        ON referral_stats (invites DESC);
+
+    CREATE TABLE IF NOT EXISTS counters (
+        name          TEXT PRIMARY KEY,
+        value         INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS payments_hourly (
+        hour          TEXT PRIMARY KEY,
+        payments      INTEGER NOT NULL DEFAULT 0,
+        stars         INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS media_cache (
+        content_hash  TEXT PRIMARY KEY,
+        name          TEXT NOT NULL,
+        file_id       TEXT NOT NULL,
+        updated_at    TEXT DEFAULT (datetime('now'))
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS payments (
+        charge_id     TEXT PRIMARY KEY,
+        user_id       INTEGER NOT NULL,
+        plan_key      TEXT NOT NULL,
+        stars         INTEGER NOT NULL,
+        tickets       INTEGER NOT NULL,
+        created_at    TEXT DEFAULT (datetime('now'))
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_payments_user ON payments (user_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_payments_created ON payments (created_at);
+
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id            INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id      INTEGER NOT NULL,
+        text          TEXT NOT NULL,
+        status        TEXT NOT NULL DEFAULT 'running',
+        last_user_id  INTEGER NOT NULL DEFAULT 0,
+        sent          INTEGER NOT NULL DEFAULT 0,
+        failed        INTEGER NOT NULL DEFAULT 0,
+        blocked       INTEGER NOT NULL DEFAULT 0,
+        created_at    TEXT DEFAULT (datetime('now')),
+        finished_at   TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS conversations (
+        name          TEXT NOT NULL,
+        conv_key      TEXT NOT NULL,
+        user_id       INTEGER NOT NULL,
+        state         TEXT NOT NULL,
+        updated_at    TEXT DEFAULT (datetime('now')),
+        PRIMARY KEY (name, conv_key)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations (user_id);
+
+    CREATE TABLE IF NOT EXISTS user_data (
+        user_id       INTEGER PRIMARY KEY,
+        data          TEXT NOT NULL,
+        updated_at    TEXT DEFAULT (datetime('now'))
+    );
+
+    -- До какого момента каждый набор уже выгружен (инкрементальный /export)
+    CREATE TABLE IF NOT EXISTS export_marks (
+        dataset       TEXT PRIMARY KEY,
+        exported_at   TEXT NOT NULL
+    ) WITHOUT ROWID;
+"""
+
+
+def _statements(script: str):
+    # executescript сам делает COMMIT, поэтому выполняем по одному запросу
+    return [sql for sql in script.split(";") if sql.strip()]
+
+
+def _base_schema(db, conn):
+    for sql in _statements(BASE_SCHEMA):
+        conn.execute(sql)
+    db.seed_aggregates(conn)
+
+
+def _users_updated_at(db, conn):
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(users)")}
+    if "updated_at" not in columns:
+        # ALTER TABLE не принимает DEFAULT (datetime('now')), новые строки
+        # получают значение из INSERT
+        conn.execute("ALTER TABLE users ADD COLUMN updated_at TEXT")
+        conn.execute("UPDATE users SET updated_at = created_at")
+
+
+def _sql(*statements):
+    def apply(db, conn):
+        for sql in statements:
+            conn.execute(sql)
+    # migrate_deferred выполняет запросы по одному, каждый в своей транзакции
+    apply.statements = statements
+    return apply
+
+
+MIGRATIONS = (
+    Migration(1, "base schema", _base_schema, False),
+    Migration(2, "users.updated_at", _users_updated_at, False),
+    Migration(3, "export indexes", _sql(
+        "CREATE INDEX IF NOT EXISTS idx_users_updated ON users (updated_at)",
+        "CREATE INDEX IF NOT EXISTS idx_referrals_created ON referrals (created_at)",
+    ), True),
+    # Рейтинг по билетам: гистограмма и первые места при старте читаются по индексу
+    Migration(4, "leaderboard index", _sql(
+        "CREATE INDEX IF NOT EXISTS idx_users_tickets ON users (invites_req)",
+    ), True),
+)
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db, include_deferred: bool = False):
+    """Применяет недостающие миграции и возвращает номера применённых.
+
+    Без ``include_deferred`` останавливается на первом отложенном шаге.
+    """
+    current = db.schema_version()
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        if migration.deferred and not include_deferred:
+            break
+        started = time.perf_counter()
+        with db.transaction() as conn:
+            # Другой процесс мог успеть применить шаг, пока мы ждали блокировку
+            current = schema_version(conn)
+            if migration.version <= current:
+                continue
+            migration.apply(db, conn)
+            conn.execute(f"PRAGMA user_version = {migration.version}")
+            current = migration.version
+        logger.info("Migration %d (%s) applied in %.0f ms", migration.version,
+                    migration.description, (time.perf_counter() - started) * 1000)
+        applied.append(migration.version)
+    return applied
+
+
+def migrate_deferred(db_path: str):
+    """Отложенные шаги на отдельном соединении; возвращает номера применённых.
+
+    Каждый запрос шага — своя транзакция BEGIN IMMEDIATE, поэтому записи
+    бота ждут не дольше построения одного индекса. Запросы шагов — с IF NOT
+    EXISTS: если процесс упал посередине, повтор доделывает остальное.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA synchronous=FULL")
+        current = schema_version(conn)
+        applied = []
+        for migration in MIGRATIONS:
+            if migration.version <= current:
+                continue
+            if not migration.deferred:
+                # Обычные шаги применяет Database при открытии базы
+                break
+            started = time.perf_counter()
+            for sql in migration.apply.statements:
+                time.sleep(DEFERRED_PAUSE)
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute(sql)
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                conn.execute("COMMIT")
+            time.sleep(DEFERRED_PAUSE)
+            conn.execute("BEGIN IMMEDIATE")
+            current = schema_version(conn)
+            if current < migration.version:
+                conn.execute(f"PRAGMA user_version = {migration.version}")
+                current = migration.version
+            conn.execute("COMMIT")
+            logger.info("Migration %d (%s) applied in %.0f ms", migration.version,
+                        migration.description, (time.perf_counter() - started) * 1000)
+            applied.append(migration.version)
+        return applied
+    finally:
+        conn.close()
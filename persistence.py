@@ -0,0 +1,199 @@
+"""
+Persistence для PTB поверх bot_data.db.
+
+Хранятся состояния ConversationHandler и user_data (bot_data, chat_data
+и callback_data бот не использует). В отличие от PicklePersistence:
+  * при старте ничего не читается — состояние пользователя подгружается
+    из базы одним запросом перед его первым апдейтом (``load`` вызывает
+    PerUserUpdateProcessor), поэтому запуск не зависит от числа диалогов;
+  * пишутся только изменившиеся ключи: Application раз в update_interval
+    отдаёт изменения, они собираются и уходят в базу одной транзакцией.
+
+В многопроцессном режиме ``owns`` отсекает чужих пользователей: нулевой
+воркер получает pre_checkout_query всех плательщиков, но их состояние
+хранит и пишет только воркер пользователя.
+
+Значения user_data и состояния диалогов хранятся в JSON.
+
+Ленивая загрузка опирается на внутренности PTB 21.6: словари состояний
+диалогов лежат в ``Application._conversation_handler_conversations``, а
+подгруженное состояние кладётся туда через ``TrackingDict.update_no_track``,
+чтобы PTB не записал его обратно. Публичного пути нет: результат
+``get_conversations`` ConversationHandler один раз копирует в свой
+словарь при старте. Поэтому версия python-telegram-bot в requirements.txt
+закреплена точно, а ``attach`` проверяет атрибут Application и падает при
+старте, если его нет.
+"""
+
+import asyncio
+import itertools
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application, BasePersistence, ConversationHandler, PersistenceInput
+
+from config import PERSISTENCE_INTERVAL
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+# Изменения одного прохода update_persistence приходят пачкой корутин —
+# ждём немного, чтобы записать их одной транзакцией
+FLUSH_DELAY = 0.05
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, db: AsyncDatabase, update_interval: float = PERSISTENCE_INTERVAL,
+                 owns: Callable[[int], bool] = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        # user_id -> хранит ли этот процесс состояние пользователя; None — всех
+        self.owns = owns
+        self._application: Optional[Application] = None
+        # имя диалога -> позиция user_id в ключе диалога
+        self._user_index: Dict[str, int] = {}
+        self._conversations: Dict[Tuple[str, tuple], tuple] = {}
+        self._user_data: Dict[int, Optional[dict]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def attach(self, application: Application):
+        """Запоминает Application и его persistent-диалоги (после add_handler)."""
+        if not hasattr(application, "_conversation_handler_conversations"):
+            raise RuntimeError(
+                "SQLitePersistence needs PTB internals of python-telegram-bot 21.6, "
+                "see persistence.py"
+            )
+        self._application = application
+        for handler in itertools.chain.from_iterable(application.handlers.values()):
+            if isinstance(handler, ConversationHandler) and handler.persistent:
+                if not handler.per_user:
+                    raise ValueError(f"Conversation {handler.name!r} must be per_user")
+                self._user_index[handler.name] = int(handler.per_chat)
+
+    # ---- Ленивая загрузка ----
+
+    async def load(self, update: object):
+        """Подгружает состояние пользователя перед первым его апдейтом."""
+        application = self._application
+        user = update.effective_user if isinstance(update, Update) else None
+        if application is None or user is None or user.id in application.user_data:
+            return
+        if self.owns and not self.owns(user.id):
+            return
+
+        user_data, conversations = await self.db.load_user_state(user.id)
+        # Ещё не записанные изменения новее того, что в базе
+        user_data = self._user_data.get(user.id, user_data)
+        # Обращение к user_data создаёт запись — по ней же видно, что пользователь загружен
+        application.user_data[user.id].update(user_data or {})
+
+        # Application держит словари состояний persistent-диалогов по имени
+        # (приватный атрибут PTB, см. docstring модуля)
+        states = application._conversation_handler_conversations
+        for name, key, state in conversations:
+            pending = (name, key) in self._conversations
+            if name in states and key not in states[name] and not pending:
+                states[name].update_no_track({key: state})
+        for (name, key), (user_id, state) in self._conversations.items():
+            if user_id == user.id and state is not None and name in states:
+                states[name].update_no_track({key: state})
+
+    # ---- Запись ----
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]):
+        user_id = key[self._user_index.get(name, 0)]
+        if self.owns and not self.owns(user_id):
+            return
+        self._conversations[(name, key)] = (user_id, new_state)
+        self._schedule_flush()
+
+    async def update_user_data(self, user_id: int, data: dict):
+        # Копия чужого пользователя в этом процессе устарела бы и затёрла
+        # то, что записал его воркер
+        if self.owns and not self.owns(user_id):
+            return
+        self._user_data[user_id] = data
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int):
+        if self.owns and not self.owns(user_id):
+            return
+        self._user_data[user_id] = None
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(FLUSH_DELAY)
+        await self._write_pending()
+
+    async def _write_pending(self):
+        if not self._conversations and not self._user_data:
+            return
+        conversations, self._conversations = self._conversations, {}
+        user_data, self._user_data = self._user_data, {}
+        try:
+            await self.db.save_user_state(
+                [(name, key, user_id, state)
+                 for (name, key), (user_id, state) in conversations.items()],
+                list(user_data.items()),
+            )
+        except Exception:
+            logger.exception("Failed to save %d conversations and %d user_data",
+                             len(conversations), len(user_data))
+            # Вернём в очередь всё, что не перезаписали за время попытки
+            for key, value in conversations.items():
+                self._conversations.setdefault(key, value)
+            for key, value in user_data.items():
+                self._user_data.setdefault(key, value)
+
+    async def flush(self):
+        if self._flush_task and not self._flush_task.done():
+            await self._flush_task
+        await self._write_pending()
+
+    # ---- Загрузка при старте: всё читается лениво в load() ----
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # ---- Не используется: store_data выключает эти данные ----
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
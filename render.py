@@ -0,0 +1,277 @@
+"""
+Рендер картинок: фоны экранов и именные сертификаты.
+
+Фон с градиентом считается одним выражением NumPy по всему массиву
+пикселей вместо draw.line на каждую строку. Сертификаты рендерятся в
+пуле процессов (PIL и NumPy держат GIL на своих операциях) и кешируются
+на диске: имя файла — хеш содержимого (имя, план, билеты, версия
+шаблона), поэтому повторный рендер того же сертификата бесплатен.
+
+NumPy и PIL импортируются при первом рендере, а не при запуске бота.
+
+Пакетный режим — сертификаты всем, кто уже оплатил план с сертификатом:
+
+    python render.py certificates
+    python render.py certificates --send
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from config import CERTIFICATES_DIR, FONT_PATH, RENDER_WORKERS
+
+logger = logging.getLogger(__name__)
+
+W, H = 800, 450
+CERT_W, CERT_H = 1200, 850
+# Меняется при изменении шаблона сертификата — старый кеш перестаёт совпадать
+CERTIFICATE_VERSION = 1
+CERTIFICATE_CAPTION = "🎁 Ваш именной подарочный сертификат!"
+
+FONT_CANDIDATES = (
+    FONT_PATH,
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "DejaVuSans.ttf",
+)
+
+
+@lru_cache(maxsize=None)
+def font(size: int):
+    """TrueType-шрифт с кириллицей; без него — встроенный шрифт PIL."""
+    from PIL import ImageFont
+
+    for path in FONT_CANDIDATES:
+        if not path:
+            continue
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size)
+
+
+def strip_emoji(text: str) -> str:
+    # Эмодзи вне BMP шрифт всё равно не нарисует
+    return "".join(c for c in text if ord(c) < 65536).strip()
+
+
+# ---- Фоны ----
+
+def gradient(width: int, height: int, color, darken: int = 80, top=None):
+    """Вертикальный градиент: ``color`` вверху, к низу темнее на ``darken``.
+
+    С ``top`` — переход от ``top`` к ``color``. NumPy считает один столбец
+    цветов, а размножает его по ширине PIL (resize NEAREST, в C).
+    """
+    import numpy as np
+    from PIL import Image
+
+    t = np.arange(height, dtype=np.float32)[:, None] / height
+    base = np.asarray(color, dtype=np.float32)
+    if top is None:
+        column = base - np.floor(darken * t)
+    else:
+        column = np.asarray(top, dtype=np.float32) * (1 - t) + base * t
+    column = np.clip(column, 0, 255).astype(np.uint8)
+    return Image.fromarray(column[:, None, :]).resize((width, height), Image.NEAREST)
+
+
+def render_screen(bg, text: str):
+    """Картинка экрана бота 800×450 (заглушки из create_images.py)."""
+    from PIL import ImageDraw
+
+    img = gradient(W, H, bg)
+    draw = ImageDraw.Draw(img)
+
+    # Декоративные круги
+    for cx, cy, r in ((50, 50, 80), (W - 60, H - 60, 100), (W // 2, 30, 60)):
+        for i in range(3):
+            draw.ellipse(
+                [cx - r + i * 5, cy - r + i * 5, cx + r - i * 5, cy + r - i * 5],
+                outline=(255, 255, 255),
+                width=2,
+            )
+
+    lines = text.split("\n")
+    y_start = H // 2 - len(lines) * 30
+    for i, line in enumerate(lines):
+        draw.text((W // 2, y_start + i * 55), strip_emoji(line), fill="white",
+                  anchor="mm", font=font(32))
+    return img
+
+
+def save_screen(directory: str, name: str, bg, text: str) -> str:
+    path = os.path.join(directory, f"{name}.jpg")
+    render_screen(bg, text).save(path, "JPEG", quality=90)
+    return path
+
+
+# ---- Сертификаты ----
+
+def certificates_dir(db_path: str) -> str:
+    """CERTIFICATES_DIR; относительный путь считается от каталога базы."""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), CERTIFICATES_DIR)
+
+
+def certificate_name(username: str, user_id: int) -> str:
+    """Имя на сертификате — одно и то же у бота и в пакетном режиме.
+
+    username берётся из базы (users.username, сохраняется при /start),
+    чтобы оба пути рендерили одинаковый сертификат и попадали в один кеш.
+    """
+    return f"@{username}" if username else f"Участник #{user_id}"
+
+
+def certificate_key(name: str, plan_title: str, tickets: int) -> str:
+    raw = f"{CERTIFICATE_VERSION}\0{name}\0{plan_title}\0{tickets}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+def certificate_path(name: str, plan_title: str, tickets: int,
+                     directory: str = CERTIFICATES_DIR) -> str:
+    return os.path.join(directory, certificate_key(name, plan_title, tickets) + ".jpg")
+
+
+def render_certificate(name: str, plan_title: str, tickets: int,
+                       directory: str = CERTIFICATES_DIR) -> str:
+    """Рендерит сертификат в кеш (если его там ещё нет) и возвращает путь."""
+    path = certificate_path(name, plan_title, tickets, directory)
+    if os.path.exists(path):
+        return path
+    from PIL import ImageDraw
+
+    img = gradient(CERT_W, CERT_H, (8, 24, 56), top=(24, 64, 120))
+    draw = ImageDraw.Draw(img)
+    gold = (232, 190, 80)
+    draw.rectangle([30, 30, CERT_W - 30, CERT_H - 30], outline=gold, width=6)
+    draw.rectangle([48, 48, CERT_W - 48, CERT_H - 48], outline=gold, width=2)
+
+    center = CERT_W // 2
+    draw.text((center, 150), "ИМЕННОЙ ПОДАРОЧНЫЙ СЕРТИФИКАТ", fill=gold,
+              anchor="mm", font=font(48))
+    draw.text((center, 240), "настоящим подтверждается, что", fill="white",
+              anchor="mm", font=font(30))
+    draw.text((center, 350), strip_emoji(name) or "Участник", fill="white",
+              anchor="mm", font=font(72))
+    draw.text((center, 460), "вписал(а) своё имя в историю рекорда Гиннесса",
+              fill="white", anchor="mm", font=font(30))
+    draw.text((center, 560), strip_emoji(plan_title), fill=gold, anchor="mm", font=font(44))
+    draw.text((center, 650), f"Билетов в розыгрыше: {tickets}", fill="white",
+              anchor="mm", font=font(34))
+
+    os.makedirs(directory, exist_ok=True)
+    # Пишем во временный файл и переименовываем: параллельный рендер того же
+    # сертификата не увидит недописанный файл
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    img.save(tmp_path, "JPEG", quality=92)
+    os.replace(tmp_path, path)
+    return path
+
+
+class CertificateRenderer:
+    """Рендер сертификатов в пуле процессов для async-кода бота."""
+
+    def __init__(self, workers: int = RENDER_WORKERS, directory: str = CERTIFICATES_DIR):
+        self.workers = workers
+        self.directory = directory
+        self._pool = None
+
+    async def render(self, name: str, plan_title: str, tickets: int) -> str:
+        path = certificate_path(name, plan_title, tickets, self.directory)
+        if os.path.exists(path):
+            return path
+        if self._pool is None:
+            # spawn: в процессе бота уже работают потоки базы
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return await asyncio.get_running_loop().run_in_executor(
+            self._pool, render_certificate, name, plan_title, tickets, self.directory
+        )
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+# ---- Пакетный режим ----
+
+def render_all(db, workers: int = RENDER_WORKERS):
+    """Сертификаты всем плательщикам планов с сертификатом. Возвращает [(user_id, путь)]."""
+    from screens import PLANS
+
+    directory = certificates_dir(db.db_path)
+    plans = [plan_id for plan_id, plan in PLANS.items() if plan.get("certificate")]
+    payers = db.get_certificate_payers(plans)
+    jobs = [
+        (certificate_name(row["username"], row["user_id"]),
+         PLANS[row["plan_key"]]["title"], row["tickets"])
+        for row in payers
+    ]
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        paths = pool.map(render_certificate, *zip(*jobs), [directory] * len(jobs),
+                         chunksize=64) if jobs else []
+        return [(row["user_id"], path) for row, path in zip(payers, paths)]
+
+
+async def send_all(token: str, results):
+    """Рассылает отрендеренные сертификаты с общим лимитом рассылок."""
+    from telegram import Bot
+    from telegram.error import RetryAfter, TelegramError
+
+    from broadcast import MAX_ATTEMPTS, TokenBucket, retry_after_seconds
+    from config import BROADCAST_RATE
+
+    bucket = TokenBucket(BROADCAST_RATE)
+    sent = 0
+    async with Bot(token) as bot:
+        for user_id, path in results:
+            for _ in range(MAX_ATTEMPTS):
+                await bucket.acquire()
+                try:
+                    with open(path, "rb") as f:
+                        await bot.send_photo(user_id, f, caption=CERTIFICATE_CAPTION)
+                except RetryAfter as e:
+                    bucket.pause(retry_after_seconds(e.retry_after))
+                    continue
+                except TelegramError as e:
+                    logger.warning("Certificate to %s not sent: %s", user_id, e)
+                else:
+                    sent += 1
+                break
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный рендер именных сертификатов")
+    parser.add_argument("command", choices=("certificates",))
+    parser.add_argument("--db", default="bot_data.db")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or RENDER_WORKERS)
+    parser.add_argument("--send", action="store_true", help="разослать сертификаты в Telegram")
+    args = parser.parse_args()
+
+    from database import Database
+
+    db = Database(args.db, readers=1)
+    try:
+        results = render_all(db, args.workers)
+    finally:
+        db.close()
+    print(f"✅ Сертификатов: {len(results)} в {certificates_dir(args.db)}/")
+    if args.send:
+        from config import BOT_TOKEN
+
+        sent = asyncio.run(send_all(BOT_TOKEN, results))
+        print(f"📨 Отправлено: {sent}")
+
+
+if __name__ == "__main__":
+    main()
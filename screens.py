@@ -0,0 +1,126 @@
+"""
+Экраны бота, собранные один раз при импорте.
+
+Клавиатуры — неизменяемые InlineKeyboardMarkup, тексты — шаблоны, в
+которые хендлеры подставляют только данные пользователя. Здесь же
+тарифные планы и индекс payload -> план.
+"""
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice
+
+from config import PLATINUM_SLOTS
+
+# ---- Тарифные планы ----
+PLANS = {
+    "plan_300": {
+        "stars": 300,
+        "invites": 1,
+        "title": "🌟 VIP – 300 звёзд",
+        "description": "Ваше имя в книге рекордов Гиннесса",
+        "payload": "plan_300"
+    },
+    "plan_500": {
+        "stars": 500,
+        "invites": 2,
+        "title": "💎 PREMIUM – 500 звёзд",
+        "description": "Ваше имя в книге рекордов Гиннесса. Именной подарочный сертификат",
+        "payload": "plan_500",
+        "certificate": True
+    },
+    "plan_1000": {
+        "stars": 1000,
+        "invites": 5,
+        "title": "👑 PLATINUM – 1000 звёзд",
+        "description": "Ваше имя в книге рекордов Гиннесса. Именной подарочный сертификат. Участие в розыгрыше билетов на FIFA World Cup 2026",
+        "payload": "plan_1000",
+        "certificate": True,
+        # Мест на плане (0 — без ограничения), проверяется в checkout.CheckoutGuard
+        "slots": PLATINUM_SLOTS
+    }
+}
+
+# payload счёта -> (plan_id, план), чтобы не перебирать PLANS при каждой оплате
+PLANS_BY_PAYLOAD = {plan["payload"]: (plan_id, plan) for plan_id, plan in PLANS.items()}
+
+# Цена для send_invoice по каждому плану
+PLAN_PRICES = {
+    plan_id: (LabeledPrice(label=plan["title"], amount=plan["stars"]),)
+    for plan_id, plan in PLANS.items()
+}
+
+
+# ---- Клавиатуры ----
+
+_INVITE_BUTTON = InlineKeyboardButton("🔗 Пригласить друга", callback_data="invite_friend")
+_MENU_BUTTON = InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")
+
+MAIN_MENU_MARKUP = InlineKeyboardMarkup(
+    [
+        [InlineKeyboardButton(
+            f"{plan['title']} – {plan['invites']} билет(а)", callback_data=f"buy_{plan_id}"
+        )]
+        for plan_id, plan in PLANS.items()
+    ]
+    + [
+        [InlineKeyboardButton("🎟 Мои билеты", callback_data="my_tickets"),
+         InlineKeyboardButton("🏆 Рейтинг", callback_data="leaderboard")],
+        [_INVITE_BUTTON],
+    ]
+)
+INVITE_AND_MENU_MARKUP = InlineKeyboardMarkup([[_INVITE_BUTTON], [_MENU_BUTTON]])
+MENU_ONLY_MARKUP = InlineKeyboardMarkup([[_MENU_BUTTON]])
+
+# ---- Тексты ----
+
+WELCOME_TEXT = (
+    "Привет, {first_name}! 🎉\n\n"
+    "📢 Создаём подарок! Самое большое послание в Мире!:\n"
+    "✨ Внеси своё имя в Книгу Рекордов Гиннесса! Оставь пожелание на самолёте Роналду!\n\n"
+    "👇  Разыграем билет на FIFA World Cup 2026 :"
+)
+
+PAYMENT_OK_TEXT = (
+    "✅ Оплата прошла успешно!\n"
+    "Вы получили {tickets} билет(а).\n\n"
+    "Теперь напишите своё пожелание для Роналду 🙏"
+)
+
+WISH_SAVED_TEXT = (
+    "💌 Ваше пожелание принято!\n\n"
+    "🎟 Хочешь больше билетов?\n"
+    "👉 Пригласи друзей и получи бонус!"
+)
+
+MY_TICKETS_TEXT = (
+    "🎟 У вас {tickets} билет(ов)\n"
+    "👥 Приглашённых друзей: {invites}\n\n"
+    "Пригласи больше друзей, чтобы получить дополнительные билеты!"
+)
+
+LEADERBOARD_TEXT = (
+    "🏆 Рейтинг участников\n\n"
+    "🎟 Больше всего билетов:\n{tickets_top}\n"
+    "Вы: {tickets_rank}\n\n"
+    "👥 Больше всего приглашённых друзей:\n{invites_top}\n"
+    "Вы: {invites_rank}"
+)
+LEADERBOARD_ROW = "{place}. {name} — {score}"
+LEADERBOARD_EMPTY = "пока никого"
+LEADERBOARD_RANK = "{rank}-е место из {total} ({score})"
+LEADERBOARD_NO_RANK = "пока не в рейтинге"
+LEADERBOARD_ANONYMOUS = "Участник без имени"
+
+INVITE_TEXT = (
+    "🔗 Твоя реферальная ссылка:\n"
+    "https://t.me/{bot_username}?start=ref_{user_id}\n\n"
+    "Отправь её друзьям! За каждого друга, который купит тариф, "
+    "ты получишь +1 билет! 🎫"
+)
+
+# Ответ на pre_checkout_query при отказе (причины из checkout)
+CHECKOUT_ERRORS = {
+    "closed": "Продажи закрыты: розыгрыш уже состоялся.",
+    "sold_out": "Все места на этом тарифе уже заняты. Выберите другой тариф.",
+    "user_limit": "Вы уже купили максимальное число тарифов.",
+    "invalid": "Счёт устарел. Откройте меню и выберите тариф заново.",
+}
@@ -0,0 +1,355 @@
+"""
+Многопроцессный режим: супервизор и N воркеров (BOT_WORKERS > 1).
+
+Супервизор только получает апдейты (getUpdates или webhook), достаёт из
+JSON id пользователя и кладёт апдейт в очередь воркера ``user_id % N``.
+Разбор апдейта в объекты PTB и вся обработка идут в воркерах, каждый со
+своими Application, BotHandlers и Database поверх общего WAL-файла.
+Апдейты одного пользователя всегда попадают в один и тот же воркер и в
+том же порядке, поэтому состояние диалога, FloodGuard и user_data
+остаются локальными. Апдейты админов, апдейты без пользователя и
+pre_checkout_query идут в нулевой воркер — он же продолжает рассылки
+после перезапуска и ведёт счётчики ограничений продаж.
+
+Остановка: супервизор перестаёт принимать апдейты и отправляет каждому
+воркеру маркер конца очереди; воркер дорабатывает принятое и выходит.
+
+Упавший воркер (OOM, исключение) супервизор замечает перед отправкой ему
+апдейта и раз в WATCH_INTERVAL секунд, перезапускает и передаёт новому
+процессу апдейты, которые старый не успел забрать из очереди. Апдейты,
+которые упавший воркер уже забрал, но не обработал, теряются. Если воркер
+падает снова меньше чем через RESTART_WINDOW секунд после перезапуска,
+супервизор останавливается с ошибкой: бот выходит с ненулевым кодом, а
+polling не подтверждает неразосланные апдейты.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from typing import Callable, List, Optional
+
+import httpx
+from telegram import Update
+
+from config import (
+    ADMIN_IDS, BOT_MODE, BOT_TOKEN, WEBHOOK_LISTEN, WEBHOOK_PATH, WEBHOOK_PORT,
+    WEBHOOK_SECRET, WEBHOOK_URL,
+)
+from webhook import WebhookServer, running
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 25
+READY_TIMEOUT = 60
+WATCH_INTERVAL = 1
+RESTART_WINDOW = 60
+# Маркер конца очереди воркера
+STOP = None
+
+
+def shard_key(data: dict) -> Optional[int]:
+    """id пользователя из сырого апдейта (без разбора в объекты PTB)."""
+    for field, value in data.items():
+        if field == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if user:
+            return user["id"]
+        chat = value.get("chat")
+        if chat:
+            return chat["id"]
+    return None
+
+
+def owner(user_id: int, workers: int) -> int:
+    """Воркер, который хранит состояние диалога и user_data пользователя."""
+    if user_id in ADMIN_IDS:
+        return 0
+    return user_id % workers
+
+
+def route(data: dict, workers: int) -> int:
+    # Места и лимиты покупок бронирует CheckoutGuard нулевого воркера;
+    # состояние плательщика этот воркер не трогает (SQLitePersistence.owns)
+    if "pre_checkout_query" in data:
+        return 0
+    user_id = shard_key(data)
+    if user_id is None:
+        return 0
+    return owner(user_id, workers)
+
+
+# ---- Воркер ----
+
+def worker_main(index: int, workers: int, db_path: str, updates, ready,
+                builder_factory: Callable = None, log_disable: int = logging.NOTSET):
+    """Точка входа процесса-воркера."""
+    # Сигналы получает супервизор, воркер останавливается по маркеру в очереди
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.disable(log_disable)
+    asyncio.run(serve_worker(index, workers, db_path, updates, ready, builder_factory))
+
+
+async def serve_worker(index: int, workers: int, db_path: str, updates, ready,
+                       builder_factory=None):
+    from bot import build_application
+    from database import Database
+
+    builder = builder_factory() if builder_factory else None
+    application = build_application(
+        Database(db_path), builder=builder, worker=index, workers=workers
+    )
+    loop = asyncio.get_running_loop()
+    inbox = asyncio.Queue()
+    parent = os.getppid()
+
+    def read_updates():
+        # Блокирующее чтение межпроцессной очереди — в отдельном потоке
+        while True:
+            try:
+                data = updates.get(timeout=1)
+            except queue.Empty:
+                if os.getppid() != parent:
+                    data = STOP
+                else:
+                    continue
+            loop.call_soon_threadsafe(inbox.put_nowait, data)
+            if data is STOP:
+                return
+
+    async with running(application):
+        threading.Thread(target=read_updates, name=f"updates-{index}", daemon=True).start()
+        ready.put(index)
+        processed = 0
+        while True:
+            data = await inbox.get()
+            if data is STOP:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+            processed += 1
+        logger.info("Worker %d stopping after %d updates", index, processed)
+
+
+# ---- Супервизор ----
+
+class Supervisor:
+    def __init__(self, workers: int, db_path: str, builder_factory: Callable = None):
+        self.workers = workers
+        self.db_path = db_path
+        self.builder_factory = builder_factory
+        self._context = multiprocessing.get_context("spawn")
+        self._ready = None
+        self._queues: List = []
+        self._processes: List = []
+        # Время последнего перезапуска каждого воркера (None — не перезапускался)
+        self._restarted: List[Optional[float]] = []
+        # Воркер снова упал сразу после перезапуска, бот останавливается
+        self.failed = False
+
+    def _spawn(self, index: int):
+        updates = self._context.Queue()
+        process = self._context.Process(
+            target=worker_main, name=f"bot-worker-{index}",
+            args=(index, self.workers, self.db_path, updates, self._ready,
+                  self.builder_factory, logging.root.manager.disable),
+        )
+        process.start()
+        return updates, process
+
+    def start(self):
+        """Запускает воркеров и ждёт, пока каждый инициализирует Application."""
+        self.migrate()
+        self._ready = self._context.Queue()
+        for index in range(self.workers):
+            updates, process = self._spawn(index)
+            self._queues.append(updates)
+            self._processes.append(process)
+            self._restarted.append(None)
+        for _ in range(self.workers):
+            try:
+                self._ready.get(timeout=READY_TIMEOUT)
+            except queue.Empty:
+                self.stop()
+                raise RuntimeError("Bot workers did not start in time")
+        logger.info("Started %d workers", self.workers)
+
+    def migrate(self):
+        """Все миграции, включая отложенные, пока воркеры ещё не пишут в базу.
+
+        Иначе построение индекса в нулевом воркере держало бы записи
+        остальных воркеров до busy_timeout.
+        """
+        import migrations
+        from database import Database
+
+        # Открытие базы применяет обычные шаги, отложенные — отдельно
+        Database(self.db_path, readers=0).close()
+        migrations.migrate_deferred(self.db_path)
+
+    def dispatch(self, data: dict):
+        index = route(data, self.workers)
+        self._ensure_alive(index)
+        self._queues[index].put(data)
+
+    def _ensure_alive(self, index: int):
+        """Перезапускает упавшего воркера; RuntimeError, если он падает раз за разом."""
+        process = self._processes[index]
+        if process.is_alive():
+            return
+        restarted = self._restarted[index]
+        if restarted is not None and time.monotonic() - restarted < RESTART_WINDOW:
+            raise RuntimeError(
+                f"Worker {process.name} keeps crashing (exit code {process.exitcode})"
+            )
+        logger.error("Worker %s died with exit code %s, restarting",
+                     process.name, process.exitcode)
+        # Новый процесс не ждём: апдейты копятся в его очереди, пока он стартует
+        old = self._queues[index]
+        updates, self._processes[index] = self._spawn(index)
+        self._queues[index] = updates
+        self._restarted[index] = time.monotonic()
+        moved = 0
+        while True:
+            try:
+                updates.put(old.get_nowait())
+            except queue.Empty:
+                break
+            moved += 1
+        if moved:
+            logger.info("Handed %d queued updates to restarted %s", moved, process.name)
+
+    async def watch(self, stop_event: asyncio.Event):
+        """Проверяет воркеров и без апдейтов; при повторных падениях останавливает бота."""
+        while not stop_event.is_set():
+            await asyncio.sleep(WATCH_INTERVAL)
+            try:
+                for index in range(self.workers):
+                    self._ensure_alive(index)
+            except RuntimeError:
+                logger.exception("Stopping bot")
+                self.failed = True
+                stop_event.set()
+
+    def stop(self):
+        """Маркер конца очереди каждому воркеру и ожидание их выхода."""
+        for updates in self._queues:
+            updates.put(STOP)
+        for process in self._processes:
+            process.join()
+            if process.exitcode:
+                logger.error("Worker %s exited with code %s", process.name, process.exitcode)
+        self._queues.clear()
+        self._processes.clear()
+        self._restarted.clear()
+
+    async def __aenter__(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.start)
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.get_running_loop().run_in_executor(None, self.stop)
+
+
+async def _api(client: httpx.AsyncClient, method: str, **params):
+    response = await client.post(f"/{method}", json=params)
+    payload = response.json()
+    if not payload.get("ok"):
+        raise RuntimeError(f"{method} failed: {payload.get('description')}")
+    return payload["result"]
+
+
+async def poll_updates(supervisor: Supervisor, stop_event: asyncio.Event, token: str = BOT_TOKEN):
+    """getUpdates в супервизоре; апдейты уходят воркерам сырыми dict."""
+    offset = 0
+    async with httpx.AsyncClient(
+        base_url=f"https://api.telegram.org/bot{token}", timeout=POLL_TIMEOUT + 10
+    ) as client:
+        await _api(client, "deleteWebhook")
+        while not stop_event.is_set():
+            fetch = asyncio.ensure_future(_api(
+                client, "getUpdates", offset=offset, timeout=POLL_TIMEOUT,
+                allowed_updates=Update.ALL_TYPES,
+            ))
+            stopped = asyncio.ensure_future(stop_event.wait())
+            await asyncio.wait((fetch, stopped), return_when=asyncio.FIRST_COMPLETED)
+            stopped.cancel()
+            if not fetch.done():
+                fetch.cancel()
+                break
+            try:
+                updates = fetch.result()
+            except (httpx.HTTPError, ValueError, RuntimeError) as e:
+                logger.warning("getUpdates failed: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for data in updates:
+                supervisor.dispatch(data)
+                offset = data["update_id"] + 1
+        # Подтверждаем уже разосланные апдейты, чтобы Telegram не прислал их снова
+        if offset:
+            try:
+                await _api(client, "getUpdates", offset=offset, timeout=0)
+            except (httpx.HTTPError, ValueError, RuntimeError) as e:
+                logger.warning("Failed to confirm update offset: %s", e)
+
+
+class ShardingWebhookServer(WebhookServer):
+    """Webhook-приёмник супервизора: апдейт уходит воркеру без разбора."""
+
+    def __init__(self, supervisor: Supervisor, *args, **kwargs):
+        super().__init__(None, *args, **kwargs)
+        self.supervisor = supervisor
+
+    async def dispatch(self, data: dict):
+        self.supervisor.dispatch(data)
+
+
+async def serve_sharded(workers: int, db_path: str, mode: str = BOT_MODE,
+                        stop_event: asyncio.Event = None):
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+    async with Supervisor(workers, db_path) as supervisor:
+        watcher = asyncio.create_task(supervisor.watch(stop_event))
+        try:
+            if mode == "webhook":
+                await _receive_webhooks(supervisor, stop_event)
+            else:
+                await poll_updates(supervisor, stop_event)
+        finally:
+            watcher.cancel()
+    if supervisor.failed:
+        raise RuntimeError("Bot worker keeps crashing")
+
+
+async def _receive_webhooks(supervisor: Supervisor, stop_event: asyncio.Event):
+    server = ShardingWebhookServer(
+        supervisor, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+    )
+    await server.start()
+    try:
+        if WEBHOOK_URL:
+            params = {"url": WEBHOOK_URL, "allowed_updates": Update.ALL_TYPES,
+                      "max_connections": 100}
+            if WEBHOOK_SECRET:
+                params["secret_token"] = WEBHOOK_SECRET
+            async with httpx.AsyncClient(
+                base_url=f"https://api.telegram.org/bot{BOT_TOKEN}"
+            ) as client:
+                await _api(client, "setWebhook", **params)
+        await stop_event.wait()
+    finally:
+        await server.stop()
+
+
+def run_sharded(workers: int, db_path: str):
+    asyncio.run(serve_sharded(workers, db_path))
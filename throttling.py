@@ -0,0 +1,126 @@
+"""
+Защита от флуда перед хендлерами.
+
+FloodGuard вызывается из PerUserUpdateProcessor до того, как апдейт
+попадёт в ConversationHandler:
+  * у каждого пользователя свой token bucket (FLOOD_RATE апдейтов в секунду,
+    всплеск до FLOOD_BURST) — лишние апдейты отбрасываются;
+  * повторное нажатие той же кнопки под тем же сообщением, пока первое
+    ещё обрабатывается, отбрасывается сразу (двойной тап).
+
+Состояние хранится в TTLStore с ограничением по числу пользователей и
+вытеснением по времени, поэтому память не растёт от числа тапавших.
+Оплаты (pre_checkout_query и successful_payment) никогда не отбрасываются.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from telegram import Update
+from telegram.error import TelegramError
+
+from config import ADMIN_IDS, FLOOD_BURST, FLOOD_MAX_USERS, FLOOD_RATE
+
+NOTICE_INTERVAL = 10.0
+
+
+class TTLStore:
+    """LRU-словарь с ограничением размера и сроком жизни записей."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, now: float):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        stored_at, value = item
+        if now - stored_at > self.ttl:
+            del self._data[key]
+            return None
+        return value
+
+    def set(self, key, value, now: float):
+        self._data[key] = (now, value)
+        self._data.move_to_end(key)
+        # Сначала выкидываем протухшие записи с головы, затем — лишние по размеру
+        while self._data:
+            oldest_at, _ = next(iter(self._data.values()))
+            if now - oldest_at <= self.ttl and len(self._data) <= self.maxsize:
+                break
+            self._data.popitem(last=False)
+
+
+class FloodGuard:
+    def __init__(self, rate: float = FLOOD_RATE, burst: float = FLOOD_BURST,
+                 max_users: int = FLOOD_MAX_USERS, exempt=ADMIN_IDS):
+        self.rate = rate
+        self.burst = burst
+        self.exempt = frozenset(exempt)
+        # Запись старше burst / rate всё равно означала бы полный bucket
+        self._buckets = TTLStore(max_users, ttl=burst / rate)
+        self._notices = TTLStore(max_users, ttl=NOTICE_INTERVAL)
+        self._in_flight = set()
+
+    @staticmethod
+    def _callback_key(update: Update):
+        query = update.callback_query
+        message_id = query.message.message_id if query.message else query.inline_message_id
+        return query.from_user.id, message_id, query.data
+
+    def _take_token(self, user_id: int, now: float) -> bool:
+        state = self._buckets.get(user_id, now)
+        tokens = self.burst if state is None else min(
+            self.burst, state[0] + (now - state[1]) * self.rate
+        )
+        if tokens < 1:
+            return False
+        self._buckets.set(user_id, (tokens - 1, now), now)
+        return True
+
+    def check(self, update: object) -> Optional[str]:
+        """None — апдейт пропускаем, иначе причина отказа: duplicate или flood."""
+        if not isinstance(update, Update):
+            return None
+        if update.pre_checkout_query or (update.message and update.message.successful_payment):
+            return None
+        user = update.effective_user
+        if user is None or user.id in self.exempt:
+            return None
+
+        key = self._callback_key(update) if update.callback_query else None
+        if key and key in self._in_flight:
+            return "duplicate"
+        if not self._take_token(user.id, time.monotonic()):
+            return "flood"
+        if key:
+            self._in_flight.add(key)
+        return None
+
+    def done(self, update: object):
+        """Вызывается после обработки пропущенного апдейта."""
+        if isinstance(update, Update) and update.callback_query:
+            self._in_flight.discard(self._callback_key(update))
+
+    async def notify(self, update: Update, reason: str):
+        """Предупреждает о флуде ответом на кнопку, не чаще раза в NOTICE_INTERVAL.
+
+        Дубли не отвечаем: «часики» снимет ответ на первое нажатие.
+        """
+        query = update.callback_query
+        if reason != "flood" or query is None:
+            return
+        now = time.monotonic()
+        if self._notices.get(query.from_user.id, now):
+            return
+        self._notices.set(query.from_user.id, True, now)
+        try:
+            await query.answer("⏳ Слишком часто, подождите пару секунд")
+        except TelegramError:
+            pass
@@ -0,0 +1,121 @@
+"""
+Параллельная обработка апдейтов с сохранением порядка для каждого пользователя.
+
+Апдейты разных пользователей обрабатываются одновременно (не больше
+``max_concurrent_updates`` штук), а апдейты одного пользователя — строго
+по очереди. Так медленный send_invoice или запись в базу не задерживает
+остальных, а состояние ConversationHandler не ломается от гонок.
+Если передан FloodGuard, флуд и двойные тапы отбрасываются ещё до очереди
+пользователя. ``preload`` (SQLitePersistence.load) вызывается под блокировкой
+пользователя перед его апдейтом, чтобы состояние диалога успело подгрузиться.
+
+Место из ``max_concurrent_updates`` апдейт занимает только после своей
+очереди пользователя: апдейты, ждущие предыдущего апдейта того же
+пользователя, не держат места и не задерживают остальных.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+from throttling import FloodGuard
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int, flood_guard: FloodGuard = None,
+                 preload: Callable[[object], Awaitable] = None):
+        super().__init__(max_concurrent_updates)
+        self.flood_guard = flood_guard
+        self.preload = preload
+        # Свой семафор вместо семафора BaseUpdateProcessor: его process_update
+        # берёт место до очереди пользователя
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._pending: Dict[int, int] = {}
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def process_update(self, update: object, coroutine: Awaitable) -> None:
+        # В PTB метод помечен @final только для тайпчекера; переопределяем,
+        # чтобы место занималось после блокировки пользователя (см. _slots)
+        await self.do_process_update(update, coroutine)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        if self.flood_guard:
+            reason = self.flood_guard.check(update)
+            if reason:
+                coroutine.close()
+                metrics.UPDATES_DROPPED.labels(reason).inc()
+                await self.flood_guard.notify(update, reason)
+                return
+
+        self._in_flight += 1
+        self._idle.clear()
+        if metrics.REGISTRY.enabled and isinstance(update, Update):
+            # Только новые сообщения: у callback_query effective_message — старое
+            # меню бота, и его date показал бы возраст меню, а не задержку апдейта
+            message = update.message or update.edited_message
+            if message:
+                sent = message.edit_date or message.date
+                metrics.UPDATE_LAG.observe(time.time() - sent.timestamp())
+        key = self._key(update)
+        try:
+            if key is None:
+                async with self._slots:
+                    await coroutine
+                return
+
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = asyncio.Lock()
+            self._pending[key] = self._pending.get(key, 0) + 1
+            try:
+                async with lock, self._slots:
+                    if self.preload:
+                        try:
+                            await self.preload(update)
+                        except BaseException:
+                            coroutine.close()
+                            raise
+                    await coroutine
+            finally:
+                self._pending[key] -= 1
+                if not self._pending[key]:
+                    # Последний апдейт пользователя — освобождаем память
+                    del self._pending[key]
+                    del self._locks[key]
+        finally:
+            if self.flood_guard:
+                self.flood_guard.done(update)
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    async def wait_idle(self):
+        """Дожидается завершения всех апдейтов, которые сейчас в обработке."""
+        await self._idle.wait()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        await self.wait_idle()
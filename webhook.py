@@ -0,0 +1,132 @@
+"""
+Webhook-режим: встроенный aiohttp-приёмник апдейтов вместо run_polling().
+
+Приёмник только проверяет секрет, разбирает JSON и кладёт апдейт в
+``application.update_queue``; обработка идёт параллельно через
+PerUserUpdateProcessor. По SIGINT/SIGTERM сервер перестаёт принимать
+запросы, а Application дорабатывает уже принятые апдейты.
+"""
+
+import asyncio
+import logging
+import signal
+from contextlib import asynccontextmanager
+from http import HTTPStatus
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    def __init__(
+        self,
+        application: Application,
+        listen: str,
+        port: int,
+        path: str,
+        secret_token: str = "",
+    ):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and request.headers.get(SECRET_HEADER) != self.secret_token:
+            return web.Response(status=HTTPStatus.FORBIDDEN)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=HTTPStatus.BAD_REQUEST)
+
+        await self.dispatch(data)
+        return web.Response()
+
+    async def dispatch(self, data: dict):
+        update = Update.de_json(data, self.application.bot)
+        await self.application.update_queue.put(update)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        logger.info("Webhook server listening on %s:%s%s", self.listen, self.port, self.path)
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def serve_webhook(
+    application: Application,
+    url: str,
+    listen: str,
+    port: int,
+    path: str,
+    secret_token: str = "",
+    stop_event: asyncio.Event = None,
+):
+    """Запускает Application в webhook-режиме до ``stop_event`` или сигнала.
+
+    Если ``url`` пустой, вебхук у Telegram не регистрируется (нужно для
+    локальных стендов, которые шлют апдейты напрямую).
+    """
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    server = WebhookServer(application, listen, port, path, secret_token)
+    async with running(application):
+        await server.start()
+        try:
+            if url:
+                await application.bot.set_webhook(
+                    url=url,
+                    secret_token=secret_token or None,
+                    allowed_updates=Update.ALL_TYPES,
+                    max_connections=100,
+                )
+            await stop_event.wait()
+        finally:
+            logger.info("Stopping webhook server, draining in-flight updates...")
+            await server.stop()
+
+
+@asynccontextmanager
+async def running(application: Application):
+    """Запуск и остановка Application со всеми post-хуками, без Updater."""
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        yield application
+    finally:
+        # Дорабатываем уже принятые апдейты, пока Application ещё running
+        await application.update_queue.join()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_webhook(application: Application, **kwargs):
+    asyncio.run(serve_webhook(application, **kwargs))